@@ -0,0 +1,257 @@
+import os
+import io
+import json
+import time
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+from structured import extract_json
+from dotenv import load_dotenv
+
+load_dotenv()
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+# Endpoint of the batch API; point it at batch_server.py to run without spending tokens.
+OPENAI_BATCH_BASE_URL = os.getenv("OPENAI_BATCH_BASE_URL") or os.getenv("OPENAI_API_BASE") or None
+# Requests submitted within this window by any book pipeline go into the same batch.
+BATCH_COLLECT_SECONDS = float(os.getenv("BATCH_COLLECT_SECONDS", 5))
+BATCH_POLL_SECONDS = float(os.getenv("BATCH_POLL_SECONDS", 30))
+# OpenAI accepts up to 50,000 requests per batch file.
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", 50000))
+# Request and result files are kept here for inspection.
+BATCH_DIR = os.getenv("BATCH_DIR", ".cache/batches")
+# Batch clients (one per API key) kept at once, least recently used dropped first.
+BATCH_CLIENTS = int(os.getenv("BATCH_CLIENTS", 32))
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_DONE = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchError(RuntimeError):
+    pass
+
+
+class BatchResult:
+    """
+    Chat completion of one batched request, read like a crew result:
+    `raw`/str() for the text, `json_dict` when a JSON response was requested
+    (None if the text holds no JSON, see nodes.parse_structured), `token_usage`
+    for the usage counts.
+    """
+
+    def __init__(self, body: dict, json_output: bool):
+        message = body["choices"][0]["message"]
+        self.raw = message.get("content") or ""
+        self.json_dict = extract_json(self.raw) if json_output else None
+        self.token_usage = body.get("usage") or {}
+
+    def __getitem__(self, key):
+        return self.json_dict[key]
+
+    def __str__(self):
+        return self.raw
+
+
+class BatchClient:
+    """
+    Collects chat completion requests from concurrent callers and runs them
+    through the OpenAI Batch API: the requests are written to a JSONL file,
+    uploaded, submitted as one batch, polled until done, and every caller's
+    Future is resolved with its own result.
+    """
+
+    def __init__(self, client: "OpenAI", collect_seconds: float = BATCH_COLLECT_SECONDS,
+                 poll_seconds: float = BATCH_POLL_SECONDS, max_requests: int = BATCH_MAX_REQUESTS,
+                 batch_dir: str = BATCH_DIR):
+        self.client = client
+        self.collect_seconds = collect_seconds
+        self.poll_seconds = poll_seconds
+        self.max_requests = max_requests
+        self.batch_dir = batch_dir
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[str, dict, Future]] = []
+        self._timer: Optional[threading.Timer] = None
+
+    def submit(self, body: dict) -> Future:
+        """
+        Queue one request for the next batch.
+        Args:
+                body (dict): Chat completions request body (model, messages, ...).
+        Returns:
+                Future: Resolves to the response body, or raises BatchError.
+        """
+        future = Future()
+        with self._lock:
+            self._pending.append((uuid.uuid4().hex, body, future))
+            if len(self._pending) >= self.max_requests:
+                self._flush_locked()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.collect_seconds, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        return future
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        requests, self._pending = self._pending, []
+        if requests:
+            threading.Thread(target=self._run, args=(requests,), daemon=True).start()
+
+    def _run(self, requests: List[Tuple[str, dict, Future]]) -> None:
+        futures = {custom_id: future for custom_id, _, future in requests}
+        try:
+            results = self.run_batch([(custom_id, body) for custom_id, body, _ in requests])
+            for custom_id, future in futures.items():
+                result = results.get(custom_id, BatchError(f"No result for batch request {custom_id}"))
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        except Exception as e:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(e)
+
+    def run_batch(self, requests: List[Tuple[str, dict]]) -> Dict[str, object]:
+        """
+        Submit one batch and wait for it.
+        Returns:
+                dict: custom_id -> response body, or a BatchError for requests that failed.
+        """
+        lines = [
+            json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}, ensure_ascii=False)
+            for custom_id, body in requests
+        ]
+        payload = ("\n".join(lines) + "\n").encode("utf-8")
+        os.makedirs(self.batch_dir, exist_ok=True)
+        name = f"batch-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        with open(os.path.join(self.batch_dir, f"{name}.jsonl"), "wb") as f:
+            f.write(payload)
+
+        input_file = self.client.files.create(file=(f"{name}.jsonl", io.BytesIO(payload)), purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window="24h",
+            metadata={"source": "bookeditor"},
+        )
+        print(f"BATCH {batch.id}: submitted {len(requests)} requests")
+        while batch.status not in BATCH_DONE:
+            time.sleep(self.poll_seconds)
+            batch = self.client.batches.retrieve(batch.id)
+            counts = batch.request_counts
+            print(f"BATCH {batch.id}: {batch.status} {counts.completed if counts else 0}/{len(requests)}")
+        if batch.status != "completed" and not batch.output_file_id:
+            raise BatchError(f"Batch {batch.id} {batch.status}: {batch.errors}")
+
+        results: Dict[str, object] = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            text = self.client.files.content(file_id).text
+            with open(os.path.join(self.batch_dir, f"{name}.{file_id}.jsonl"), "w", encoding="utf-8") as f:
+                f.write(text)
+            for line in text.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                response = item.get("response") or {}
+                if item.get("error") or response.get("status_code") != 200:
+                    results[item["custom_id"]] = BatchError(f"Batch request failed: {item.get('error') or response.get('body')}")
+                else:
+                    results[item["custom_id"]] = response["body"]
+        return results
+
+
+def chat_request(messages: List[dict], model: str, schema=None, temperature: float = 0, top_p: float = 0.2) -> dict:
+    """
+    Chat completions body for one batched call, with a strict JSON schema
+    response format when `schema` (a pydantic model) is given.
+    """
+    body = {"model": model, "messages": messages, "temperature": temperature, "top_p": top_p}
+    if schema is not None:
+        body["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": schema.__name__, "strict": True, "schema": strict_schema(schema.model_json_schema())},
+        }
+    return body
+
+
+def strict_schema(schema: dict) -> dict:
+    """
+    Inline $defs and mark every object closed with all properties required,
+    the shape structured outputs requires.
+    """
+    defs = schema.get("$defs", {})
+
+    def walk(node):
+        if isinstance(node, dict):
+            if "$ref" in node:
+                return walk(defs[node["$ref"].split("/")[-1]])
+            node = {k: walk(v) for k, v in node.items() if k not in ("$defs", "title", "default")}
+            if node.get("type") == "object":
+                node["additionalProperties"] = False
+                node["required"] = list(node.get("properties", {}))
+            return node
+        if isinstance(node, list):
+            return [walk(v) for v in node]
+        return node
+
+    return walk(schema)
+
+
+def task_request(agent, task, model: str) -> dict:
+    """
+    Chat completions body equivalent to running `task` with `agent` in a one-task crew:
+    the agent's role, backstory and goal as system message, the task and its expected
+    output as user message, and the task's output_json as response schema.
+    """
+    return chat_request(
+        [
+            {"role": "system", "content": f"You are {agent.role}. {agent.backstory}\nYour personal goal is: {agent.goal}"},
+            {"role": "user", "content": f"{task.description}\n\nThis is the expected criteria for your final answer: {task.expected_output}"},
+        ],
+        model=model,
+        schema=task.output_json,
+    )
+
+
+def complete(batch_client: BatchClient, body: dict) -> BatchResult:
+    """
+    Submit one request and block until its batch is done.
+    """
+    return BatchResult(batch_client.submit(body).result(), json_output="response_format" in body)
+
+
+_clients: "OrderedDict[str, BatchClient]" = OrderedDict()
+_clients_lock = threading.Lock()
+
+
+def get_batch_client(api_key: str) -> BatchClient:
+    """
+    Shared BatchClient per API key, so concurrent book pipelines fill the same batches.
+    The last BATCH_CLIENTS are kept, keyed by the key's sha256; a dropped client still
+    finishes the batches it collected.
+    """
+    digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+    with _clients_lock:
+        client = _clients.get(digest)
+        if client is None:
+            from openai import OpenAI
+
+            client = _clients[digest] = BatchClient(OpenAI(api_key=api_key, base_url=OPENAI_BATCH_BASE_URL))
+        _clients.move_to_end(digest)
+        while len(_clients) > BATCH_CLIENTS:
+            _clients.popitem(last=False)
+        return client
@@ -0,0 +1,166 @@
+# Local stand-in for the OpenAI Files and Batch endpoints
+# Run `python batch_server.py` and set OPENAI_BATCH_BASE_URL=http://localhost:8001/v1
+# to exercise engine "batch" without spending tokens.
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.responses import PlainTextResponse
+import uvicorn
+import os
+import json
+import time
+import uuid
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PORT = int(os.getenv("BATCH_STANDIN_PORT", 8001))
+# Seconds a batch stays in_progress before its results are available.
+BATCH_STANDIN_DELAY = float(os.getenv("BATCH_STANDIN_DELAY", 1))
+# Requests whose body contains this text fail (in the batch's error file), to exercise
+# failed and resumed runs.
+BATCH_STANDIN_FAIL_TEXT = os.getenv("BATCH_STANDIN_FAIL_TEXT", "")
+
+app = FastAPI()
+
+files = {}
+batches = {}
+lock = threading.Lock()
+
+
+def fake_value(schema: dict, name: str = "value"):
+    """
+    Deterministic value matching a JSON schema, so structured outputs parse.
+    """
+    kind = schema.get("type")
+    if kind == "object":
+        return {key: fake_value(sub, key) for key, sub in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [fake_value(schema.get("items", {}), name)]
+    if kind in ("integer", "number"):
+        return 0
+    if kind == "boolean":
+        return False
+    return f"Stand-in {name}."
+
+
+def fake_completion(body: dict) -> dict:
+    messages = body.get("messages", [])
+    prompt = "\n".join(str(m.get("content", "")) for m in messages)
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        content = json.dumps(fake_value(response_format["json_schema"]["schema"]))
+    else:
+        content = f"Stand-in completion of: {prompt[-200:]}"
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        # Rough 4 characters per token.
+        "usage": {
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": (len(prompt) + len(content)) // 4,
+        },
+    }
+
+
+def store_file(content: bytes, filename: str, purpose: str) -> dict:
+    file_id = f"file-{uuid.uuid4().hex}"
+    meta = {
+        "id": file_id,
+        "object": "file",
+        "bytes": len(content),
+        "created_at": int(time.time()),
+        "filename": filename,
+        "purpose": purpose,
+        "status": "processed",
+    }
+    with lock:
+        files[file_id] = {"meta": meta, "content": content}
+    return meta
+
+
+def run_batch(batch_id: str) -> None:
+    with lock:
+        batch = batches[batch_id]
+        lines = files[batch["input_file_id"]]["content"].decode("utf-8").splitlines()
+    results, errors = [], []
+    for line in lines:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        if BATCH_STANDIN_FAIL_TEXT and BATCH_STANDIN_FAIL_TEXT in line:
+            errors.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 500, "request_id": uuid.uuid4().hex, "body": {"error": {"message": "Stand-in failure."}}},
+                "error": None,
+            }))
+            continue
+        results.append(json.dumps({
+            "id": f"batch_req_{uuid.uuid4().hex}",
+            "custom_id": request["custom_id"],
+            "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": fake_completion(request["body"])},
+            "error": None,
+        }))
+    output = store_file(("\n".join(results) + "\n").encode("utf-8"), f"{batch_id}_output.jsonl", "batch_output")
+    error = store_file(("\n".join(errors) + "\n").encode("utf-8"), f"{batch_id}_error.jsonl", "batch_output") if errors else None
+    with lock:
+        batch.update(
+            status="completed",
+            output_file_id=output["id"],
+            error_file_id=error["id"] if error else None,
+            completed_at=int(time.time()),
+            request_counts={"total": len(results) + len(errors), "completed": len(results), "failed": len(errors)},
+        )
+
+
+@app.post("/v1/files")
+async def create_file(file: UploadFile = File(...), purpose: str = Form(...)):
+    return store_file(await file.read(), file.filename, purpose)
+
+
+@app.get("/v1/files/{file_id}/content")
+async def file_content(file_id: str):
+    if file_id not in files:
+        raise HTTPException(status_code=404, detail="File not found")
+    return PlainTextResponse(files[file_id]["content"].decode("utf-8"))
+
+
+@app.post("/v1/batches")
+async def create_batch(payload: dict):
+    if payload.get("input_file_id") not in files:
+        raise HTTPException(status_code=400, detail="Unknown input_file_id")
+    batch_id = f"batch_{uuid.uuid4().hex}"
+    batch = {
+        "id": batch_id,
+        "object": "batch",
+        "endpoint": payload["endpoint"],
+        "input_file_id": payload["input_file_id"],
+        "completion_window": payload.get("completion_window", "24h"),
+        "metadata": payload.get("metadata"),
+        "status": "in_progress",
+        "created_at": int(time.time()),
+        "output_file_id": None,
+        "error_file_id": None,
+        "errors": None,
+        "request_counts": {"total": 0, "completed": 0, "failed": 0},
+    }
+    with lock:
+        batches[batch_id] = batch
+    threading.Timer(BATCH_STANDIN_DELAY, run_batch, args=(batch_id,)).start()
+    return batch
+
+
+@app.get("/v1/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    with lock:
+        if batch_id not in batches:
+            raise HTTPException(status_code=404, detail="Batch not found")
+        return dict(batches[batch_id])
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=PORT)
@@ -0,0 +1,160 @@
+# Pipeline benchmark on the fake LLM and sheet of fakes.py, no tokens spent.
+# Example:
+#   python benchmark.py --chapters 20 100 --r-chapters 3 5 --max-docs 3 10 --concurrency 4 16
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import contextlib
+import itertools
+import resource
+import tempfile
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime
+
+parser = argparse.ArgumentParser(description="Benchmark the book graph end to end against fake backends.")
+parser.add_argument("--chapters", type=int, nargs="+", default=[20], help="catalog sizes")
+parser.add_argument("--r-chapters", type=int, nargs="+", default=[3], help="chapters per book")
+parser.add_argument("--max-docs", type=int, nargs="+", default=[3], help="books per run")
+parser.add_argument("--max-overlap", type=int, default=1)
+parser.add_argument("--concurrency", type=int, nargs="+", default=[4], help="max_concurrency values")
+parser.add_argument("--engine", nargs="+", default=["crew"], help="expansion engines")
+parser.add_argument("--selection", default="overlap", help='"overlap" or "diverse"')
+parser.add_argument("--expansion", default="chapter", help='"chapter" or "longform"')
+parser.add_argument("--latency", type=float, default=0.05, help="fake LLM latency per call, seconds")
+parser.add_argument("--output-tokens", type=int, default=300, help="fake LLM output size, words")
+parser.add_argument("--warm-cache", action="store_true", help="keep the expansion cache between runs")
+parser.add_argument("--json", help="also write the report to this file")
+parser.add_argument("--no-warmup", action="store_true", help="measure the first run too, including one-time setup")
+parser.add_argument("--verbose", action="store_true", help="keep the nodes' own output")
+args = parser.parse_args()
+
+# Fakes and throwaway stores have to be configured before the graph modules are imported.
+workdir = tempfile.mkdtemp(prefix="bookeditor-bench-")
+os.environ.update(
+    LLM_BACKEND="fake",
+    FAKE_LLM_LATENCY=str(args.latency),
+    FAKE_LLM_OUTPUT_TOKENS=str(args.output_tokens),
+    CHECKPOINT_DB=os.path.join(workdir, "checkpoints.sqlite"),
+    EXPANSION_CACHE_PATH=os.path.join(workdir, "expansions.sqlite"),
+    BATCH_DIR=os.path.join(workdir, "batches"),
+    OUTPUT_DIR=os.path.join(workdir, "output"),
+    BLOB_DIR=os.path.join(workdir, "blobs"),
+    EMBEDDING_DIR=os.path.join(workdir, "embeddings"),
+)
+os.environ.setdefault("OTEL_SDK_DISABLED", "true")
+os.environ.setdefault("CREWAI_DISABLE_TELEMETRY", "true")
+
+from graph import graph
+from cache import get_expansion_cache
+
+
+def run_once(chapters: int, r_chapters: int, max_docs: int, concurrency: int, engine: str) -> dict:
+    """
+    Run the compiled graph once and measure it.
+    Returns:
+            dict: The settings, wall time, per-node wall time, peak memory and books per hour.
+    """
+    if not args.warm_cache:
+        get_expansion_cache().clear()
+    config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+    input = {
+        "messages": [("human", "Generate Book from given chapters.")],
+        "gpt_prompt": "Generate Book from given chapters.",
+        "sheet_id": f"fake:{chapters}",
+        "r_chapters": r_chapters,
+        "max_docs": max_docs,
+        "max_overlap": args.max_overlap,
+        "max_concurrency": concurrency,
+        "engine": engine,
+        "expansion": args.expansion,
+        "selection": args.selection,
+        "output_lang": "en",
+        "mode": "permutation",
+        "seed": 0,
+    }
+    started = {}
+    nodes = defaultdict(lambda: {"calls": 0, "seconds": 0.0})
+
+    checkpoint_bytes = os.path.getsize(os.environ["CHECKPOINT_DB"]) if os.path.exists(os.environ["CHECKPOINT_DB"]) else 0
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    # Debug events carry a timestamp for every task start and result, subgraph tasks included.
+    for _, event in graph.stream(input, config, stream_mode="debug", subgraphs=True):
+        if event["type"] not in ("task", "task_result"):
+            continue
+        task_id = event["payload"]["id"]
+        at = datetime.fromisoformat(event["timestamp"]).timestamp()
+        if event["type"] == "task":
+            started[task_id] = at
+        elif task_id in started:
+            node = nodes[event["payload"]["name"]]
+            node["calls"] += 1
+            node["seconds"] += at - started.pop(task_id)
+    wall = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    values = graph.get_state(config).values
+    books = len(values.get("books_written", [])) + len(values.get("books_generated", []))
+    return {
+        "chapters": chapters,
+        "r_chapters": r_chapters,
+        "max_docs": max_docs,
+        "concurrency": concurrency,
+        "engine": engine,
+        "books": books,
+        "wall_seconds": round(wall, 3),
+        "books_per_hour": round(books / wall * 3600, 1) if wall else None,
+        "peak_memory_mb": round(peak / 2 ** 20, 2),
+        # Growth of the checkpoint database during the run.
+        "checkpoint_mb": round((os.path.getsize(os.environ["CHECKPOINT_DB"]) - checkpoint_bytes) / 2 ** 20, 2),
+        "nodes": {name: {"calls": n["calls"], "seconds": round(n["seconds"], 3)} for name, n in nodes.items()},
+    }
+
+
+def main():
+    results = []
+    if not args.no_warmup:
+        # One small run first, so imports, tokenizer loading and the like do not count against the first setting.
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            run_once(max(args.r_chapters[0] + 1, 4), args.r_chapters[0], 1, args.concurrency[0], args.engine[0])
+    for chapters, r_chapters, max_docs, concurrency, engine in itertools.product(
+        args.chapters, args.r_chapters, args.max_docs, args.concurrency, args.engine
+    ):
+        label = f"chapters={chapters} r={r_chapters} docs={max_docs} concurrency={concurrency} engine={engine}"
+        try:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+                result = run_once(chapters, r_chapters, max_docs, concurrency, engine)
+        except (ValueError, RuntimeError) as e:
+            # More books requested than the overlap limit allows for this catalog.
+            print(f"SKIPPED {label}: {e}")
+            continue
+        results.append(result)
+        print(
+            f"{label}: {result['books']} books in {result['wall_seconds']}s, "
+            f"{result['books_per_hour']} books/h, peak {result['peak_memory_mb']} MB, "
+            f"checkpoints +{result['checkpoint_mb']} MB"
+        )
+        for name, node in sorted(result["nodes"].items(), key=lambda kv: -kv[1]["seconds"]):
+            print(f"    {name:<24}{node['calls']:>5} x  {node['seconds']:>9.3f}s")
+
+    report = {
+        "latency": args.latency,
+        "output_tokens": args.output_tokens,
+        # ru_maxrss is in KB on Linux
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "runs": results,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json}")
+    return 0 if results else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+import os
+import re
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional, Set, Union
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Chapter and book texts are stored here once, named by their sha256.
+BLOB_DIR = os.getenv("BLOB_DIR", ".cache/blobs")
+# Texts shorter than this stay inline in the state, a reference would not save anything.
+BLOB_MIN_CHARS = int(os.getenv("BLOB_MIN_CHARS", 512))
+# Recently read texts kept decoded in memory.
+BLOB_CACHE_ENTRIES = int(os.getenv("BLOB_CACHE_ENTRIES", 256))
+# A blob nothing refers to is only deleted once it has not been stored or read for this
+# long, running books may hold references that are not checkpointed yet.
+BLOB_GRACE_SECONDS = float(os.getenv("BLOB_GRACE_SECONDS", 24 * 3600))
+
+BLOB_PREFIX = "blob:sha256:"
+BLOB_REF = re.compile(r"blob:sha256:[0-9a-f]{64}")
+BLOB_REF_BYTES = re.compile(BLOB_REF.pattern.encode("ascii"))
+
+
+def atomic_write(path: str, data: bytes) -> str:
+    """
+    Write `data` to `path` through a temporary file in the same directory and a
+    rename, so readers see either the previous file or the complete new one.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return path
+
+
+def is_ref(value) -> bool:
+    return isinstance(value, str) and value.startswith(BLOB_PREFIX)
+
+
+def refs_in(data: Union[str, bytes, None]) -> Set[str]:
+    """
+    Every blob reference found in `data`: JSON text, or serialized checkpoints, whose
+    msgpack strings hold the references as they are.
+    """
+    if not data:
+        return set()
+    if isinstance(data, bytes):
+        return {ref.decode("ascii") for ref in BLOB_REF_BYTES.findall(data)}
+    return set(BLOB_REF.findall(data))
+
+
+class BlobStore:
+    """
+    Content-addressed store of texts on the local filesystem: put() returns a short
+    "blob:sha256:<hex>" reference, get() reads the text back. The same text is
+    stored once, however many chapters, books or runs refer to it, and blobs are
+    never modified, so references stay valid across processes and resumed runs.
+    Blobs are only deleted by sweep(), once nothing refers to them any more
+    (see checkpoint.sweep_blobs).
+    """
+
+    def __init__(self, directory: str = BLOB_DIR, cache_entries: int = BLOB_CACHE_ENTRIES):
+        self.directory = directory
+        self.cache_entries = cache_entries
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def path(self, ref: str) -> str:
+        digest = ref[len(BLOB_PREFIX):]
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def put(self, text: str) -> str:
+        data = text.encode("utf-8")
+        ref = BLOB_PREFIX + hashlib.sha256(data).hexdigest()
+        path = self.path(ref)
+        if os.path.exists(path):
+            self.touch(ref)
+        else:
+            atomic_write(path, data)
+        self._remember(ref, text)
+        return ref
+
+    def get(self, ref: str) -> str:
+        with self._lock:
+            text = self._cache.get(ref)
+            if text is not None:
+                self._cache.move_to_end(ref)
+                return text
+        try:
+            with open(self.path(ref), "rb") as f:
+                text = f.read().decode("utf-8")
+        except FileNotFoundError:
+            raise KeyError(f"Blob {ref} not found in {self.directory}") from None
+        self._remember(ref, text)
+        return text
+
+    def exists(self, ref: str) -> bool:
+        return os.path.exists(self.path(ref))
+
+    def size(self, ref: str) -> int:
+        try:
+            return os.path.getsize(self.path(ref))
+        except FileNotFoundError:
+            return 0
+
+    def touch(self, ref: str) -> None:
+        # The modification time tells how recently a blob was stored or used.
+        try:
+            os.utime(self.path(ref))
+        except FileNotFoundError:
+            pass
+
+    def delete(self, ref: str, min_age: float = 0) -> bool:
+        """
+        Remove the blob of `ref`, unless it was stored or used less than `min_age` seconds ago.
+        Returns:
+                bool: False if it was kept for being too recent, True if it is gone.
+        """
+        path = self.path(ref)
+        try:
+            if time.time() - os.path.getmtime(path) < min_age:
+                return False
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._cache.pop(ref, None)
+        return True
+
+    def refs(self) -> Iterable[str]:
+        """References of every stored blob."""
+        for prefix in os.listdir(self.directory) if os.path.isdir(self.directory) else []:
+            if len(prefix) != 2:
+                continue
+            for name in os.listdir(os.path.join(self.directory, prefix)):
+                if name.startswith(prefix) and not name.endswith(".tmp"):
+                    yield BLOB_PREFIX + name
+
+    def sweep(self, live: Set[str], min_age: float = BLOB_GRACE_SECONDS) -> dict:
+        """
+        Delete every blob not in `live` that was not stored or used for `min_age` seconds.
+        Returns:
+                dict: Blobs kept and deleted, and the bytes freed.
+        """
+        kept = deleted = freed = 0
+        for ref in list(self.refs()):
+            if ref in live:
+                kept += 1
+                continue
+            size = self.size(ref)
+            if self.delete(ref, min_age=min_age):
+                deleted += 1
+                freed += size
+            else:
+                kept += 1
+        return {"kept": kept, "deleted": deleted, "bytes_freed": freed}
+
+    def _remember(self, ref: str, text: str) -> None:
+        with self._lock:
+            self._cache[ref] = text
+            self._cache.move_to_end(ref)
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+
+
+_blob_store: Optional[BlobStore] = None
+_blob_store_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    """
+    Process-wide blob store, created on first use.
+    """
+    global _blob_store
+    with _blob_store_lock:
+        if _blob_store is None:
+            _blob_store = BlobStore()
+        return _blob_store
+
+
+def store_text(value: str) -> str:
+    """
+    Reference to `value` in the blob store, or `value` itself if it is short or already a reference.
+    """
+    if is_ref(value) or len(value) < BLOB_MIN_CHARS:
+        return value
+    return get_blob_store().put(value)
+
+
+def resolve(value: Optional[str]) -> Optional[str]:
+    """
+    Text behind a value written by store_text: read from the blob store if it is a reference.
+    """
+    return get_blob_store().get(value) if is_ref(value) else value
+
+
+def available(value: Optional[str]) -> bool:
+    """
+    False if `value` is a reference to a blob that is no longer on disk.
+    """
+    return not is_ref(value) or get_blob_store().exists(value)
@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import List, Optional, Set
+from dotenv import load_dotenv
+from blobs import get_blob_store, is_ref, refs_in
+
+load_dotenv()
+
+EXPANSION_CACHE_PATH = os.getenv("EXPANSION_CACHE_PATH", ".cache/expansions.sqlite")
+# Upper bound on the stored size, entries plus the blobs they refer to, before least recently used entries are evicted.
+EXPANSION_CACHE_MAX_BYTES = int(os.getenv("EXPANSION_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+
+def cache_key(*parts) -> str:
+    """
+    Content-addressed key for a cached LLM output.
+    Args:
+            parts: Everything the output depends on (chapter title and content, prompt template, model, ...).
+    Returns:
+            str: sha256 hex digest of the JSON-encoded parts.
+    """
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ExpansionCache:
+    """
+    Persistent, size-bounded LRU cache of expanded chapters backed by SQLite.
+    Safe to share between the threads of the expansion pool.
+    Entries hold blob references (see blobs.store_text). An entry's size includes
+    its blobs; the blobs of evicted entries are deleted by the blob sweep once
+    nothing else refers to them (see checkpoint.sweep_blobs).
+    """
+
+    def __init__(self, path: str = EXPANSION_CACHE_PATH, max_bytes: int = EXPANSION_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS expansions ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS expansions_lru ON expansions(last_access)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM expansions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE expansions SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        value = json.loads(row[0])
+        store = get_blob_store()
+        for ref in refs_of(value):
+            store.touch(ref)
+        return value
+
+    def set(self, key: str, value: dict) -> None:
+        payload = json.dumps(value, ensure_ascii=False)
+        refs = refs_of(value)
+        # A blob shared by several entries counts for each of them, which errs on the small side.
+        size = len(payload.encode("utf-8")) + sum(get_blob_store().size(ref) for ref in refs)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO expansions (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, payload, size, time.time()),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        # Drop least recently used entries until the store fits in max_bytes again.
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM expansions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM expansions ORDER BY last_access ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM expansions WHERE key = ?", (key,))
+            total -= size
+
+    def refs(self) -> Set[str]:
+        """Blob references of every entry, for the blob sweep."""
+        with self._lock:
+            rows = self._conn.execute("SELECT value FROM expansions").fetchall()
+        return set().union(*(refs_in(value) for value, in rows))
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM expansions"
+            ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM expansions")
+            self._conn.commit()
+
+
+def refs_of(value: dict) -> List[str]:
+    return sorted({v for v in value.values() if is_ref(v)})
+
+
+_expansion_cache: Optional[ExpansionCache] = None
+_expansion_cache_lock = threading.Lock()
+
+
+def get_expansion_cache() -> ExpansionCache:
+    """
+    Process-wide expansion cache, opened on first use.
+    """
+    global _expansion_cache
+    with _expansion_cache_lock:
+        if _expansion_cache is None:
+            _expansion_cache = ExpansionCache()
+        return _expansion_cache
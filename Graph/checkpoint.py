@@ -0,0 +1,275 @@
+import os
+import json
+import asyncio
+import sqlite3
+import time
+import threading
+from typing import List, Optional, Set
+from langgraph.checkpoint.sqlite import SqliteSaver
+from dotenv import load_dotenv
+from blobs import BLOB_GRACE_SECONDS, get_blob_store, refs_in
+
+load_dotenv()
+
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", ".cache/checkpoints.sqlite")
+# Unreferenced blobs are swept after a run at most this often (across processes).
+BLOB_SWEEP_INTERVAL_SECONDS = float(os.getenv("BLOB_SWEEP_INTERVAL_SECONDS", 3600))
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    if path != ":memory:":
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return sqlite3.connect(path, check_same_thread=False)
+
+
+class LazyConnection:
+    """
+    SQLite connection to `path`, opened on first use (with `schema` run on it), so
+    importing the graph neither creates the database nor its directory.
+    """
+
+    def __init__(self, path: str, schema: str = ""):
+        self.path = path
+        self.schema = schema
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._conn is None:
+                conn = _connect(self.path)
+                if self.schema:
+                    conn.executescript(self.schema)
+                    conn.commit()
+                self._conn = conn
+            return self._conn
+
+
+class DurableSqliteSaver(SqliteSaver):
+    """
+    SqliteSaver that also serves graph.astream / graph.ainvoke by running the
+    synchronous SQLite calls on a worker thread. The database is opened on first use.
+    """
+
+    def __init__(self, path: str = CHECKPOINT_DB, *, serde=None):
+        self._db = LazyConnection(path)
+        super().__init__(None, serde=serde)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        return self._db.get()
+
+    @conn.setter
+    def conn(self, conn: Optional[sqlite3.Connection]) -> None:
+        # SqliteSaver.__init__ sets the connection it is given; None leaves it to be opened on first use.
+        if conn is not None:
+            self._db._conn = conn
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        return await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def refs(self) -> Set[str]:
+        """Blob references held by any checkpoint or pending write, of every thread."""
+        refs = set()
+        for table, column in (("checkpoints", "checkpoint"), ("writes", "value")):
+            # In chunks, so the runs writing checkpoints meanwhile are not held up for the whole scan.
+            last = 0
+            while True:
+                with self.cursor(transaction=False) as cur:
+                    rows = cur.execute(
+                        f"SELECT rowid, {column} FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT 500", (last,)
+                    ).fetchall()
+                if not rows:
+                    break
+                last = rows[-1][0]
+                for _, data in rows:
+                    refs |= refs_in(data)
+        return refs
+
+
+class ChapterJournal:
+    """
+    Per-thread record of finished chapter expansions.
+    Graph checkpoints are only written between nodes, the journal keeps the work
+    done inside generate_book so a resumed run skips chapters that already finished.
+    """
+
+    def __init__(self, path: str = CHECKPOINT_DB):
+        self._db = LazyConnection(
+            path,
+            "CREATE TABLE IF NOT EXISTS chapter_journal ("
+            " thread_id TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " PRIMARY KEY (thread_id, key));",
+        )
+        self._lock = threading.Lock()
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        return self._db.get()
+
+    def get(self, thread_id: str, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM chapter_journal WHERE thread_id = ? AND key = ?", (thread_id, key)
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def record(self, thread_id: str, key: str, value: dict) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO chapter_journal (thread_id, key, value) VALUES (?, ?, ?)",
+                (thread_id, key, json.dumps(value, ensure_ascii=False)),
+            )
+            self._conn.commit()
+
+    def count(self, thread_id: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM chapter_journal WHERE thread_id = ?", (thread_id,)
+            ).fetchone()[0]
+
+    def refs(self) -> Set[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT value FROM chapter_journal").fetchall()
+        return set().union(*(refs_in(value) for value, in rows))
+
+
+class BuildLog:
+    """
+    What every run of a build produced, for incremental rebuilds. A build is a
+    series of runs over the same source with the same book settings (see
+    nodes.build_key). Per run it keeps the fingerprint of every source row and
+    the rows of every book (the chapter -> book dependency map), and per finished
+    book what it produced. A delta run compares the rows with the latest earlier
+    run of its build and only rebuilds the books holding a changed row.
+    """
+
+    def __init__(self, path: str = CHECKPOINT_DB):
+        self._db = LazyConnection(
+            path,
+            "CREATE TABLE IF NOT EXISTS build_runs ("
+            " build TEXT NOT NULL,"
+            " thread_id TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " plan TEXT NOT NULL,"
+            " PRIMARY KEY (build, thread_id));"
+            "CREATE TABLE IF NOT EXISTS build_books ("
+            " build TEXT NOT NULL,"
+            " thread_id TEXT NOT NULL,"
+            " book_index INTEGER NOT NULL,"
+            " result TEXT NOT NULL,"
+            " PRIMARY KEY (build, thread_id, book_index));",
+        )
+        self._lock = threading.Lock()
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        return self._db.get()
+
+    def start(self, build: str, thread_id: str, rows: List[str], books: List[List[int]]) -> None:
+        """
+        Record the plan of a run: the fingerprint of every row, and the rows of every book.
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO build_runs (build, thread_id, created, plan) VALUES (?, ?, ?, ?)",
+                (build, thread_id, time.time(), json.dumps({"rows": rows, "books": books})),
+            )
+            self._conn.execute("DELETE FROM build_books WHERE build = ? AND thread_id = ?", (build, thread_id))
+            self._conn.commit()
+
+    def finish_book(self, build: str, thread_id: str, book_index: int, result: dict) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO build_books (build, thread_id, book_index, result) VALUES (?, ?, ?, ?)",
+                (build, thread_id, book_index, json.dumps(result, ensure_ascii=False)),
+            )
+            self._conn.commit()
+
+    def latest(self, build: str) -> Optional[dict]:
+        """
+        The latest run of `build`.
+        Returns:
+                dict: thread_id, rows, books, and results (book_index -> result) of its finished books.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT thread_id, plan FROM build_runs WHERE build = ? ORDER BY created DESC LIMIT 1", (build,)
+            ).fetchone()
+            if row is None:
+                return None
+            results = self._conn.execute(
+                "SELECT book_index, result FROM build_books WHERE build = ? AND thread_id = ?", (build, row[0])
+            ).fetchall()
+        return {"thread_id": row[0], **json.loads(row[1]), "results": {i: json.loads(r) for i, r in results}}
+
+    def refs(self) -> Set[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT result FROM build_books").fetchall()
+        return set().union(*(refs_in(result) for result, in rows))
+
+
+# Graph checkpoints, the chapter journal and the build log live in the same database
+# file, each on its own connection so their transactions never interleave.
+checkpointer = DurableSqliteSaver(CHECKPOINT_DB)
+chapter_journal = ChapterJournal(CHECKPOINT_DB)
+build_log = BuildLog(CHECKPOINT_DB)
+
+
+_sweep_lock = threading.Lock()
+
+
+def sweep_blobs(min_age: float = BLOB_GRACE_SECONDS) -> dict:
+    """
+    Mark and sweep the blob store: every blob referred to by a checkpoint, the chapter
+    journal, the build log or the expansion cache is kept, the others are deleted once
+    they have not been stored or read for `min_age` seconds.
+    Returns:
+            dict: Blobs kept and deleted, and the bytes freed.
+    """
+    from cache import get_expansion_cache
+
+    with _sweep_lock:
+        live = checkpointer.refs() | chapter_journal.refs() | build_log.refs() | get_expansion_cache().refs()
+        return get_blob_store().sweep(live, min_age=min_age)
+
+
+def maybe_sweep_blobs(interval: float = BLOB_SWEEP_INTERVAL_SECONDS) -> Optional[dict]:
+    """
+    sweep_blobs(), unless a sweep of the same blob directory ran less than `interval`
+    seconds ago. Called when a run finishes; a failed sweep is reported, not raised.
+    """
+    marker = os.path.join(get_blob_store().directory, ".last_sweep")
+    try:
+        if time.time() - os.path.getmtime(marker) < interval:
+            return None
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(marker), exist_ok=True)
+    with open(marker, "a"):
+        os.utime(marker)
+    try:
+        result = sweep_blobs()
+    except (OSError, sqlite3.Error) as e:
+        print(f"BLOBS:::sweep failed: {e}")
+        return None
+    print(f"BLOBS:::swept {result['deleted']} unreferenced blob(s), {result['bytes_freed']} bytes freed, {result['kept']} kept")
+    return result
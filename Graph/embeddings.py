@@ -0,0 +1,190 @@
+import io
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Sequence
+from blobs import atomic_write
+from llms import LLM_BACKEND, OPENAI_API_BASE, OPENAI_API_KEYS
+from dotenv import load_dotenv
+
+load_dotenv()
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# "openai" or "fake" (fakes.fake_embeddings, offline and deterministic); follows LLM_BACKEND by default.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "fake" if LLM_BACKEND == "fake" else "openai")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+# Longer texts are cut to this many tokens before they are embedded (the model's input limit).
+EMBEDDING_MAX_TOKENS = int(os.getenv("EMBEDDING_MAX_TOKENS", 8000))
+# Texts sent per embeddings request.
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 256))
+# One .npz matrix per backend and model, rows keyed by the sha256 of the embedded text.
+EMBEDDING_DIR = os.getenv("EMBEDDING_DIR", ".cache/embeddings")
+# Embedding clients (one per API key and model) kept at once, least recently used dropped first.
+EMBEDDING_CLIENTS = int(os.getenv("EMBEDDING_CLIENTS", 32))
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def normalize(vectors: "np.ndarray") -> "np.ndarray":
+    """
+    Rows scaled to unit length (zero rows stay zero), so dot products are cosine similarities.
+    """
+    import numpy as np
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.where(norms == 0, 1, norms)).astype(np.float32)
+
+
+def cosine_similarity(a: "np.ndarray", b: Optional["np.ndarray"] = None) -> "np.ndarray":
+    """
+    Cosine similarity of every row of `a` with every row of `b` (of `a` itself if
+    None) as one matrix product. Rows must be normalized, as EmbeddingIndex returns them.
+    Returns:
+            np.ndarray: len(a) x len(b) matrix.
+    """
+    return a @ (a if b is None else b).T
+
+
+class EmbeddingIndex:
+    """
+    Embeddings of chapter texts, kept as one float32 matrix per model in
+    EMBEDDING_DIR with the sha256 of every embedded text as its row key. embed()
+    only sends texts it has not seen before to the embedding function, in
+    batches, then appends their rows and rewrites the file, so a catalog is
+    embedded once however many runs draw books from it.
+    """
+
+    def __init__(self, name: str, directory: str = EMBEDDING_DIR, batch_size: int = EMBEDDING_BATCH_SIZE):
+        self.path = os.path.join(directory, f"{name}.npz")
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._rows: Optional[Dict[str, int]] = None
+        self._vectors: Optional["np.ndarray"] = None
+        self.stats = {"hits": 0, "misses": 0}
+
+    def _load(self) -> None:
+        import numpy as np
+
+        if self._rows is not None:
+            return
+        try:
+            with np.load(self.path) as data:
+                keys, self._vectors = data["keys"], data["vectors"]
+        except FileNotFoundError:
+            keys, self._vectors = np.array([], dtype="U64"), None
+        self._rows = {str(key): i for i, key in enumerate(keys)}
+
+    def _save(self) -> None:
+        import numpy as np
+
+        keys = np.array(sorted(self._rows, key=self._rows.__getitem__), dtype="U64")
+        buffer = io.BytesIO()
+        np.savez(buffer, keys=keys, vectors=self._vectors)
+        atomic_write(self.path, buffer.getvalue())
+
+    def embed(self, texts: Sequence[str], embed_fn: Callable[[List[str]], "np.ndarray"]) -> "np.ndarray":
+        """
+        Normalized embeddings of `texts`, from the index where it has them.
+        Args:
+                texts (list): Texts to embed.
+                embed_fn (callable): Embeds a batch of the texts the index does not have yet.
+        Returns:
+                np.ndarray: float32 matrix, one unit-length row per text, in order.
+        """
+        import numpy as np
+
+        keys = [text_hash(text) for text in texts]
+        with self._lock:
+            self._load()
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in self._rows and key not in missing:
+                    missing[key] = text
+            self.stats["hits"] += len(keys) - len(missing)
+            self.stats["misses"] += len(missing)
+            if missing:
+                pending = list(missing)
+                new = normalize(np.concatenate([
+                    np.asarray(embed_fn([missing[key] for key in pending[i:i + self.batch_size]]), dtype=np.float32)
+                    for i in range(0, len(pending), self.batch_size)
+                ]))
+                start = len(self._rows)
+                self._vectors = new if self._vectors is None else np.concatenate([self._vectors, new])
+                self._rows.update({key: start + i for i, key in enumerate(pending)})
+                self._save()
+            return self._vectors[[self._rows[key] for key in keys]]
+
+
+_embedders: "OrderedDict[str, Callable[[List[str]], List[List[float]]]]" = OrderedDict()
+_embedders_lock = threading.Lock()
+
+
+def openai_embeddings(api_key: str, model: str = EMBEDDING_MODEL) -> Callable[[List[str]], List[List[float]]]:
+    """
+    Embedding function calling the OpenAI embeddings endpoint, one request per batch.
+    The last EMBEDDING_CLIENTS are kept, keyed by the sha256 of the key, and reused.
+    """
+    digest = text_hash(f"{model}\n{api_key}")
+    with _embedders_lock:
+        embed = _embedders.get(digest)
+        if embed is None:
+            embed = _embedders[digest] = _openai_embeddings(api_key, model)
+        _embedders.move_to_end(digest)
+        while len(_embedders) > EMBEDDING_CLIENTS:
+            _embedders.popitem(last=False)
+        return embed
+
+
+def _openai_embeddings(api_key: str, model: str) -> Callable[[List[str]], List[List[float]]]:
+    from openai import OpenAI
+    from tokens import truncate_tokens
+
+    client = OpenAI(api_key=api_key, base_url=OPENAI_API_BASE)
+
+    def embed(texts: List[str]) -> List[List[float]]:
+        response = client.embeddings.create(model=model, input=[truncate_tokens(text, EMBEDDING_MAX_TOKENS, model) for text in texts])
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    return embed
+
+
+_index: Optional[EmbeddingIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_embedding_index() -> EmbeddingIndex:
+    """
+    Process-wide EmbeddingIndex of EMBEDDING_BACKEND (and EMBEDDING_MODEL).
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = EmbeddingIndex("fake" if EMBEDDING_BACKEND == "fake" else f"{EMBEDDING_BACKEND}-{EMBEDDING_MODEL}")
+        return _index
+
+
+def embed_texts(texts: Sequence[str], api_key: Optional[str] = None) -> "np.ndarray":
+    """
+    Normalized embeddings of `texts` through the shared index. With the OpenAI
+    backend, texts the index does not have are embedded with `api_key` (a run's
+    own key) or the first key of the pool.
+    Returns:
+            np.ndarray: float32 matrix, one unit-length row per text.
+    """
+    if EMBEDDING_BACKEND == "fake":
+        from fakes import fake_embeddings
+
+        embed_fn = fake_embeddings
+    elif EMBEDDING_BACKEND == "openai":
+        key = api_key or (OPENAI_API_KEYS[0] if OPENAI_API_KEYS else None)
+        if not key:
+            raise ValueError("selection 'diverse' needs openai_api_key or OPENAI_API_KEY(S) for embeddings")
+        embed_fn = openai_embeddings(key)
+    else:
+        raise ValueError(f"Unknown EMBEDDING_BACKEND {EMBEDDING_BACKEND!r}, expected 'openai' or 'fake'")
+    return get_embedding_index().embed(texts, embed_fn)
@@ -0,0 +1,22 @@
+from typing import Callable
+
+
+def emit(writer: Callable[[dict], None], event: str, **data) -> None:
+    """
+    Send one progress event on the graph's custom stream,
+    e.g. emit(writer, "chapter_expanded", chapter_title=...).
+    `writer` is the StreamWriter LangGraph injects into the node; it is a no-op
+    unless the graph is streamed with stream_mode "custom", and is safe to call
+    from the node's worker threads.
+    """
+    writer({"event": event, **data})
+
+
+def token_usage(crew_output) -> dict:
+    """
+    Token counts of a crew kickoff or batch result, empty if none were reported.
+    """
+    usage = getattr(crew_output, "token_usage", None)
+    if usage is None:
+        return {}
+    return usage if isinstance(usage, dict) else usage.model_dump()
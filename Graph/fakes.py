@@ -0,0 +1,209 @@
+import os
+import re
+import json
+import time
+import hashlib
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Union
+import numpy as np
+import pandas as pd
+from crewai.llms.base_llm import BaseLLM
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableLambda
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Stand-ins for the LLM and the chapters sheet, for benchmarks and runs without
+# credentials. Select them with LLM_BACKEND=fake and a "fake:<chapters>" sheet_id.
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", 0.05))
+FAKE_LLM_OUTPUT_TOKENS = int(os.getenv("FAKE_LLM_OUTPUT_TOKENS", 300))
+FAKE_SHEET_LATENCY = float(os.getenv("FAKE_SHEET_LATENCY", 0))
+FAKE_CHAPTER_WORDS = int(os.getenv("FAKE_CHAPTER_WORDS", 120))
+FAKE_EMBEDDING_DIM = int(os.getenv("FAKE_EMBEDDING_DIM", 256))
+
+WORDS = (
+    "meaning attention habit silence practice judgment trust change courage "
+    "clarity patience work freedom doubt purpose craft focus balance memory time"
+).split()
+
+
+def fake_text(seed: str, n_words: int) -> str:
+    """
+    Deterministic filler text of `n_words` words derived from `seed`.
+    """
+    digest = hashlib.sha256(seed.encode("utf-8")).digest()
+    return " ".join(WORDS[(digest[i % len(digest)] + i) % len(WORDS)] for i in range(max(1, n_words)))
+
+
+def fake_json(fields: Dict[str, Any], seed: str, n_words: int) -> dict:
+    """
+    Fill a {field: type} description: strings get filler text, nested dicts recurse.
+    """
+    strings = max(1, sum(1 for t in fields.values() if t == "str"))
+    out = {}
+    for name, kind in fields.items():
+        if isinstance(kind, dict):
+            out[name] = fake_json(kind, seed + name, n_words)
+        elif kind.startswith("List"):
+            out[name] = [fake_text(seed + name + str(i), 3) for i in range(3)]
+        elif kind in ("int", "float"):
+            out[name] = 0
+        elif kind == "bool":
+            out[name] = False
+        else:
+            out[name] = fake_text(seed + name, n_words // strings)
+    return out
+
+
+def schema_fields(schema: dict) -> Dict[str, Any]:
+    """
+    {field: type} description of a JSON schema, in the shape fake_json takes.
+    """
+    defs = schema.get("$defs", {})
+
+    def fields(node):
+        if "$ref" in node:
+            node = defs[node["$ref"].split("/")[-1]]
+        if node.get("type") == "object":
+            return {k: fields(v) for k, v in node.get("properties", {}).items()}
+        return {"array": "List", "integer": "int", "number": "float", "boolean": "bool"}.get(node.get("type"), "str")
+
+    return fields(schema)
+
+
+# CrewAI describes an output_json model in the prompt as {"field": type, ...}.
+FORMAT_RE = re.compile(r"in the following format: (\{.*?\})\s*Ensure the final output", re.S)
+FIELD_TYPE_RE = re.compile(r'("\w+"): ([A-Za-z_\[\], ]+?)(?=,\n|\n)')
+
+
+def crew_format_fields(prompt: str) -> Optional[Dict[str, Any]]:
+    match = FORMAT_RE.search(prompt)
+    if match is None:
+        return None
+    as_json = FIELD_TYPE_RE.sub(lambda m: f'{m.group(1)}: "{m.group(2)}"', match.group(1))
+    try:
+        return json.loads(as_json)
+    except json.JSONDecodeError:
+        return None
+
+
+class FakeCrewLLM(BaseLLM):
+    """
+    CrewAI LLM that answers after `latency` seconds with `output_tokens` words of
+    filler, as a final answer in the format the agent executor parses, and as
+    JSON when the task has an output_json.
+    """
+
+    def __init__(self, model: str = "fake", latency: float = FAKE_LLM_LATENCY, output_tokens: int = FAKE_LLM_OUTPUT_TOKENS):
+        super().__init__(model=model, temperature=0)
+        self.latency = latency
+        self.output_tokens = output_tokens
+
+    def call(self, messages: Union[str, List[Dict[str, str]]], tools=None, callbacks=None, available_functions=None) -> str:
+        prompt = messages if isinstance(messages, str) else "\n".join(m["content"] for m in messages)
+        time.sleep(self.latency)
+        fields = crew_format_fields(prompt)
+        if fields is not None:
+            answer = json.dumps(fake_json(fields, prompt, self.output_tokens))
+        else:
+            answer = fake_text(prompt, self.output_tokens)
+        return f"Thought: I now can give a great answer\nFinal Answer: {answer}"
+
+    def supports_function_calling(self) -> bool:
+        return False
+
+    def get_context_window_size(self) -> int:
+        return 128000
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    LangChain chat model with the same behaviour as FakeCrewLLM, for the direct
+    engine and digests. Reports usage_metadata with word counts as tokens.
+    """
+
+    latency: float = FAKE_LLM_LATENCY
+    output_tokens: int = FAKE_LLM_OUTPUT_TOKENS
+    model_name: str = "fake"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        prompt = "\n".join(str(m.content) for m in messages)
+        time.sleep(self.latency)
+        text = fake_text(prompt, self.output_tokens)
+        return ChatResult(generations=[ChatGeneration(message=self._message(prompt, text))])
+
+    def _message(self, prompt: str, content: str) -> AIMessage:
+        input_tokens, output_tokens = len(prompt.split()), len(content.split())
+        return AIMessage(
+            content=content,
+            usage_metadata={"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens},
+        )
+
+    def with_structured_output(self, schema, include_raw: bool = False, **kwargs):
+        def structured(messages):
+            prompt = "\n".join(str(m[1] if isinstance(m, tuple) else getattr(m, "content", m)) for m in messages)
+            time.sleep(self.latency)
+            data = fake_json(schema_fields(schema.model_json_schema()), prompt, self.output_tokens)
+            parsed = schema(**data)
+            if not include_raw:
+                return parsed
+            return {"raw": self._message(prompt, json.dumps(data)), "parsed": parsed, "parsing_error": None}
+
+        return RunnableLambda(structured)
+
+
+@lru_cache(maxsize=2 ** 16)
+def _bucket(gram: str, dim: int) -> int:
+    return int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest(), "little") % dim
+
+
+def fake_embeddings(texts: List[str], dim: int = FAKE_EMBEDDING_DIM) -> np.ndarray:
+    """
+    Deterministic embeddings without a model: the words and word pairs and triples
+    of each text hashed into `dim` buckets, counts damped with log1p. Texts sharing
+    most of their wording come out close, unrelated texts far apart.
+    Returns:
+            np.ndarray: float32 matrix, one row per text.
+    """
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        words = re.findall(r"\w+", text.lower())
+        grams = [" ".join(words[i:i + n]) for n in (1, 2, 3) for i in range(len(words) - n + 1)]
+        np.add.at(vectors[row], [_bucket(gram, dim) for gram in grams], 1.0)
+    return np.log1p(vectors)
+
+
+def fake_router():
+    """
+    LLMRouter over a single fake client, what get_router returns with LLM_BACKEND=fake.
+    """
+    from llms import LLMClient, LLMRouter
+
+    return LLMRouter([
+        LLMClient(
+            name="fake",
+            chat_model=FakeChatModel(),
+            crew_llm=FakeCrewLLM(),
+            rpm=10 ** 9,
+            tpm=10 ** 12,
+        )
+    ])
+
+
+def read_fake_sheet(sheet_id: str) -> pd.DataFrame:
+    """
+    Deterministic chapter rows for a "fake:<n>" sheet_id, e.g. "fake:100" for 100 chapters.
+    """
+    n = int(sheet_id.split(":", 1)[1] or 20)
+    time.sleep(FAKE_SHEET_LATENCY)
+    return pd.DataFrame({
+        "chapter_title": [f"Chapter {i + 1}" for i in range(n)],
+        "chapter_content": [fake_text(f"{sheet_id}:{i}", FAKE_CHAPTER_WORDS) for i in range(n)],
+    })
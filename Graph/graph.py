@@ -1,27 +1,82 @@
 from langgraph.graph import StateGraph, START, END
-from langgraph.checkpoint.memory import MemorySaver
-from langgraph.types import Send
-from nodes import read_sheet, generate_combinations, generate_book, generate_preface
-from states import StateIn, StateOut
+from nodes import (
+    read_sheet,
+    generate_combinations,
+    dispatch_books,
+    route_book,
+    generate_book,
+    generate_preface,
+    generate_extras,
+    generate_bio,
+    generate_toc,
+    assemble_book,
+    write_doc,
+    expansion_engine,
+)
+from states import StateIn, StateOut, BookState, BookOut
+from checkpoint import checkpointer
+from metrics import instrument
 
 
-memory = MemorySaver()
+# Per-book pipeline: expand the chapters, finish and assemble the book, then write it out.
+# Every node is wrapped by metrics.instrument for the run report and /metrics; the LLM nodes
+# with the engine they resolve, so batch runs are priced as such.
+book_builder = StateGraph(state_schema=BookState, output=BookOut)
+book_builder.add_node("generate_book", instrument("generate_book", generate_book, engine=expansion_engine))
+book_builder.add_node("generate_preface", instrument("generate_preface", generate_preface, engine=expansion_engine))
+book_builder.add_node("generate_extras", instrument("generate_extras", generate_extras, engine=expansion_engine))
+book_builder.add_node("generate_bio", instrument("generate_bio", generate_bio, engine=expansion_engine))
+book_builder.add_node("generate_toc", instrument("generate_toc", generate_toc, engine=expansion_engine))
+book_builder.add_node("assemble_book", instrument("assemble_book", assemble_book))
+book_builder.add_node("write_doc", instrument("write_doc", write_doc))
+
+# Books reused from the previous run of the build go straight to write_doc.
+book_builder.add_conditional_edges(START, route_book, ["generate_book", "write_doc"])
+# Finishing stage: preface, extras, bio and TOC run as parallel branches
+finishing_nodes = ["generate_preface", "generate_extras", "generate_bio", "generate_toc"]
+for node in finishing_nodes:
+    book_builder.add_edge("generate_book", node)
+book_builder.add_edge(finishing_nodes, "assemble_book")
+book_builder.add_edge("assemble_book", "write_doc")
+book_builder.add_edge("write_doc", END)
+
+book_pipeline = book_builder.compile()
+
 
 graph_builder = StateGraph(state_schema=StateIn, output=StateOut)
 # Nodes
-graph_builder.add_node("read_sheet", read_sheet)
-graph_builder.add_node("generate_combinations", generate_combinations)
-graph_builder.add_node("generate_book", generate_book)
-graph_builder.add_node("generate_preface", generate_preface)
+graph_builder.add_node("read_sheet", instrument("read_sheet", read_sheet))
+graph_builder.add_node("generate_combinations", instrument("generate_combinations", generate_combinations))
+graph_builder.add_node("book_pipeline", book_pipeline)
 
 
 # Edges
 graph_builder.add_edge(START, "read_sheet")
 graph_builder.add_edge("read_sheet", "generate_combinations")
-graph_builder.add_edge("generate_combinations", "generate_book")
-graph_builder.add_edge("generate_book", "generate_preface")
-graph_builder.add_edge("generate_preface", END)
+# One book_pipeline per book, all running concurrently
+graph_builder.add_conditional_edges("generate_combinations", dispatch_books, ["book_pipeline"])
+graph_builder.add_edge("book_pipeline", END)
 
 
 # Compiled graph
-graph = graph_builder.compile(checkpointer=memory, debug=False)
+graph = graph_builder.compile(checkpointer=checkpointer, debug=False)
+
+
+def resume(thread_id: str):
+    """
+    Continue an interrupted or failed run from its last checkpoint.
+    Chapters expanded before the failure are taken from the chapter journal.
+    Args:
+            thread_id (str): thread_id of the run to resume.
+    Returns:
+            dict: The final graph state.
+    """
+    config = {"configurable": {"thread_id": thread_id}}
+    snapshot = graph.get_state(config)
+    if not snapshot.values:
+        raise ValueError(f"No checkpoint found for thread_id {thread_id}")
+    if not snapshot.next:
+        print(f"Thread {thread_id} already finished, nothing to resume.")
+        return snapshot.values
+    print(f"Resuming thread {thread_id} at {snapshot.next}")
+    return graph.invoke(input=None, config=config, stream_mode="values")
@@ -0,0 +1,208 @@
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, Iterator, Optional
+from dotenv import load_dotenv
+from metrics import metrics
+
+load_dotenv()
+
+# Number of graph runs executing at the same time, further jobs wait in the queue.
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", 2))
+# Finished jobs are forgotten this long after they end; their checkpoints and outputs stay.
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", 24 * 3600))
+
+
+def build_input(payload: dict) -> dict:
+    """
+    Map a request payload, or a job of a manifest (see manifest.py), to the graph input.
+    """
+    gpt_prompt = payload.get("gpt_prompt")
+    openai_api_key = payload.get("openai_api_key")
+    output_lang = payload.get("output_lang")
+    output_format = payload.get("output_format")
+    max_tokens = payload.get("max_tokens")
+    max_docs = payload.get("max_docs")
+    max_overlap = payload.get("max_overlap")
+    min_diff = payload.get("min_diff")
+    selection = payload.get("selection")
+    max_similarity = payload.get("max_similarity")
+    delta = payload.get("delta")
+    r_chapters = payload.get("r_chapters")
+    mode = payload.get("mode")
+    engine = payload.get("engine")
+    expansion = payload.get("expansion")
+    max_concurrency = payload.get("max_concurrency")
+    seed = payload.get("seed")
+    sheet_id = payload.get("sheet_id", os.getenv("SHEET_ID"))
+
+    return {
+        "messages": [("human", gpt_prompt)],
+        "gpt_prompt": gpt_prompt,
+        "openai_api_key": openai_api_key,
+        "output_lang": output_lang,
+        "output_format": output_format,
+        "max_tokens": max_tokens,
+        "max_docs": max_docs,
+        "max_overlap": max_overlap,
+        "min_diff": min_diff,
+        "selection": selection,
+        "max_similarity": max_similarity,
+        "delta": delta,
+        "r_chapters": r_chapters,
+        "mode": mode,
+        "engine": engine,
+        "expansion": expansion,
+        "max_concurrency": max_concurrency,
+        "seed": seed,
+        "sheet_id": sheet_id,
+    }
+
+
+
+class JobManager:
+    """
+    Runs graph invocations on a background thread pool and keeps their status.
+    A job moves through queued -> running -> succeeded | failed.
+    `get_graph` returns the compiled graph; it is called by the first job, so
+    creating the manager does not load the graph.
+    With `llm_pool`, all its jobs share one LLM concurrency budget (see
+    nodes.llm_slot) instead of each run having its own.
+    Succeeded and failed jobs are dropped `retention` seconds after they finish,
+    so a long-lived manager does not keep every result it ever produced.
+    """
+
+    def __init__(self, get_graph, max_workers: int = JOB_CONCURRENCY, llm_pool: Optional[str] = None,
+                 retention: float = JOB_RETENTION_SECONDS):
+        self._get_graph = get_graph
+        self.llm_pool = llm_pool
+        self.retention = retention
+        self.jobs: Dict[str, dict] = {}
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+
+    def submit(self, input: dict, job_id: Optional[str] = None) -> str:
+        """
+        Queue a graph run.
+        Args:
+                input (dict): Graph input, as passed to graph.invoke.
+                job_id (str): Id of the job, a new uuid by default.
+        Returns:
+                str: The job id, also used as the graph thread_id.
+        """
+        job_id = job_id or str(uuid.uuid4())
+        with self._lock:
+            self._prune()
+            if job_id in self.jobs and self.jobs[job_id]["status"] in ("queued", "running"):
+                raise ValueError(f"Job {job_id} is already {self.jobs[job_id]['status']}")
+            self.jobs[job_id] = {
+                "job_id": job_id,
+                "status": "queued",
+                "progress": {"completed_nodes": [], "books_finished": 0, "percent": 0},
+                "result": None,
+                "error": None,
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+            }
+            self._futures[job_id] = self._executor.submit(self._run, job_id, input)
+        return job_id
+
+    def resume(self, job_id: str) -> bool:
+        """
+        Re-queue a failed job; it continues from its last checkpoint.
+        Returns:
+                bool: False if the job is unknown or not in the failed state.
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] != "failed":
+                return False
+            job.update(status="queued", error=None, finished_at=None)
+            self._futures[job_id] = self._executor.submit(self._run, job_id, None)
+        return True
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return None if job is None else dict(job, progress=dict(job["progress"]))
+
+    def list(self) -> list:
+        with self._lock:
+            self._prune()
+            return [
+                {"job_id": job_id, "status": job["status"], "percent": job["progress"]["percent"]}
+                for job_id, job in self.jobs.items()
+            ]
+
+    def as_completed(self, job_ids: Iterable[str]) -> Iterator[dict]:
+        """
+        Wait for the jobs `job_ids` and yield each one as it finishes, succeeded or failed.
+        """
+        with self._lock:
+            futures = {self._futures[job_id]: job_id for job_id in job_ids}
+        for future in as_completed(futures):
+            yield self.get(futures[future])
+
+    @property
+    def graph(self):
+        return self._get_graph()
+
+    def _prune(self) -> None:
+        # Called with the lock held.
+        cutoff = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self.jobs.items() if job["finished_at"] and job["finished_at"] < cutoff]:
+            del self.jobs[job_id]
+            self._futures.pop(job_id, None)
+
+    def _update(self, job_id: str, **fields) -> None:
+        with self._lock:
+            self.jobs[job_id].update(fields)
+
+    def _run(self, job_id: str, input: Optional[dict]) -> None:
+        # input=None resumes the thread from its last checkpoint.
+        config = {"configurable": {"thread_id": job_id, "llm_pool": self.llm_pool}}
+        self._update(job_id, status="running", started_at=time.time())
+        try:
+            if input is not None:
+                completed = []
+                total_books = input.get("max_docs") or 0
+            else:
+                completed = list(self.get(job_id)["progress"]["completed_nodes"])
+                total_books = self.graph.get_state(config).values.get("max_docs") or 0
+            # read_sheet, generate_combinations, then one book_pipeline per book.
+            total_steps = 2 + max(1, total_books)
+            for update in self.graph.stream(input=input, config=config, stream_mode="updates"):
+                completed.extend(update.keys())
+                # Every book_pipeline update is one finished book.
+                books_finished = completed.count("book_pipeline")
+                self._update(
+                    job_id,
+                    progress={
+                        "completed_nodes": list(completed),
+                        "books_finished": books_finished,
+                        "percent": min(100, round(100 * len(completed) / total_steps)),
+                    },
+                )
+            values = self.graph.get_state(config).values
+            metrics.write_report(job_id)
+            self._update(
+                job_id,
+                status="succeeded",
+                result={
+                    "books_generated": values.get("books_generated", []),
+                    "books_written": values.get("books_written", []),
+                    "out_sheet": values.get("out_sheet"),
+                    "report": metrics.report(job_id),
+                },
+                finished_at=time.time(),
+            )
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            self._update(job_id, status="failed", error=str(e), finished_at=time.time())
+        from checkpoint import maybe_sweep_blobs
+
+        maybe_sweep_blobs()
@@ -1,21 +1,310 @@
-from langchain_google_vertexai import ChatVertexAI
-from langchain_openai import ChatOpenAI
 from dotenv import load_dotenv
+from metrics import metrics
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, TypeVar
+from collections import OrderedDict
 import os
+import time
+import hashlib
+import threading
 
 load_dotenv()
-# print(os.getenv("OPENAI_API_KEY"))
 
-llm_gpt = ChatOpenAI(
-    model="gpt-4o",
-    temperature=0,
-    top_p=0.2,
-)
+# "openai" (default) or "fake", the stand-in of fakes.py for benchmarks.
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE") or None
+# Comma-separated pool of keys; each key gets its own rate limits.
+OPENAI_API_KEYS = [k.strip() for k in (os.getenv("OPENAI_API_KEYS") or os.getenv("OPENAI_API_KEY") or "").split(",") if k.strip()]
+# Per-key limits of the account tier.
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", 500))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", 30000))
+# Vertex is added to the pool as a fallback provider when VERTEX_MODEL is set.
+VERTEX_MODEL = os.getenv("VERTEX_MODEL", "")
+VERTEX_RPM = int(os.getenv("VERTEX_RPM", 200))
+VERTEX_TPM = int(os.getenv("VERTEX_TPM", 1000000))
+# Tokens charged against the TPM budget when a caller has no better estimate.
+LLM_DEFAULT_CALL_TOKENS = int(os.getenv("LLM_DEFAULT_CALL_TOKENS", 4000))
+# Cool-down of a client after a 429/5xx, doubled per consecutive failure up to the max.
+LLM_COOLDOWN_SECONDS = float(os.getenv("LLM_COOLDOWN_SECONDS", 5))
+LLM_MAX_COOLDOWN_SECONDS = float(os.getenv("LLM_MAX_COOLDOWN_SECONDS", 120))
+# Routers of runs that bring their own key kept at once, least recently used dropped first.
+LLM_REQUEST_ROUTERS = int(os.getenv("LLM_REQUEST_ROUTERS", 32))
 
-# llm_gemini = ChatVertexAI(
-# 	model="gemini-2.0-flash-001",
-# 	temperature=0,
-# 	top_p=0.2,
-# )
+T = TypeVar("T")
+
+if TYPE_CHECKING:
+    from crewai import LLM
+
+
+class TokenBucket:
+    """
+    Continuously refilled budget of `per_minute` units, e.g. requests or tokens per minute.
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = max(1, per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: int, now: float) -> float:
+        """
+        Seconds until `amount` units are available, 0 if they are available now.
+        Requests larger than the capacity only wait for a full bucket.
+        """
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount: int, now: float) -> None:
+        self._refill(now)
+        self.level -= min(amount, self.capacity)
+
+
+class LLMClient:
+    """
+    One provider/key/model combination with its own rate limits and health.
+    Holds the LangChain chat model, for direct calls, and the equivalent CrewAI LLM,
+    for agents; CrewAI does not pick up the key or base URL of a LangChain model.
+    """
+
+    def __init__(self, name: str, chat_model, crew_llm: "LLM", rpm: int, tpm: int):
+        self.name = name
+        self.chat_model = chat_model
+        self.crew_llm = crew_llm
+        self.model_name = crew_llm.model.split("/")[-1]
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.in_flight = 0
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.stats = {"calls": 0, "errors": 0, "rate_limited": 0, "fallbacks": 0}
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.cooldown_until
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        if not self.healthy(now):
+            return self.cooldown_until - now
+        return max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+
+
+# Provider SDKs are imported when the first client is built, not when this module is.
+def openai_client(api_key: str, name: str) -> LLMClient:
+    from crewai import LLM
+    from langchain_openai import ChatOpenAI
+
+    return LLMClient(
+        name=name,
+        chat_model=ChatOpenAI(
+            model=OPENAI_MODEL,
+            temperature=0,
+            top_p=0.2,
+            api_key=api_key,
+            base_url=OPENAI_API_BASE,
+            # Retries are the router's job, it moves on to another client instead.
+            max_retries=0,
+        ),
+        crew_llm=LLM(
+            model=OPENAI_MODEL,
+            temperature=0,
+            top_p=0.2,
+            api_key=api_key,
+            base_url=OPENAI_API_BASE,
+        ),
+        rpm=OPENAI_RPM,
+        tpm=OPENAI_TPM,
+    )
+
+
+def vertex_client() -> LLMClient:
+    from crewai import LLM
+    from langchain_google_vertexai import ChatVertexAI
+
+    return LLMClient(
+        name=f"vertex:{VERTEX_MODEL}",
+        chat_model=ChatVertexAI(
+            model=VERTEX_MODEL,
+            temperature=0,
+            top_p=0.2,
+            max_retries=0,
+        ),
+        crew_llm=LLM(
+            model=f"vertex_ai/{VERTEX_MODEL}",
+            temperature=0,
+            top_p=0.2,
+        ),
+        rpm=VERTEX_RPM,
+        tpm=VERTEX_TPM,
+    )
+
+
+def status_code(error: BaseException) -> Optional[int]:
+    """
+    HTTP status of a provider error (openai, litellm, google), looking through wrapped causes.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        for attr in ("status_code", "code", "status"):
+            value = getattr(error, attr, None)
+            if isinstance(value, int):
+                return value
+        response = getattr(error, "response", None)
+        if isinstance(getattr(response, "status_code", None), int):
+            return response.status_code
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Rate limits, server errors and connection failures go to another client;
+    anything else (bad request, auth, parsing) is raised to the caller.
+    """
+    code = status_code(error)
+    if code is not None:
+        return code == 429 or code >= 500
+    name = type(error).__name__
+    return "RateLimit" in name or "Timeout" in name or "Connection" in name or "ServiceUnavailable" in name
+
+
+class LLMRouter:
+    """
+    Spreads LLM calls over a pool of clients (providers x API keys).
+    Every call goes to the healthy client that can take it soonest under its
+    request and token budgets, preferring the least busy. A 429 or 5xx puts the
+    client in an exponential cool-down and the call is retried on the next one.
+    Usage: `router.run(lambda client: client.chat_model.invoke(prompt), tokens=...)`
+    """
+
+    def __init__(self, clients: List[LLMClient], max_attempts: Optional[int] = None):
+        if not clients:
+            raise ValueError("LLMRouter needs at least one client, set OPENAI_API_KEY(S) or VERTEX_MODEL")
+        self.clients = clients
+        self.max_attempts = max_attempts or 2 * len(clients) + 1
+        self._cond = threading.Condition()
+
+    @property
+    def model_name(self) -> str:
+        """Model of the primary client, used for token counting and cache keys."""
+        return self.clients[0].model_name
+
+    @property
+    def temperature(self):
+        return self.clients[0].crew_llm.temperature
+
+    def _acquire(self, tokens: int) -> LLMClient:
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                waits = [(c.wait_time(tokens, now), c.in_flight, i) for i, c in enumerate(self.clients)]
+                wait, _, i = min(waits)
+                if wait <= 0:
+                    client = self.clients[i]
+                    client.requests.take(1, now)
+                    client.tokens.take(tokens, now)
+                    client.in_flight += 1
+                    return client
+                # Woken early when a client recovers or frees up.
+                self._cond.wait(timeout=wait)
+
+    def _release(self, client: LLMClient, error: Optional[BaseException], retryable: bool = False,
+                 fallback: bool = False) -> None:
+        with self._cond:
+            client.in_flight -= 1
+            client.stats["calls"] += 1
+            if fallback:
+                client.stats["fallbacks"] += 1
+            if error is None:
+                client.failures = 0
+            else:
+                client.stats["errors"] += 1
+                # A non-retryable error is the request's fault, not the client's: its failure
+                # count and cool-down stay as they were.
+                if retryable:
+                    if status_code(error) == 429 or "RateLimit" in type(error).__name__:
+                        client.stats["rate_limited"] += 1
+                    client.failures += 1
+                    cooldown = min(LLM_MAX_COOLDOWN_SECONDS, LLM_COOLDOWN_SECONDS * 2 ** (client.failures - 1))
+                    client.cooldown_until = time.monotonic() + cooldown
+                    print(f"LLM client {client.name} failed ({type(error).__name__}), cooling down {cooldown:.1f}s")
+            self._cond.notify_all()
+
+    def run(self, fn: Callable[[LLMClient], T], tokens: int = LLM_DEFAULT_CALL_TOKENS) -> T:
+        """
+        Call `fn` with a client picked from the pool, falling back to other clients on 429/5xx.
+        Args:
+                fn (callable): Makes the LLM call(s) with the given client.
+                tokens (int): Estimated prompt plus completion tokens, charged to the client's TPM budget.
+        Returns:
+                The result of `fn`.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            client = self._acquire(tokens)
+            start = time.perf_counter()
+            try:
+                result = fn(client)
+            except Exception as e:
+                metrics.record_llm_call(client.name, time.perf_counter() - start, e, retry=attempt > 1)
+                retryable = is_retryable(e)
+                fallback = retryable and attempt < self.max_attempts
+                self._release(client, e, retryable=retryable, fallback=fallback)
+                if not fallback:
+                    raise
+                continue
+            metrics.record_llm_call(client.name, time.perf_counter() - start, None, retry=attempt > 1)
+            self._release(client, None)
+            return result
+
+    def stats(self) -> Dict[str, dict]:
+        with self._cond:
+            now = time.monotonic()
+            return {
+                c.name: {**c.stats, "in_flight": c.in_flight, "healthy": c.healthy(now)}
+                for c in self.clients
+            }
+
+
+def build_router(api_keys: List[str]) -> LLMRouter:
+    clients = [openai_client(key, f"openai:{OPENAI_MODEL}:key{i}") for i, key in enumerate(api_keys)]
+    if VERTEX_MODEL:
+        clients.append(vertex_client())
+    return LLMRouter(clients)
+
+
+_router: Optional[LLMRouter] = None
+# Keyed by the sha256 of the key, so the keys themselves are not kept around.
+_request_routers: "OrderedDict[str, LLMRouter]" = OrderedDict()
+_routers_lock = threading.Lock()
+
+
+def get_router(api_key: Optional[str] = None) -> LLMRouter:
+    """
+    The shared router. A run that brings its own `openai_api_key` gets a router
+    of its own on that key only, so its calls are billed to and limited by that key.
+    The last LLM_REQUEST_ROUTERS of those are kept, so a run's calls share its rate limits.
+    """
+    global _router
+    with _routers_lock:
+        if LLM_BACKEND == "fake" or not api_key:
+            if _router is None:
+                if LLM_BACKEND == "fake":
+                    from fakes import fake_router
+                    _router = fake_router()
+                else:
+                    _router = build_router(OPENAI_API_KEYS)
+            return _router
+        digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+        router = _request_routers.get(digest)
+        if router is None:
+            router = _request_routers[digest] = LLMRouter([openai_client(api_key, f"openai:{OPENAI_MODEL}:request")])
+        _request_routers.move_to_end(digest)
+        while len(_request_routers) > LLM_REQUEST_ROUTERS:
+            _request_routers.popitem(last=False)
+        return router
 
-llm = llm_gpt
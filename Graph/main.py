@@ -1,38 +1,77 @@
 import os
+import uuid
+import argparse
 from dotenv import load_dotenv
-from graph import graph
+from graph import graph, resume
+from checkpoint import maybe_sweep_blobs
+from metrics import metrics
 
 load_dotenv()
 
+parser = argparse.ArgumentParser(description="Generate books from the chapters sheet.")
+parser.add_argument("--thread-id", help="thread_id of the run, used for checkpoints (default: a new one per run)")
+parser.add_argument("--resume", action="store_true", help="continue --thread-id from its last checkpoint")
+parser.add_argument("--delta", action="store_true", help="only rebuild the books whose chapters changed since the last run")
+args = parser.parse_args()
+if args.resume and not args.thread_id:
+    parser.error("--resume needs the --thread-id of the run to continue")
+# A fresh thread per run: reusing one would add this run's books and messages to the previous run's state.
+thread_id = args.thread_id or str(uuid.uuid4())
+print("Thread:", thread_id)
+
 #inputs from web interface
 max_docs = 3
 max_overlap = 1
+# "overlap", or "diverse" to also keep near-duplicate chapters apart (cosine similarity above max_similarity)
+selection = os.getenv("SELECTION_MODE", "overlap")
+max_similarity = float(os.getenv("MAX_SIMILARITY", 0.85))
 r_chapters = 3
 mode = "permutation"
+engine = "crew"
+# "chapter" or "longform" (outline, sections in parallel, stitched transitions)
+expansion = os.getenv("EXPANSION_MODE", "chapter")
+max_concurrency = 4
+seed = 0
 
 max_tokens = 10000
-openai_api_key = "your_openai_api_key"
+# Optional, bills the run to this key instead of the OPENAI_API_KEYS pool
+openai_api_key = os.getenv("RUN_OPENAI_API_KEY")
 output_lang = "en"
+# "markdown", "docx", "jsonl", "google" or "none" (keep the books in the state only)
+output_format = os.getenv("OUTPUT_FORMAT", "markdown")
 gpt_prompt = "Generate Book from given chapters."
 sheet_id = os.getenv("SHEET_ID")
 
-config = {"configurable": {"thread_id": "001"}}
+config = {"configurable": {"thread_id": thread_id}}
 
-output = graph.invoke(
-    input={
-        "messages": [("human", gpt_prompt)],
-        "gpt_prompt": gpt_prompt,
-        "openai_api_key": openai_api_key,
-        "output_lang": output_lang,
-        "max_tokens": max_tokens,
-        "max_docs": max_docs,
-        "max_overlap": max_overlap,
-        "r_chapters": r_chapters,
-        "mode": mode,
-        "sheet_id": sheet_id,
-    },
-    config=config,
-    stream_mode="values",
-)
+if args.resume:
+    output = resume(thread_id)
+else:
+    output = graph.invoke(
+        input={
+            "messages": [("human", gpt_prompt)],
+            "gpt_prompt": gpt_prompt,
+            "openai_api_key": openai_api_key,
+            "output_lang": output_lang,
+            "output_format": output_format,
+            "max_tokens": max_tokens,
+            "max_docs": max_docs,
+            "max_overlap": max_overlap,
+            "selection": selection,
+            "max_similarity": max_similarity,
+            "delta": args.delta or None,
+            "r_chapters": r_chapters,
+            "mode": mode,
+            "engine": engine,
+            "expansion": expansion,
+            "max_concurrency": max_concurrency,
+            "seed": seed,
+            "sheet_id": sheet_id,
+        },
+        config=config,
+        stream_mode="values",
+    )
 
 print(output)
+print("Run report:", metrics.write_report(thread_id))
+maybe_sweep_blobs()
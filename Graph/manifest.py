@@ -0,0 +1,204 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, List, Optional
+from dotenv import load_dotenv
+from jobs import JOB_CONCURRENCY, JobManager, build_input
+
+load_dotenv()
+
+# Defaults of every job of a manifest, before the manifest's own "defaults".
+JOB_DEFAULTS = {
+    "gpt_prompt": "Generate Book from given chapters.",
+    "r_chapters": 3,
+    "max_docs": 3,
+    "max_overlap": 1,
+    "output_lang": "en",
+    "mode": "permutation",
+    "seed": 0,
+}
+# Keys of a job besides the graph input: its name, and a local chapter file.
+JOB_KEYS = {"name", "file"}
+INPUT_KEYS = set(build_input({})) - {"messages"}
+
+
+def load_manifest(path: str) -> List[dict]:
+    """
+    Read the jobs of a manifest: a JSON list of jobs, a JSON object with "jobs"
+    and optional "defaults" for all of them, or JSONL with one job per line.
+    A job has a `sheet_id` (Google Sheet id, "fake:<n>" or a file under SOURCE_DIR)
+    or a `file`, and any graph input option: r_chapters, max_docs, max_overlap,
+    output_lang, engine, output_format, ...
+    Args:
+            path (str): The manifest file.
+    Returns:
+            List[dict]: The jobs, defaults applied, each with a unique `name`.
+    Raises:
+            ValueError: If a job has unknown keys, no chapters source or a duplicate name.
+    """
+    with open(path) as f:
+        text = f.read()
+    defaults = {}
+    if path.endswith(".jsonl"):
+        entries = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        data = json.loads(text)
+        if isinstance(data, dict):
+            defaults, entries = data.get("defaults", {}), data.get("jobs", [])
+        else:
+            entries = data
+    stem = os.path.splitext(os.path.basename(path))[0]
+
+    jobs, names = [], set()
+    for i, entry in enumerate(entries):
+        job = {**JOB_DEFAULTS, **defaults, **entry}
+        unknown = set(job) - INPUT_KEYS - JOB_KEYS
+        if unknown:
+            raise ValueError(f"Job {i + 1} of {path}: unknown keys {sorted(unknown)}")
+        if job.get("file"):
+            job["sheet_id"] = f"file:{job.pop('file')}"
+        if not job.get("sheet_id"):
+            raise ValueError(f"Job {i + 1} of {path}: needs a sheet_id or a file")
+        # Part of the graph thread_id, and so of the output directory of the job's books.
+        job["name"] = re.sub(r"[^A-Za-z0-9._-]+", "-", str(job.get("name") or f"{stem}-{i + 1:03d}"))
+        if job["name"] in names:
+            raise ValueError(f"Job {i + 1} of {path}: duplicate name {job['name']!r}")
+        names.add(job["name"])
+        jobs.append(job)
+    return jobs
+
+
+def get_graph():
+    from graph import graph
+
+    return graph
+
+
+def job_result(name: str, job: dict) -> dict:
+    """
+    Summary of a finished JobManager job: status, books and the totals of its run report.
+    """
+    result = job["result"] or {}
+    totals = (result.get("report") or {}).get("totals", {})
+    return {
+        "name": name,
+        "thread_id": job["job_id"],
+        "status": job["status"],
+        "error": job["error"],
+        "seconds": round((job["finished_at"] or time.time()) - (job["started_at"] or job["created_at"]), 3),
+        "books": len(result.get("books_written", [])) + len(result.get("books_generated", [])),
+        "llm_calls": totals.get("llm_calls", 0),
+        "prompt_tokens": totals.get("prompt_tokens", 0),
+        "completion_tokens": totals.get("completion_tokens", 0),
+        "estimated_cost_usd": totals.get("estimated_cost_usd", 0.0),
+    }
+
+
+def run_jobs(jobs: List[dict], run_id: str, workers: int = JOB_CONCURRENCY, llm_concurrency: Optional[int] = None,
+             quiet: bool = False, on_result: Optional[Callable[[dict], None]] = None) -> List[dict]:
+    """
+    Run `jobs` in this process, `workers` at a time. They share the process-wide
+    LLM clients and rate limits, the expansion cache and the embedding index,
+    the graph is compiled once, and with `llm_concurrency` their LLM calls also
+    share one concurrency budget instead of each run having its own.
+    Args:
+            jobs (list): Jobs of load_manifest.
+            run_id (str): Id of the manifest run; a job's thread_id is "<name>-<run_id>".
+            workers (int): Jobs running at the same time.
+            llm_concurrency (int): LLM calls in flight across all the jobs.
+            quiet (bool): Silence the nodes' own output.
+            on_result (callable): Called with the job_result of each job as it finishes.
+    Returns:
+            List[dict]: job_result of every job, in the order they finished.
+    """
+    manager = JobManager(get_graph, max_workers=workers, llm_pool="manifest" if llm_concurrency else None)
+    stdout, results = sys.stdout, []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull if quiet else stdout):
+        names = {}
+        for job in jobs:
+            input = build_input({key: value for key, value in job.items() if key != "name"})
+            if llm_concurrency:
+                input["max_concurrency"] = llm_concurrency
+            names[manager.submit(input, job_id=f"{job['name']}-{run_id}")] = job["name"]
+        for job in manager.as_completed(names):
+            results.append(job_result(names[job["job_id"]], job))
+            if on_result:
+                with contextlib.redirect_stdout(stdout):
+                    on_result(results[-1])
+    return results
+
+
+def run_manifest(jobs: List[dict], workers: int = JOB_CONCURRENCY, processes: int = 1, llm_concurrency: Optional[int] = None,
+                 quiet: bool = False, on_result: Optional[Callable[[dict], None]] = None) -> List[dict]:
+    """
+    Run the jobs of a manifest, in this process or spread over `processes`
+    worker processes. Jobs are dealt round-robin to the processes; each runs its
+    share with run_jobs, so `workers` and `llm_concurrency` apply per process
+    (LLM rate limits are tracked per process too), and its results are known
+    when its whole share is done.
+    Args:
+            jobs (list): Jobs of load_manifest.
+            workers (int): Jobs running at the same time, per process.
+            processes (int): Worker processes, 1 to run everything in this process.
+            llm_concurrency (int): LLM calls in flight, per process.
+            quiet (bool): Silence the nodes' own output.
+            on_result (callable): Called with each job_result as soon as it is known.
+    Returns:
+            List[dict]: job_result of every job, in manifest order.
+    """
+    results = {}
+    # Every run gets fresh threads: reusing a thread_id would resume its journal and add to its books.
+    run_id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+
+    def done(result: dict) -> None:
+        results[result["name"]] = result
+        if on_result:
+            on_result(result)
+
+    processes = max(1, min(processes, len(jobs)))
+    if processes == 1:
+        run_jobs(jobs, run_id, workers, llm_concurrency, quiet, on_result=done)
+    else:
+        # spawn: the children import the graph themselves rather than inheriting a forked copy of its threads.
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+            groups = [jobs[i::processes] for i in range(processes)]
+            futures = {executor.submit(run_jobs, group, run_id, workers, llm_concurrency, quiet): group for group in groups}
+            for future in as_completed(futures):
+                try:
+                    group_results = future.result()
+                except Exception as e:
+                    # The process died: every job of its group counts as failed.
+                    group_results = [
+                        {"name": job["name"], "thread_id": f"{job['name']}-{run_id}", "status": "failed",
+                         "error": f"worker process failed: {e}", "seconds": 0.0, "books": 0,
+                         "llm_calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "estimated_cost_usd": 0.0}
+                        for job in futures[future]
+                    ]
+                for result in group_results:
+                    done(result)
+    return [results[job["name"]] for job in jobs]
+
+
+def summary(results: List[dict], wall_seconds: float) -> dict:
+    """
+    Throughput of a manifest run: jobs and books finished, tokens and cost, books per hour of wall time.
+    """
+    books = sum(result["books"] for result in results)
+    return {
+        "jobs": len(results),
+        "succeeded": sum(result["status"] == "succeeded" for result in results),
+        "failed": sum(result["status"] != "succeeded" for result in results),
+        "books": books,
+        "wall_seconds": round(wall_seconds, 3),
+        "books_per_hour": round(books / wall_seconds * 3600, 1) if wall_seconds else None,
+        "llm_calls": sum(result["llm_calls"] for result in results),
+        "prompt_tokens": sum(result["prompt_tokens"] for result in results),
+        "completion_tokens": sum(result["completion_tokens"] for result in results),
+        "estimated_cost_usd": round(sum(result["estimated_cost_usd"] for result in results), 6),
+    }
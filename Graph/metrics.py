@@ -0,0 +1,310 @@
+import os
+import json
+import time
+import bisect
+import inspect
+import threading
+from contextvars import ContextVar
+from functools import wraps
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+if TYPE_CHECKING:
+    from langchain_core.runnables import RunnableConfig
+
+load_dotenv()
+
+# USD per 1M tokens, for the cost estimate of the run report.
+LLM_PRICE_INPUT_PER_MTOK = float(os.getenv("LLM_PRICE_INPUT_PER_MTOK", 2.50))
+LLM_PRICE_OUTPUT_PER_MTOK = float(os.getenv("LLM_PRICE_OUTPUT_PER_MTOK", 10.00))
+# The Batch API bills half price.
+BATCH_PRICE_FACTOR = 0.5
+# Finished run reports are written here as <thread_id>.json.
+RUN_REPORT_DIR = os.getenv("RUN_REPORT_DIR", ".cache/reports")
+# Runs kept in memory for reports, oldest dropped first.
+METRICS_MAX_RUNS = int(os.getenv("METRICS_MAX_RUNS", 500))
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+# (thread_id, node) of the node running in this context, set by `instrument`.
+current_node: ContextVar[Optional[Tuple[str, str]]] = ContextVar("current_node", default=None)
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 4)
+
+
+def estimated_cost(prompt_tokens: int, completion_tokens: int, batch: bool = False) -> float:
+    cost = (prompt_tokens * LLM_PRICE_INPUT_PER_MTOK + completion_tokens * LLM_PRICE_OUTPUT_PER_MTOK) / 1e6
+    return cost * (BATCH_PRICE_FACTOR if batch else 1)
+
+
+class NodeStats:
+    """
+    Counters of one node, within one run or summed over all runs.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.llm_calls = 0
+        self.llm_errors = 0
+        self.retries = 0
+        self.llm_latencies: List[float] = []
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.llm_seconds = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.parse_failures = 0
+        self.repairs = 0
+        self.repair_failures = 0
+        self.cost = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "wall_seconds": round(self.seconds, 3),
+            "llm_calls": self.llm_calls,
+            "llm_errors": self.llm_errors,
+            "retries": self.retries,
+            "llm_latency_p50": percentile(self.llm_latencies, 0.50),
+            "llm_latency_p90": percentile(self.llm_latencies, 0.90),
+            "llm_latency_p99": percentile(self.llm_latencies, 0.99),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "parse_failures": self.parse_failures,
+            "repairs": self.repairs,
+            "repair_failures": self.repair_failures,
+            "estimated_cost_usd": round(self.cost, 6),
+        }
+
+
+class Metrics:
+    """
+    Per-run and process-wide counters of nodes and LLM calls.
+    Nodes are timed by the `instrument` wrapper, which also marks the running
+    node so LLM calls made inside it (see LLMRouter.run) are attributed to it,
+    including calls made from the node's own worker threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs: Dict[str, dict] = {}
+        self.totals: Dict[str, NodeStats] = {}
+        self.clients: Dict[str, Dict[str, int]] = {}
+
+    def _stats(self, thread_id: str, node: str) -> Tuple[NodeStats, NodeStats]:
+        run = self.runs.get(thread_id)
+        if run is None:
+            run = self.runs[thread_id] = {"started_at": time.time(), "finished_at": None, "nodes": {}}
+            while len(self.runs) > METRICS_MAX_RUNS:
+                del self.runs[next(iter(self.runs))]
+        run["finished_at"] = time.time()
+        return run["nodes"].setdefault(node, NodeStats()), self.totals.setdefault(node, NodeStats())
+
+    def record_node(self, thread_id: str, node: str, seconds: float, error: bool, update, batch: bool = False) -> None:
+        """
+        Record one node execution; tokens are read from the node's own token_usage update.
+        """
+        usage = (update or {}).get("token_usage", {}).get(node, {}) if isinstance(update, dict) else {}
+        with self._lock:
+            for stats in self._stats(thread_id, node):
+                stats.calls += 1
+                stats.errors += int(error)
+                stats.seconds += seconds
+                stats.prompt_tokens += usage.get("prompt_tokens", 0)
+                stats.completion_tokens += usage.get("completion_tokens", 0)
+                stats.cost += estimated_cost(
+                    usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), batch=batch
+                )
+
+    def record_llm_call(self, client: str, seconds: float, error: Optional[BaseException], retry: bool) -> None:
+        """
+        Record one LLM call attempt, attributed to the node running in this context.
+        """
+        thread_id, node = current_node.get() or ("", "unknown")
+        with self._lock:
+            counts = self.clients.setdefault(client, {"calls": 0, "errors": 0})
+            counts["calls"] += 1
+            counts["errors"] += int(error is not None)
+            run_stats, total_stats = self._stats(thread_id, node)
+            for stats in (run_stats, total_stats):
+                stats.llm_calls += 1
+                stats.llm_errors += int(error is not None)
+                stats.retries += int(retry)
+                stats.llm_seconds += seconds
+                stats.latency_buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            # Raw latencies only per run, the process-wide view keeps the histogram.
+            if error is None:
+                run_stats.llm_latencies.append(seconds)
+
+    def record_cache(self, hits: int = 0, misses: int = 0) -> None:
+        thread_id, node = current_node.get() or ("", "unknown")
+        with self._lock:
+            for stats in self._stats(thread_id, node):
+                stats.cache_hits += hits
+                stats.cache_misses += misses
+
+    def record_parse(self, failures: int = 0, repairs: int = 0, repair_failures: int = 0) -> None:
+        """
+        Record structured outputs that did not match their schema, and how their repair went.
+        """
+        thread_id, node = current_node.get() or ("", "unknown")
+        with self._lock:
+            for stats in self._stats(thread_id, node):
+                stats.parse_failures += failures
+                stats.repairs += repairs
+                stats.repair_failures += repair_failures
+
+    def report(self, thread_id: str) -> Optional[dict]:
+        """
+        JSON-ready report of one run: per-node stats and their totals.
+        """
+        with self._lock:
+            run = self.runs.get(thread_id)
+            if run is None:
+                return None
+            nodes = {name: stats.as_dict() for name, stats in run["nodes"].items()}
+            latencies = [s for stats in run["nodes"].values() for s in stats.llm_latencies]
+            started, finished = run["started_at"], run["finished_at"]
+        total = lambda key: sum(node[key] for node in nodes.values())
+        return {
+            "thread_id": thread_id,
+            "started_at": started,
+            "finished_at": finished,
+            "wall_seconds": round(finished - started, 3),
+            "nodes": nodes,
+            "totals": {
+                "llm_calls": total("llm_calls"),
+                "llm_errors": total("llm_errors"),
+                "retries": total("retries"),
+                "llm_latency_p50": percentile(latencies, 0.50),
+                "llm_latency_p90": percentile(latencies, 0.90),
+                "llm_latency_p99": percentile(latencies, 0.99),
+                "prompt_tokens": total("prompt_tokens"),
+                "completion_tokens": total("completion_tokens"),
+                "cache_hits": total("cache_hits"),
+                "cache_misses": total("cache_misses"),
+                "parse_failures": total("parse_failures"),
+                "repairs": total("repairs"),
+                "repair_failures": total("repair_failures"),
+                "estimated_cost_usd": round(total("estimated_cost_usd"), 6),
+            },
+        }
+
+    def write_report(self, thread_id: str, directory: str = RUN_REPORT_DIR) -> Optional[str]:
+        """
+        Write the run report to `directory`/<thread_id>.json.
+        Returns:
+                str: The file path, None if the run recorded nothing.
+        """
+        report = self.report(thread_id)
+        if report is None:
+            return None
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{thread_id}.json")
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        return path
+
+    def prometheus(self) -> str:
+        """
+        Process-wide totals in the Prometheus text exposition format.
+        """
+        lines = []
+
+        def metric(name: str, kind: str, help: str, samples):
+            lines.append(f"# HELP bookeditor_{name} {help}")
+            lines.append(f"# TYPE bookeditor_{name} {kind}")
+            for labels, value in samples:
+                label = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"bookeditor_{name}{{{label}}} {value}")
+
+        with self._lock:
+            totals = list(self.totals.items())
+            metric("node_calls_total", "counter", "Node executions.", [({"node": n}, s.calls) for n, s in totals])
+            metric("node_errors_total", "counter", "Node executions that raised.", [({"node": n}, s.errors) for n, s in totals])
+            metric("node_seconds_total", "counter", "Wall time spent in nodes.", [({"node": n}, round(s.seconds, 6)) for n, s in totals])
+            metric("llm_retries_total", "counter", "LLM calls retried on another client after a 429/5xx.", [({"node": n}, s.retries) for n, s in totals])
+            metric("tokens_total", "counter", "Tokens used, by node and kind.", [
+                sample for n, s in totals
+                for sample in (({"node": n, "kind": "prompt"}, s.prompt_tokens), ({"node": n, "kind": "completion"}, s.completion_tokens))
+            ])
+            metric("cache_hits_total", "counter", "Expansion cache hits.", [({"node": n}, s.cache_hits) for n, s in totals])
+            metric("cache_misses_total", "counter", "Expansion cache misses.", [({"node": n}, s.cache_misses) for n, s in totals])
+            metric("parse_failures_total", "counter", "Structured outputs that did not match their schema.", [({"node": n}, s.parse_failures) for n, s in totals])
+            metric("repairs_total", "counter", "Structured outputs fixed by a repair call.", [({"node": n}, s.repairs) for n, s in totals])
+            metric("repair_failures_total", "counter", "Structured outputs still invalid after their repair call.", [({"node": n}, s.repair_failures) for n, s in totals])
+            metric("estimated_cost_usd_total", "counter", "Estimated LLM cost.", [({"node": n}, round(s.cost, 6)) for n, s in totals])
+            metric("llm_client_calls_total", "counter", "LLM calls per router client.", [({"client": c}, v["calls"]) for c, v in self.clients.items()])
+            metric("llm_client_errors_total", "counter", "Failed LLM calls per router client.", [({"client": c}, v["errors"]) for c, v in self.clients.items()])
+
+            lines.append("# HELP bookeditor_llm_latency_seconds LLM call latency.")
+            lines.append("# TYPE bookeditor_llm_latency_seconds histogram")
+            for n, s in totals:
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), s.latency_buckets):
+                    cumulative += count
+                    lines.append(f'bookeditor_llm_latency_seconds_bucket{{node="{n}",le="{bound}"}} {cumulative}')
+                lines.append(f'bookeditor_llm_latency_seconds_sum{{node="{n}"}} {round(s.llm_seconds, 6)}')
+                lines.append(f'bookeditor_llm_latency_seconds_count{{node="{n}"}} {s.llm_calls}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def instrument(node: str, fn, engine: Optional[Callable[[dict], str]] = None):
+    """
+    Wrap a node function to record its wall time, errors and token usage, and to
+    attribute the LLM calls it makes. The wrapper has fn's signature plus a `config`
+    parameter, so LangGraph injects the run config (the thread_id is read from it, which
+    works in the worker threads `astream` runs sync nodes on) and still injects `writer`.
+    Args:
+            engine (callable): The engine a state runs its LLM calls with, so "batch" runs
+                    are priced at the batch rate; the state's `engine` by default.
+    """
+    engine = engine or (lambda state: state.get("engine"))
+    signature = inspect.signature(fn)
+    takes_config = "config" in signature.parameters
+
+    @wraps(fn)
+    def wrapper(state, config: "RunnableConfig", **kwargs):
+        thread_id = (config or {}).get("configurable", {}).get("thread_id") or ""
+        token = current_node.set((thread_id, node))
+        start = time.perf_counter()
+        update, error = None, False
+        try:
+            if takes_config:
+                kwargs["config"] = config
+            update = fn(state, **kwargs)
+            return update
+        except Exception:
+            error = True
+            raise
+        finally:
+            metrics.record_node(
+                thread_id, node, time.perf_counter() - start, error, update, batch=engine(state) == "batch"
+            )
+            current_node.reset(token)
+
+    if not takes_config:
+        params = [p for p in signature.parameters.values() if p.kind != p.VAR_KEYWORD]
+        params.append(inspect.Parameter("config", inspect.Parameter.KEYWORD_ONLY))
+        params += [p for p in signature.parameters.values() if p.kind == p.VAR_KEYWORD]
+        signature = signature.replace(parameters=params)
+    # The signature is set explicitly rather than followed through __wrapped__: at compile
+    # LangGraph reads the source of a node (and of what it wraps) looking for subgraphs,
+    # and parsing every node function of nodes.py was most of the graph's import time.
+    wrapper.__signature__ = signature
+    del wrapper.__wrapped__
+    return wrapper
@@ -1,50 +1,434 @@
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
+from functools import partial
 from dotenv import load_dotenv
-from crewai import Agent, Crew, Task
-from llms import llm
-from typing import List
-from states import StateIn, Book, ChapterTitleList, Chapter, TOC, ExpandedChapter, Extras
-from utils import read_google_sheet, generate_books_with_limited_overlap1
+from langchain_core.runnables import RunnableConfig
+from langgraph.types import Send, StreamWriter
+from llms import LLM_DEFAULT_CALL_TOKENS, OPENAI_API_KEYS, LLMClient, LLMRouter, get_router
+from batch import BatchClient, chat_request, complete, get_batch_client, task_request
+from typing import List, Tuple
+from states import StateIn, BookState, Book, Bio, Chapter, ChapterExpansion, TOC, ExpandedChapter, Extras, GeneratedBook, SectionOutline
+from utils import select_book_indices
+from sources import get_source
+from structured import deferred_converter, output_text, parse_output, repair
+from prompts import (
+    bio_task_prompt,
+    chapter_digest_prompt,
+    expand_chapter_prompt,
+    expand_chapter_task_prompt,
+    expander_system_prompt,
+    extras_task_prompt,
+    longform_outline_prompt,
+    longform_section_prompt,
+    longform_transition_prompt,
+    preface_task_prompt,
+    toc_task_prompt,
+)
+from cache import cache_key, get_expansion_cache
+from events import emit, token_usage
+from checkpoint import build_log, chapter_journal
+from scheduler import get_scheduler, single_flight
+from metrics import metrics
+from blobs import available, resolve, store_text
+from output import OUTPUT_DIR, OUTPUT_FORMAT, BookSink, NullSink, get_sink
+from tokens import (
+    DEFAULT_MAX_TOKENS,
+    BIO_COMPLETION_TOKENS,
+    DIGEST_COMPLETION_TOKENS,
+    EXPANSION_COMPLETION_TOKENS,
+    EXTRAS_COMPLETION_TOKENS,
+    OUTLINE_COMPLETION_TOKENS,
+    PREFACE_COMPLETION_TOKENS,
+    SECTION_COMPLETION_TOKENS,
+    TOC_COMPLETION_TOKENS,
+    TRANSITION_COMPLETION_TOKENS,
+    UsageMeter,
+    count_tokens,
+    fit_to_budget,
+    prompt_budget,
+    truncate_tokens,
+)
 
 load_dotenv()
 
+# Upper bound on crews running at the same time, overridable per run with `max_concurrency`.
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", 4))
+# "crew" (default), "direct" or "batch", overridable per run with `engine`.
+EXPANSION_ENGINE = os.getenv("EXPANSION_ENGINE", "crew")
+# "chapter" (default) or "longform", overridable per run with `expansion`.
+EXPANSION_MODE = os.getenv("EXPANSION_MODE", "chapter")
+# Size of a long-form manuscript, and the number of sections its outline asks for.
+LONGFORM_WORDS = int(os.getenv("LONGFORM_WORDS", 10000))
+LONGFORM_SECTIONS = int(os.getenv("LONGFORM_SECTIONS", 8))
 
-def read_sheet(state: StateIn) -> StateIn:
+# "overlap" (default) or "diverse", overridable per run with `selection`.
+SELECTION_MODE = os.getenv("SELECTION_MODE", "overlap")
+# With "diverse", chapters more similar than this (cosine) count as the same chapter; per run `max_similarity`.
+MAX_SIMILARITY = float(os.getenv("MAX_SIMILARITY", 0.85))
+
+# Incremental rebuilds by default; per run `delta`.
+DELTA_BUILDS = os.getenv("DELTA_BUILDS", "0") == "1"
+
+# Run options copied from the run state into every book pipeline.
+RUN_OPTIONS = ("max_tokens", "max_concurrency", "engine", "expansion", "output_lang", "output_format", "openai_api_key")
+
+# Scheduler priorities within a book: finishing a book goes before expanding more chapters.
+STAGE_FINISH = 0
+STAGE_EXPAND = 1
+
+
+def concurrency(state) -> int:
+    """
+    Max number of LLM calls in flight for this run, across all books.
+    """
+    return max(1, int(state.get("max_concurrency") or MAX_CONCURRENCY))
+
+
+def similarity_threshold(state) -> float:
+    """
+    Cosine similarity above which "diverse" selection counts two chapters as the
+    same: the run's `max_similarity`, 0.0 included, else MAX_SIMILARITY.
+    """
+    value = state.get("max_similarity")
+    return float(MAX_SIMILARITY if value is None else value)
+
+
+def expansion_engine(state) -> str:
+    """
+    The engine of the run's LLM calls: its `engine`, else EXPANSION_ENGINE.
+    """
+    return state.get("engine") or EXPANSION_ENGINE
+
+
+def llm_slot(state: BookState, config: RunnableConfig, stage: int):
+    """
+    Wait for a slot of the run's shared LLM budget (see scheduler.LLMScheduler),
+    or of the budget of its `llm_pool` when several runs share one (see jobs.JobManager).
+    Usage: `with llm_slot(state, config, STAGE_EXPAND): ...`
+    """
+    configurable = config["configurable"]
+    scheduler = get_scheduler(configurable.get("llm_pool") or configurable.get("thread_id"), concurrency(state))
+    return scheduler.slot((state.get("book_index", 0), stage))
+
+
+def llm_router(state) -> LLMRouter:
+    """
+    Router the run's LLM calls go through: the shared key pool, or the run's own `openai_api_key`.
+    """
+    return get_router(state.get("openai_api_key"))
+
+
+def batch_client(state) -> BatchClient:
     """
-    Read a sheet from an Excel file and convert it to JSON.
+    Batch API client of the run's `openai_api_key`, or of the first pool key.
+    """
+    api_key = state.get("openai_api_key") or (OPENAI_API_KEYS[0] if OPENAI_API_KEYS else None)
+    if not api_key:
+        raise ValueError("engine 'batch' needs openai_api_key or OPENAI_API_KEY(S)")
+    return get_batch_client(api_key)
+
+
+def book_sink(state, config: RunnableConfig) -> BookSink:
+    """
+    Sink of the run's `output_format`, writing under OUTPUT_DIR/<thread_id>.
+    """
+    return get_sink(state.get("output_format"), os.path.join(OUTPUT_DIR, config["configurable"].get("thread_id") or "default"))
+
+
+def run_crew(state, config: RunnableConfig, build_crew, tokens: int = LLM_DEFAULT_CALL_TOKENS):
+    """
+    Run the one-task crew `build_crew(client)` of a finishing node.
+    With engine "batch" the task is sent as a plain chat request in the next
+    batch instead; the result reads the same (str(), json_dict, token_usage).
+    """
+    router = llm_router(state)
+    if expansion_engine(state) == "batch":
+        crew = build_crew(router.clients[0])
+        return complete(batch_client(state), task_request(crew.agents[0], crew.tasks[0], router.model_name))
+    with llm_slot(state, config, STAGE_FINISH):
+        return router.run(lambda client: build_crew(client).kickoff(), tokens=tokens)
+
+
+def parse_structured(state, config: RunnableConfig, schema, output, meter: UsageMeter, stage: int = STAGE_FINISH, client: LLMClient = None, fixed: dict = None):
+    """
+    The `schema` model of an LLM result (crew, batch or chat model output). Fields
+    are validated one by one; if any is missing or invalid, the failure is counted
+    for the running node and only the broken fields are asked for again, with the
+    model's native structured output (see structured.repair).
+    Args:
+            state, config: Of the calling node, for the scheduler slot and router of the repair call.
+            schema: The pydantic model the result must match.
+            output: The result.
+            meter (UsageMeter): Records the tokens of the repair call.
+            stage (int): Scheduler priority of the repair call.
+            client (LLMClient): Make the repair call with this client, when the caller already holds a slot.
+            fixed (dict): Values known without the LLM, e.g. the chapter title.
+    Returns:
+            The validated model.
+    Raises:
+            StructuredOutputError: If the result is still invalid after the repair.
+    """
+    model, valid, errors = parse_output(schema, output, fixed)
+    if model is not None:
+        return model
+    metrics.record_parse(failures=1)
+    print("PARSE:::", schema.__name__, "invalid fields", sorted(errors))
+    text = output_text(output)
+
+    def run(client: LLMClient):
+        repaired, usage = repair(client.chat_model, schema, text, valid, errors)
+        meter.record(usage)
+        return repaired
+
+    try:
+        if client is not None:
+            model = run(client)
+        else:
+            with llm_slot(state, config, stage):
+                model = llm_router(state).run(run)
+    except Exception:
+        metrics.record_parse(repair_failures=1)
+        raise
+    metrics.record_parse(repairs=1)
+    return model
+
+
+def read_sheet(state: StateIn) -> dict:
+    """
+    Read the chapters from the run's source: a Google Sheet, a local CSV, XLSX or
+    Parquet file, or fake chapters (see sources.get_source).
+    Local files are read and validated in chunks.
     Args:
             state (StateIn)
     Returns:
-            StateIn: The updated state with the chapters data.
+            dict: State update with the ChapterCatalog of the valid chapters.
     """
-    sheet_id = state["sheet_id"]
-    state["chapter_list"] = read_google_sheet(sheet_id=sheet_id)
-    return state
+    catalog = get_source(state["sheet_id"]).read()
+    print(f"CHAPTERS:::{len(catalog)}")
+    return {"chapter_list": catalog}
 
 
-def generate_combinations(state: StateIn) -> StateIn:
-    structed_book: list[Book] = []
-    unstructured_books = []
-    books_list = generate_books_with_limited_overlap1(
-        chapters=state["chapter_list"],
-        r=state["r_chapters"],
-        max_docs=state["max_docs"],
-        max_overlap=state["max_overlap"],
+def build_key(state: StateIn) -> str:
+    """
+    Runs with the same key are versions of the same build (see checkpoint.BuildLog):
+    same source, book settings, model, language and expansion.
+    """
+    selection = state.get("selection") or SELECTION_MODE
+    return cache_key(
+        "build",
+        state["sheet_id"],
+        state["r_chapters"],
+        state["max_docs"],
+        state["max_overlap"],
+        state.get("seed") or 0,
+        selection,
+        similarity_threshold(state) if selection == "diverse" else None,
+        state.get("expansion") or EXPANSION_MODE,
+        state.get("output_lang"),
+        llm_router(state).model_name,
     )
-    for i, books in enumerate(books_list):
-        book = Book(chapters=books.chapters, book_title=f"Book {i + 1}:")
-        unstructured_books.append(books)
-        structed_book.append(book)
 
-    state["books"] = structed_book
-    # print(structed_book)
-    return state
+
+def blobs_available(value) -> bool:
+    """
+    False if any blob reference in `value` (nested dicts and lists) is no longer on disk.
+    """
+    if isinstance(value, dict):
+        return all(blobs_available(v) for v in value.values())
+    if isinstance(value, list):
+        return all(blobs_available(v) for v in value)
+    return available(value) if isinstance(value, str) else True
+
+
+def generate_combinations(state: StateIn, config: RunnableConfig) -> dict:
+    """
+    Draw the books from the chapters. With `selection` "overlap" books share at
+    most `max_overlap` chapters; with "diverse" the chapters are embedded (see
+    embeddings.EmbeddingIndex) and chapters more similar than `max_similarity`
+    also count as the same chapter, so no book holds two near-duplicates and
+    near-duplicates count towards the overlap between books.
+    Every row is fingerprinted and the plan (row fingerprints, rows of every
+    book) recorded in the build log. With `delta`, the books of the previous run
+    of the same build are kept as they were, and only those holding a row whose
+    fingerprint changed are rebuilt; the others are passed on to be written from
+    the previous run's result (see write_doc). Unchanged chapters of rebuilt
+    books come from the expansion cache. If rows were added or removed, every
+    book is rebuilt.
+    Args:
+            state (StateIn)
+    Returns:
+            dict: State update with the books, the build key and the books to reuse.
+    """
+    catalog = state["chapter_list"]
+    selection = state.get("selection") or SELECTION_MODE
+    if selection not in ("overlap", "diverse"):
+        raise ValueError(f"Unknown selection {selection!r}, expected 'overlap' or 'diverse'")
+    thread_id = config["configurable"].get("thread_id")
+    build = build_key(state)
+    rows = [cache_key(title, content) for title, content in catalog.texts()]
+
+    delta = state.get("delta")
+    previous = None
+    if DELTA_BUILDS if delta is None else delta:
+        # Looked up before this run is recorded, which replaces an earlier run on the same thread.
+        previous = build_log.latest(build)
+        if previous is None:
+            print("DELTA::: no previous run of this build, building every book")
+        elif len(previous["rows"]) != len(rows):
+            print(f"DELTA::: {len(previous['rows'])} -> {len(rows)} rows, building every book")
+            previous = None
+
+    reused = []
+    if previous is not None:
+        packed = previous["books"]
+        changed = {i for i, (old, new) in enumerate(zip(previous["rows"], rows)) if old != new}
+        for i, indices in enumerate(packed):
+            result = previous["results"].get(i)
+            if result is not None and not changed.intersection(indices) and blobs_available(result["generated"]):
+                reused.append({"book_index": i, **result})
+        print(f"DELTA::: {len(changed)} changed row(s), rebuilding {len(packed) - len(reused)} of {len(packed)} books, "
+              f"reusing the rest from {previous['thread_id']}")
+    else:
+        vectors = None
+        max_similarity = similarity_threshold(state)
+        if selection == "diverse":
+            from embeddings import embed_texts, get_embedding_index
+
+            vectors = embed_texts(
+                [f"{title}\n{content}" for title, content in catalog.texts()],
+                api_key=state.get("openai_api_key"),
+            )
+            print("EMBEDDINGS:::", get_embedding_index().stats)
+        packed = select_book_indices(
+            len(catalog),
+            r=state["r_chapters"],
+            max_docs=state["max_docs"],
+            max_overlap=state["max_overlap"],
+            seed=state.get("seed") or 0,
+            vectors=vectors,
+            max_similarity=max_similarity,
+        )
+
+    build_log.start(build, thread_id, rows, packed)
+    structed_book: list[Book] = [
+        Book(chapters=[catalog[c] for c in indices], book_title=f"Book {i + 1}:")
+        for i, indices in enumerate(packed)
+    ]
+    return {"books": structed_book, "build": build, "reused_books": reused}
+
+
+def dispatch_books(state: StateIn) -> List[Send]:
+    """
+    Fan out one book pipeline per book. Each book is expanded, finished and
+    emitted on its own, so the first books complete while later ones are still
+    expanding; the shared scheduler keeps the LLM budget busy across all of them.
+    Books reused from the previous run of the build go with their finished
+    book and skip straight to write_doc (see route_book).
+    """
+    options = {key: state.get(key) for key in RUN_OPTIONS}
+    reused = {result["book_index"]: result for result in state.get("reused_books") or []}
+    sends = []
+    for i, book in enumerate(state["books"]):
+        payload = {"book": book, "book_index": i, "build": state.get("build"), **options}
+        if i in reused:
+            payload["generated"] = GeneratedBook(**reused[i]["generated"])
+            payload["previous"] = reused[i]
+        sends.append(Send("book_pipeline", payload))
+    return sends
+
+
+def route_book(state: BookState) -> str:
+    """
+    Entry of the book pipeline: a book reused from the previous run is only written.
+    """
+    return "write_doc" if state.get("generated") is not None else "generate_book"
+
+
+def chapter_digests(book: Book) -> List[str]:
+    """
+    One "## title" section per chapter holding its digest, falling back to
+    the chapter content for chapters without one.
+    """
+    return [
+        f"## {ch.chapter_title}\n{resolve(getattr(ch, 'digest', None)) or ch.content}"
+        for ch in book.chapters
+    ]
+
+
+def book_prompt(state: BookState, template: str, completion_tokens: int, meter: UsageMeter, **fields) -> Tuple[str, int]:
+    """
+    Fill `template` with the book's title and chapter digests as `{book}`, the view
+    of the whole book the preface, extras, bio and TOC are written from. The digests
+    are truncated evenly if prompt plus `completion_tokens` would exceed `max_tokens`.
+    Args:
+            template (str): Prompt with a `{book}` field.
+            completion_tokens (int): Tokens reserved for the answer.
+            meter (UsageMeter): Records the planned prompt tokens.
+            fields: The template's other fields.
+    Returns:
+            tuple: The prompt, and the tokens of the whole call for the router.
+    Raises:
+            ValueError: If the template and completion alone do not fit in `max_tokens`.
+    """
+    book = state["book"]
+    max_tokens = int(state.get("max_tokens") or DEFAULT_MAX_TOKENS)
+    model_name = llm_router(state).model_name
+    header = f"# {book.book_title}"
+    budget = prompt_budget(max_tokens, template.format(book="", **fields), completion_tokens, model_name)
+    chapters = chapter_digests(book)
+    fitted = fit_to_budget(chapters, budget - count_tokens(header, model_name), model_name)
+    prompt = template.format(book="\n\n".join([header, *fitted]), **fields)
+    prompt_tokens = count_tokens(prompt, model_name)
+    meter.plan(prompt_tokens, truncated=fitted != chapters)
+    return prompt, prompt_tokens + completion_tokens
 
 
-def generate_book(state:StateIn) -> StateIn:
+def split_opening(text: str, sentences: int = 3) -> tuple:
+    """
+    Split a section into its opening and the rest: the first paragraph, or the
+    first `sentences` sentences of a section written as a single paragraph.
+    Returns:
+            tuple: (opening, rest), rest empty if the section is no longer than its opening.
+    """
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", text.strip()) if p.strip()]
+    if len(paragraphs) > 1:
+        return paragraphs[0], "\n\n".join(paragraphs[1:])
+    parts = re.split(r"(?<=[.!?])\s+", text.strip())
+    return " ".join(parts[:sentences]), " ".join(parts[sentences:])
+
+
+def in_parallel(fn, items) -> list:
+    """
+    `fn` of every item on its own thread, results in order. Threads only wait for
+    their LLM calls, every call still takes a scheduler slot.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, len(items))) as executor:
+        return [f.result() for f in [executor.submit(copy_context().run, fn, item) for item in items]]
 
-    # --- Define Agents and Task functions ---
-    expander_agent = Agent(
+
+def section_prompt(ch: Chapter, outline: List[str], i: int) -> str:
+    """
+    Prompt for section `i` of the long-form manuscript of `ch`.
+    """
+    return longform_section_prompt.format(
+        chapter_title=ch.chapter_title,
+        chapter_content=ch.content,
+        outline="\n".join(f"{n + 1}. {line}" for n, line in enumerate(outline)),
+        previous_section=outline[i - 1] if i > 0 else "None, this is the first section.",
+        next_section=outline[i + 1] if i + 1 < len(outline) else "None, this is the last section.",
+        number=i + 1,
+        sections=len(outline),
+        section=outline[i].split(":", 1)[0].strip(),
+        words=max(1, LONGFORM_WORDS // len(outline)),
+    )
+
+
+def create_expander_agent(llm):
+    from crewai import Agent
+
+    return Agent(
         role="Philosophical Long-Form Expansion Expert",
         goal="Expand brief chapters into rich, deep, long-form philosophical content.",
         backstory=(
@@ -54,264 +438,635 @@ def generate_book(state:StateIn) -> StateIn:
         llm=llm,
     )
 
-    def create_expansion_task(chapter: Chapter) -> Task:
-        return Task(
-            description=(
-                f"Expand the following chapter into a deeply philosophical long-form essay of around 1,500 words.\n\n"
-                f"### Chapter Title: {chapter.chapter_title}\n\n"
-                f"### Original Content:\n{chapter.chapter_content}\n\n"
-                "Ensure a modern tone, reflective insights, logical flow, and high-quality transitions. "
-                "Avoid academic language or redundancy. Every paragraph must be engaging and valuable."
-            ),
-            expected_output="Expanded long-form version of the chapter, with keys chapter_title and chapter_content as provided in output_json format.",
-            agent=expander_agent,
-            output_json=ExpandedChapter
+
+def create_expansion_task(chapter: Chapter, expander_agent):
+    from crewai import Task
+
+    return Task(
+        description=expand_chapter_task_prompt.format(
+            chapter_title=chapter.chapter_title,
+            chapter_content=chapter.content,
+        ),
+        expected_output="Expanded long-form version of the chapter, with keys chapter_title and expanded_content as provided in output_json format.",
+        agent=expander_agent,
+        output_json=ChapterExpansion,
+        converter_cls=deferred_converter()
+    )
+
+
+class ChapterExpander:
+    """
+    Expands and digests the chapters of one book for generate_book.
+    The `engine` option picks between one CrewAI crew per chapter ("crew") and
+    structured-output calls straight to the llm ("direct"), which skips the agent
+    overhead. "batch" sends the direct requests through the OpenAI Batch API
+    instead, sharing batches with the other books, for large runs where cost
+    matters more than latency. With `expansion` "longform" a chapter becomes a
+    manuscript of about LONGFORM_WORDS words (see expand_longform), whatever the engine.
+    Every call waits for a slot of the run's shared scheduler and goes through the
+    run's LLM router, which spreads calls over the configured keys and providers.
+    """
+
+    def __init__(self, state: BookState, config: RunnableConfig, writer: StreamWriter):
+        self.state = state
+        self.config = config
+        self.writer = writer
+        self.book_index = state.get("book_index", 0)
+        self.engine = expansion_engine(state)
+        if self.engine not in ("crew", "direct", "batch"):
+            raise ValueError(f"Unknown expansion engine {self.engine!r}, expected 'crew', 'direct' or 'batch'")
+        expansion = state.get("expansion") or EXPANSION_MODE
+        if expansion not in ("chapter", "longform"):
+            raise ValueError(f"Unknown expansion {expansion!r}, expected 'chapter' or 'longform'")
+        self.longform = expansion == "longform"
+        self.longform_system = expand_chapter_prompt.format(output_language=state.get("output_lang") or "en")
+        self.batches = batch_client(state) if self.engine == "batch" else None
+        self.max_tokens = int(state.get("max_tokens") or DEFAULT_MAX_TOKENS)
+        self.router = llm_router(state)
+        self.model_name = self.router.model_name
+        self.meter = UsageMeter()
+        self.cache = get_expansion_cache()
+        self.thread_id = config["configurable"].get("thread_id")
+
+    # --- Planning and caching ---
+    def fit(self, ch: Chapter) -> Tuple[Chapter, int]:
+        """
+        Trim the chapter content so prompt plus expected completion stay within max_tokens.
+        Returns:
+                tuple: The trimmed chapter and the estimated prompt tokens of its expansion.
+        Raises:
+                ValueError: If the prompt cannot fit at all.
+        """
+        if self.longform:
+            # The largest long-form prompt is a section's: the chapter plus the outline.
+            empty = Chapter(chapter_title=ch.chapter_title, chapter_content="")
+            fixed = self.longform_system + section_prompt(empty, ["", ""], 0)
+            completion = SECTION_COMPLETION_TOKENS + OUTLINE_COMPLETION_TOKENS
+        else:
+            fixed = expander_system_prompt + expand_chapter_task_prompt.format(
+                chapter_title=ch.chapter_title, chapter_content=""
+            )
+            completion = EXPANSION_COMPLETION_TOKENS
+        budget = prompt_budget(self.max_tokens, fixed, completion, self.model_name)
+        content = truncate_tokens(ch.content, budget, self.model_name)
+        tokens = count_tokens(fixed, self.model_name) + count_tokens(content, self.model_name)
+        return Chapter(chapter_title=ch.chapter_title, chapter_content=content), tokens
+
+    def key(self, ch: Chapter) -> str:
+        # Of the fitted chapter: what is expanded depends on max_tokens, not only on the chapter.
+        if self.longform:
+            return cache_key(
+                "expand_chapter_longform",
+                ch.chapter_title,
+                ch.content,
+                self.longform_system,
+                longform_outline_prompt,
+                longform_section_prompt,
+                longform_transition_prompt,
+                LONGFORM_WORDS,
+                LONGFORM_SECTIONS,
+                self.router.model_name,
+                self.router.temperature,
+            )
+        return cache_key(
+            "expand_chapter",
+            ch.chapter_title,
+            ch.content,
+            expand_chapter_task_prompt,
+            self.router.model_name,
+            self.router.temperature,
+            self.state.get("output_lang"),
         )
 
-    def run_crews_in_loop(chapters: List[Chapter]):
-        expanded_chapters = []
-        for ch in chapters:
-            expander_task = create_expansion_task(ch)
+    def lookup(self, key: str):
+        cached = chapter_journal.get(self.thread_id, key) or self.cache.get(key)
+        # Entries hold blob references; one whose blob is gone counts as a miss.
+        if cached is None or not available(cached.get("expanded_content")):
+            return None
+        return ExpandedChapter(**cached)
+
+    def produce(self, key: str, planned: Chapter) -> ExpandedChapter:
+        """
+        Expand and digest a fitted chapter, unless it is journaled or cached by now, and store the result.
+        """
+        # Looked up again: another book may have finished this chapter in the meantime.
+        exp = self.lookup(key)
+        if exp is None and self.longform:
+            exp = self.expand_longform(planned)
+        elif exp is None:
+            prompt = expander_system_prompt + expand_chapter_task_prompt.format(
+                chapter_title=planned.chapter_title, chapter_content=planned.content
+            )
+            exp = self.call(partial(self.expand, planned), count_tokens(prompt, self.model_name) + EXPANSION_COMPLETION_TOKENS)
+        if not exp.digest:
+            prompt = self.digest_prompt(exp)
+            digest = self.call(partial(self.summarize, prompt), count_tokens(prompt, self.model_name) + DIGEST_COMPLETION_TOKENS)
+            exp = exp.model_copy(update={"digest": store_text(digest)})
+        # Stored as soon as it is done, so a failure elsewhere does not lose it.
+        self.cache.set(key, exp.model_dump())
+        chapter_journal.record(self.thread_id, key, exp.model_dump())
+        return exp
+
+    def call(self, fn, tokens: int):
+        # Batch requests wait in the batch queue, not for a scheduler slot or router client.
+        if self.engine == "batch":
+            return fn(None)
+        with llm_slot(self.state, self.config, STAGE_EXPAND):
+            return self.router.run(fn, tokens=tokens)
+
+    # --- One chapter, one call ---
+    def expand(self, ch: Chapter, client: LLMClient) -> ExpandedChapter:
+        if self.engine == "crew":
+            from crewai import Crew
+
+            # Each crew gets its own agent, crews running in parallel must not share one.
+            expander_agent = create_expander_agent(client.crew_llm)
             crew = Crew(
                 agents=[expander_agent],
-                tasks=[expander_task],
+                tasks=[create_expansion_task(ch, expander_agent)],
                 # verbose=True
             )
-            results = crew.kickoff()
-            print("RESULT:::-----------------------\n", results["chapter_title"])
-            expanded_chapters.append(
-                ExpandedChapter(
-                    chapter_title=ch.chapter_title,
-                    expanded_content=results["expanded_content"],
-                )
-            )
-        return expanded_chapters
+            output = crew.kickoff()
+            usage = token_usage(output)
+        elif self.engine == "direct":
+            # One structured-output call straight to the llm, no agent framing.
+            result = client.chat_model.with_structured_output(ChapterExpansion, include_raw=True).invoke([
+                ("system", expander_system_prompt),
+                ("human", expand_chapter_task_prompt.format(chapter_title=ch.chapter_title, chapter_content=ch.content)),
+            ])
+            output = result["parsed"] or result["raw"]
+            usage = getattr(result["raw"], "usage_metadata", None) or {}
+        else:
+            # Same request as the direct engine, sent in the next batch.
+            output = complete(self.batches, chat_request(
+                [
+                    {"role": "system", "content": expander_system_prompt},
+                    {"role": "user", "content": expand_chapter_task_prompt.format(
+                        chapter_title=ch.chapter_title,
+                        chapter_content=ch.content,
+                    )},
+                ],
+                model=self.model_name,
+                schema=ChapterExpansion,
+            ))
+            usage = output.token_usage
+        print("RESULT:::-----------------------\n", ch.chapter_title)
+        self.meter.record(usage)
+        emit(self.writer, "chapter_expanded", book_index=self.book_index, chapter_title=ch.chapter_title, cached=False, tokens=usage)
+        answer = output if isinstance(output, ChapterExpansion) else parse_structured(
+            self.state, self.config, ChapterExpansion, output, self.meter, STAGE_EXPAND, client, fixed={"chapter_title": ch.chapter_title}
+        )
+        return ExpandedChapter(chapter_title=ch.chapter_title, expanded_content=answer.expanded_content)
 
+    def digest_prompt(self, exp: ExpandedChapter) -> str:
+        fixed = chapter_digest_prompt.format(chapter_title=exp.chapter_title, expanded_content="")
+        budget = prompt_budget(self.max_tokens, fixed, DIGEST_COMPLETION_TOKENS, self.model_name)
+        return chapter_digest_prompt.format(
+            chapter_title=exp.chapter_title,
+            expanded_content=truncate_tokens(exp.content, budget, self.model_name),
+        )
 
-    # --- Run for all books ---
-    for book in state["books"]:
-        print(f"Book {state['books'].index(book) + 1}:-----------------------------------------")
-        # --- Run the crew in a loop to generate each chapter of a book ---
-        expanded_chapters = run_crews_in_loop(book.chapters)
-        book.chapters = expanded_chapters
-        book.book_title = f"Book {state['books'].index(book) + 1}:"
+    def summarize(self, prompt: str, client: LLMClient) -> str:
+        if client is None:
+            results = complete(self.batches, chat_request([{"role": "user", "content": prompt}], model=self.model_name))
+            self.meter.record(results.token_usage)
+            return str(results).strip()
+        out = client.chat_model.invoke(prompt)
+        self.meter.record(getattr(out, "usage_metadata", None) or {})
+        return out.content.strip()
 
-    # print("BOOKS:::-----------------------\n", state["books"])
-    return state
+    # --- Long-form ---
+    def ask(self, messages: list, completion_tokens: int, usage: UsageMeter, schema=None):
+        """
+        One long-form call: the text of the answer, or the `schema` it was parsed into.
+        Its tokens are recorded in the node's meter and in `usage`, the chapter's.
+        """
+        def run(client):
+            if client is None:
+                results = complete(self.batches, chat_request(
+                    [{"role": "user" if role == "human" else role, "content": content} for role, content in messages],
+                    model=self.model_name,
+                    schema=schema,
+                ))
+                answer, reported = (results if schema else str(results).strip()), results.token_usage
+            elif schema is not None:
+                output = client.chat_model.with_structured_output(schema, include_raw=True).invoke(messages)
+                answer, reported = (output["parsed"] or output["raw"]), getattr(output["raw"], "usage_metadata", None) or {}
+            else:
+                out = client.chat_model.invoke(messages)
+                answer, reported = out.content.strip(), getattr(out, "usage_metadata", None) or {}
+            self.meter.record(reported)
+            usage.record(reported)
+            if schema is not None and not isinstance(answer, schema):
+                repaired = UsageMeter()
+                answer = parse_structured(self.state, self.config, schema, answer, repaired, STAGE_EXPAND, client)
+                if repaired.calls:
+                    self.meter.record(repaired.as_dict())
+                    usage.record(repaired.as_dict())
+            return answer
 
+        prompt_tokens = sum(count_tokens(content, self.model_name) for _, content in messages)
+        return self.call(run, prompt_tokens + completion_tokens)
+
+    def expand_longform(self, ch: Chapter) -> ExpandedChapter:
+        """
+        An outline of the chapter's sections first, then every section at once (each
+        with the outline and its neighbours in the prompt), then the opening of every
+        section reworked against the end of the previous one, also all at once.
+        These calls go straight to the llm, or the batch queue with engine "batch".
+        """
+        usage = UsageMeter()
+        system = self.longform_system
+        plan = self.ask([("system", system), ("human", longform_outline_prompt.format(
+            sections=LONGFORM_SECTIONS,
+            words=LONGFORM_WORDS,
+            chapter_title=ch.chapter_title,
+            chapter_content=ch.content,
+        ))], OUTLINE_COMPLETION_TOKENS, usage, schema=SectionOutline)
+        outline = [line.strip() for line in plan.sections if line.strip()][:LONGFORM_SECTIONS]
+        if not outline:
+            raise ValueError(f"Empty outline for the long-form expansion of {ch.chapter_title}")
+
+        sections = in_parallel(
+            lambda i: self.ask([("system", system), ("human", section_prompt(ch, outline, i))], SECTION_COMPLETION_TOKENS, usage),
+            range(len(outline)),
+        )
+
+        def smooth(i: int) -> str:
+            # Rework the opening of section i so it follows on from the end of section i - 1.
+            opening, rest = split_opening(sections[i])
+            if not rest:
+                return sections[i]
+            previous = re.split(r"\n\s*\n", sections[i - 1].strip())[-1]
+            opening = self.ask([("system", system), ("human", longform_transition_prompt.format(
+                previous_section=outline[i - 1].split(":", 1)[0].strip(),
+                previous_paragraph=previous,
+                section=outline[i].split(":", 1)[0].strip(),
+                paragraph=opening,
+            ))], TRANSITION_COMPLETION_TOKENS, usage)
+            return f"{opening}\n\n{rest}"
+
+        sections = sections[:1] + in_parallel(smooth, range(1, len(sections)))
+        print("RESULT:::-----------------------\n", ch.chapter_title)
+        tokens = {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
+        emit(self.writer, "chapter_expanded", book_index=self.book_index, chapter_title=ch.chapter_title, cached=False, tokens=tokens)
+        return ExpandedChapter(chapter_title=ch.chapter_title, expanded_content="\n\n".join(sections))
 
-def generate_preface(state: StateIn) -> StateIn:
-    preface_agent = Agent(
-        role="Preface Writer",
-        goal="Compose a suitable preface that introduces the manuscript naturally",
-        backstory="A seasoned editor who writes introductory prefaces for nonfiction works.",
-        llm=llm,
-    )
 
-    def create_prefece_task(book) -> Task:
+def generate_book(state: BookState, config: RunnableConfig, writer: StreamWriter) -> dict:
+    """
+    Expand every chapter of one book (see ChapterExpander).
+    Chapters are expanded concurrently, at most `max_concurrency` LLM calls in
+    flight across all books. Each prompt is planned against `max_tokens` and the
+    chapter content truncated if needed. Expansions are cached on disk and
+    de-duplicated while in flight, so a chapter shared by several books, or seen
+    in an earlier run, is expanded and digested once. Every finished chapter is
+    journaled under the run's thread_id, so a resumed run continues from the last
+    finished chapter, and handed to the run's output sink as it completes.
+    Args:
+            state (BookState)
+    Returns:
+            dict: State update with the expanded book, chapters in their original order.
+    """
+    book = state["book"]
+    expander = ChapterExpander(state, config, writer)
+    sink = book_sink(state, config)
+
+    def write_chapter(key: str, exp: ExpandedChapter) -> None:
+        # At every position of the book the chapter is used in.
+        for position, k in enumerate(keys):
+            if k == key:
+                path = sink.write_chapter(expander.book_index, book.book_title, position, exp)
+                if path:
+                    emit(writer, "chapter_written", book_index=expander.book_index, chapter_title=exp.chapter_title, location=path)
+
+    # --- Only produce chapters that are not journaled or cached with a digest ---
+    # Planned before any call, so a chapter that cannot fit fails the node up front.
+    plans = [expander.fit(ch) for ch in book.chapters]
+    keys = [expander.key(ch) for ch, _ in plans]
+    by_key = {}
+    pending = {}
+    for key, ch, (fitted, estimate) in zip(keys, book.chapters, plans):
+        if key in by_key or key in pending:
+            continue
+        exp = expander.lookup(key)
+        if exp is not None and exp.digest:
+            by_key[key] = exp
+            emit(writer, "chapter_expanded", book_index=expander.book_index, chapter_title=ch.chapter_title, cached=True, tokens={})
+            write_chapter(key, exp)
+        else:
+            if exp is None:
+                expander.meter.plan(estimate, truncated=fitted.content != ch.content)
+            pending[key] = fitted
+
+    metrics.record_cache(hits=len(by_key), misses=len(pending))
+
+    # Threads only wait here, the scheduler decides how many calls actually run.
+    # Each runs in a copy of this context, so its LLM calls are attributed to this node.
+    with ThreadPoolExecutor(max_workers=max(1, len(pending))) as executor:
+        futures = {
+            executor.submit(copy_context().run, single_flight.do, key, partial(expander.produce, key, planned)): key
+            for key, planned in pending.items()
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            by_key[key] = future.result()
+            write_chapter(key, by_key[key])
+    print("EXPANSION CACHE:::", expander.cache.stats())
+    print("TOKENS:::", expander.meter.as_dict())
+
+    print(f"{book.book_title}-----------------------------------------")
+    expanded_book = Book(book_title=book.book_title, chapters=[by_key[key] for key in keys])
+    emit(writer, "book_expanded", book_index=expander.book_index, book_title=book.book_title)
+    return {"book": expanded_book, "token_usage": {"generate_book": expander.meter.as_dict()}}
+
+
+
+def generate_preface(state: BookState, config: RunnableConfig, writer: StreamWriter) -> dict:
+    """
+    Write the preface of the book.
+    Runs as one branch of the book's finishing stage, alongside extras, bio and TOC.
+    Returns:
+            dict: State update with `preface`.
+    """
+    from crewai import Agent, Crew, Task
+
+    def create_preface_agent(llm) -> Agent:
+        return Agent(
+            role="Preface Writer",
+            goal="Compose a suitable preface that introduces the manuscript naturally",
+            backstory="A seasoned editor who writes introductory prefaces for nonfiction works.",
+            llm=llm,
+        )
+
+    meter = UsageMeter()
+
+    def create_prefece_task(description: str, preface_agent: Agent) -> Task:
         return Task(
-            description=(f"""
-                You are a preface writer. 
-                You will be given a book with chapters.
-                Generate a preface for the book, summarizing its themes and purpose.
-                The preface should be engaging and set the tone for the reader.
-                This is the expanded book: {book}
-                """
-            ),
+            description=description,
             expected_output="Preface content.",
             agent=preface_agent,
         )
-    
-    for book in state["books"]:
-        preface_task = create_prefece_task(book)
+
+    def build_preface_crew(client: LLMClient) -> Crew:
+        preface_agent = create_preface_agent(client.crew_llm)
+        preface_task = create_prefece_task(description, preface_agent)
         preface_crew = Crew(
             agents=[preface_agent],
             tasks=[preface_task],
             # verbose=True
         )
-        
-        preface_results = preface_crew.kickoff()
-        print("PREFACE--RESULT:::-----------------------\n", preface_results)
-    return state
-
-
-def generate_extras(state: StateIn) -> StateIn:
-    extras_agent = Agent(
-        role="Introductory Chapter Strategist & Reader Onboarding Specialist",
-        goal=(
-            "Craft compelling, clear, and thoughtfully structured introductory chapters—"
-            "'Who Should Read This Book', 'Structure of This Book', and 'How to Use This Book'—"
-            "to guide the reader with purpose and inspire engagement. Each chapter should be "
-            "well-developed, engaging, and aligned with the book's tone and purpose. Each chapter should be around ~700 words long."
-        ),
-        backstory=(
-            "You are a highly experienced instructional designer and non-fiction editor. "
-            "You've helped bestselling authors create accessible entry points into deep and complex material. "
-            "You specialize in crafting reader-friendly guidance, setting context, framing expectations, and inspiring curiosity. "
-            "You know how to connect the reader to the material with clarity, empathy, and vision."
-        ),
-        llm=llm,
-    )
+        return preface_crew
 
-    def create_extras_task(book: Book) -> Task:
-        return Task(
-            description=(
-                f"""
-You are given the full content of a structured non-fiction book titled "{book.book_title}" composed of the following chapters:
-
-{[ch.chapter_title for ch in book.chapters]}
-
-Your task is to write **three well-developed introductory chapters**:
-1. **Who Should Read This Book** : Describe the ideal reader profile. Identify their problems, mindset, or goals. Help them self-identify and feel seen.
-2. **Structure of This Book** : Explain how the book is organized, chapter by chapter. Reveal the thought process behind the structure and how it benefits the reader.
-3. **How to Use This Book** : Provide practical guidance on how readers should approach the book. Should they read linearly or by topic? How should they take notes or reflect? Should they revisit sections?
-Each section must be **engaging, clearly written, and tuned to the tone and purpose of the book**. Be instructive but not dry. Use a warm, confident, yet professional voice.
-Each chapter should be around ~700 words long.
-Return a dictionary like:
-```json
-{{
-"who_should_read_this_book": "..."
-"how_to_use_this_book": "..."
-"structure_of_book": "..."
-}}
-```
-            """
+    book = state["book"]
+    description, tokens = book_prompt(state, preface_task_prompt, PREFACE_COMPLETION_TOKENS, meter)
+    preface_results = run_crew(state, config, build_preface_crew, tokens=tokens)
+    print("PREFACE--RESULT:::-----------------------\n", preface_results)
+    meter.record(token_usage(preface_results))
+    emit(writer, "preface_done", book_index=state["book_index"], book_title=book.book_title, preface=str(preface_results), tokens=token_usage(preface_results))
+    return {"preface": store_text(str(preface_results)), "token_usage": {"generate_preface": meter.as_dict()}}
+
+
+def generate_extras(state: BookState, config: RunnableConfig, writer: StreamWriter) -> dict:
+    """
+    Write the three introductory chapters of the book.
+    Returns:
+            dict: State update with `extras`.
+    """
+    from crewai import Agent, Crew, Task
+
+    def create_extras_agent(llm) -> Agent:
+        return Agent(
+            role="Introductory Chapter Strategist & Reader Onboarding Specialist",
+            goal=(
+                "Craft compelling, clear, and thoughtfully structured introductory chapters—"
+                "'Who Should Read This Book', 'Structure of This Book', and 'How to Use This Book'—"
+                "to guide the reader with purpose and inspire engagement. Each chapter should be "
+                "well-developed, engaging, and aligned with the book's tone and purpose. Each chapter should be around ~700 words long."
+            ),
+            backstory=(
+                "You are a highly experienced instructional designer and non-fiction editor. "
+                "You've helped bestselling authors create accessible entry points into deep and complex material. "
+                "You specialize in crafting reader-friendly guidance, setting context, framing expectations, and inspiring curiosity. "
+                "You know how to connect the reader to the material with clarity, empathy, and vision."
             ),
+            llm=llm,
+        )
+
+    meter = UsageMeter()
+
+    def create_extras_task(description: str, extras_agent: Agent) -> Task:
+        return Task(
+            description=description,
             expected_output="A dictionary with keys 'Who Should Read This Book', 'Structure of This Book', and 'How to Use This Book', and high-quality corresponding content as values.",
             agent=extras_agent,
-            output_json=Extras
+            output_json=Extras,
+            converter_cls=deferred_converter()
         )
 
-    for book in state["books"]:
-        extras_task = create_extras_task(book)
+    def build_extras_crew(client: LLMClient) -> Crew:
+        extras_agent = create_extras_agent(client.crew_llm)
+        extras_task = create_extras_task(description, extras_agent)
         extras_crew = Crew(
             agents=[extras_agent],
             tasks=[extras_task],
             # verbose=True
         )
-        
-        extras_results = extras_crew.kickoff()
-        extras_results = extras_results.strip().replace("```","").replace("json","")
-        print("Extras--RESULT:::-----------------------\n", extras_results)
-    return state
+        return extras_crew
 
+    book = state["book"]
+    description, tokens = book_prompt(state, extras_task_prompt, EXTRAS_COMPLETION_TOKENS, meter, book_title=book.book_title)
+    extras_results = run_crew(state, config, build_extras_crew, tokens=tokens)
+    print("Extras--RESULT:::-----------------------\n", extras_results)
+    meter.record(token_usage(extras_results))
+    emit(writer, "extras_done", book_index=state["book_index"], book_title=book.book_title, tokens=token_usage(extras_results))
+    return {"extras": parse_structured(state, config, Extras, extras_results, meter), "token_usage": {"generate_extras": meter.as_dict()}}
 
-def generate_bio(state: StateIn) -> StateIn:
-    bio_agent = Agent(
-        role="Author Bio Architect",
-        goal="Craft a compelling, trust-building author bio that resonates deeply with the book's philosophical and professional themes.",
-        backstory=(
-            "You are an accomplished narrative strategist and editorial consultant. "
-            "You specialize in transforming professional backgrounds into relatable and inspiring biographies. "
-            "Your bios bridge the gap between expertise and human connection, making the author feel both credible and approachable."
-        ),
-        llm=llm,
-    )
 
-    def create_bio_task(book: Book) -> Task:
-        author_info = (
-            "The author of this book has extensive experience in startups and international public companies. "
-            "They possess deep insights into organizational operations and specialize in resolving complex dilemmas. "
-            "Their career spans executive roles in public companies across the United States and Germany. "
-            "They have led major initiatives in general management, organizational transformation, and rapid growth. "
-            "Currently, the author advises senior executives and CEOs as a management consultant. "
-            f"This bio should reflect their relevance to the book titled '{book.book_title}' and its themes."
+def generate_bio(state: BookState, config: RunnableConfig, writer: StreamWriter) -> dict:
+    """
+    Write an author bio tuned to the book.
+    Returns:
+            dict: State update with `bio`.
+    """
+    from crewai import Agent, Crew, Task
+
+    def create_bio_agent(llm) -> Agent:
+        return Agent(
+            role="Author Bio Architect",
+            goal="Craft a compelling, trust-building author bio that resonates deeply with the book's philosophical and professional themes.",
+            backstory=(
+                "You are an accomplished narrative strategist and editorial consultant. "
+                "You specialize in transforming professional backgrounds into relatable and inspiring biographies. "
+                "Your bios bridge the gap between expertise and human connection, making the author feel both credible and approachable."
+            ),
+            llm=llm,
         )
+
+    meter = UsageMeter()
+
+    def create_bio_task(description: str, bio_agent: Agent) -> Task:
         return Task(
-            description=(
-                f"""
-Write a professional, engaging, and reader-resonant **author biography**.
-It should be concise (150–200 words), written in third-person, and speak to the author’s **credibility, unique experience, and personal connection** to the book’s subject.
-
-Author Info:
-{author_info}
-
-Output Format:
-```json
-{{
-  "bio": "..."
-}}
-"""
-            ),
+            description=description,
             expected_output="A JSON dictionary with a single key 'bio' and the biography string as the value.",
             agent=bio_agent,
+            output_json=Bio,
+            converter_cls=deferred_converter()
         )
 
-    for book in state["books"]:
-        bio_task = create_bio_task()
+    def build_bio_crew(client: LLMClient) -> Crew:
+        bio_agent = create_bio_agent(client.crew_llm)
+        bio_task = create_bio_task(description, bio_agent)
         bio_crew = Crew(
             agents=[bio_agent],
             tasks=[bio_task],
             # verbose=True
         )
-        
-        bio_results = bio_crew.kickoff()
-        bio_results = bio_results.strip().replace("```","").replace("json","")
-        print("Bio--RESULT:::-----------------------\n", bio_results)
-    return state
+        return bio_crew
 
-
-def generate_toc(state: StateIn) -> StateIn:
-    toc_agent = Agent(
-        role="Table of Contents Creator",
-        goal="Generate a structured table of contents for the book.",
-        backstory=(
-            "You are a seasoned editor and content strategist. "
-            "You excel at creating clear, logical, and engaging tables of contents that guide readers through complex material."
-        ),
-        llm=llm,
+    book = state["book"]
+    author_info = (
+        "The author of this book has extensive experience in startups and international public companies. "
+        "They possess deep insights into organizational operations and specialize in resolving complex dilemmas. "
+        "Their career spans executive roles in public companies across the United States and Germany. "
+        "They have led major initiatives in general management, organizational transformation, and rapid growth. "
+        "Currently, the author advises senior executives and CEOs as a management consultant. "
+        f"This bio should reflect their relevance to the book titled '{book.book_title}' and its themes."
     )
+    description, tokens = book_prompt(state, bio_task_prompt, BIO_COMPLETION_TOKENS, meter, author_info=author_info)
+    bio_results = run_crew(state, config, build_bio_crew, tokens=tokens)
+    print("Bio--RESULT:::-----------------------\n", bio_results)
+    meter.record(token_usage(bio_results))
+    emit(writer, "bio_done", book_index=state["book_index"], book_title=book.book_title, tokens=token_usage(bio_results))
+    return {"bio": parse_structured(state, config, Bio, bio_results, meter).bio, "token_usage": {"generate_bio": meter.as_dict()}}
 
-    def create_toc_task(book: Book) -> Task:
-        return Task(
-            description=(
-                f"""
-You are given the full content of a structured non-fiction book titled "{book.book_title}" composed of the following chapters:
-
-{[ch.chapter_title for ch in book.chapters]}
-Your task is to write a **Table of Contents** for the book.
-The table of contents should include:
-1. **Preface**: A brief introduction to the book.
-2. **Who Should Read This Book**: A description of the ideal reader profile.
-3. **Structure of This Book**: An explanation of how the book is organized, chapter by chapter.
-4. **How to Use This Book**: Practical guidance on how readers should approach the book.
-5. **Author Bio**: A brief biography of the author.
-6. **Chapters**: A list of all chapters in the book.
-The table of contents should be clear, engaging, and aligned with the book's tone and purpose.
-Return a dictionary like:
-```json
-{{
-"preface": "Preface",
-"who_should_read_this_book": "Who Should Read This Book",
-"structure_of_book": "Structure of This Book",
-"how_to_use_this_book": "How to Use This Book",
-"bio": "Author Bio",
-"chapter_list": {{
-  "chapter_titles": {book.chapters}
-}}
-}}
-```
-"""
+
+def generate_toc(state: BookState, config: RunnableConfig, writer: StreamWriter) -> dict:
+    """
+    Write the table of contents of the book.
+    Returns:
+            dict: State update with `toc`.
+    """
+    from crewai import Agent, Crew, Task
+
+    def create_toc_agent(llm) -> Agent:
+        return Agent(
+            role="Table of Contents Creator",
+            goal="Generate a structured table of contents for the book.",
+            backstory=(
+                "You are a seasoned editor and content strategist. "
+                "You excel at creating clear, logical, and engaging tables of contents that guide readers through complex material."
             ),
+            llm=llm,
+        )
+
+    meter = UsageMeter()
+
+    def create_toc_task(description: str, toc_agent: Agent) -> Task:
+        return Task(
+            description=description,
             expected_output="A JSON dictionary with keys 'preface', 'who_should_read_this_book', 'structure_of_book', 'how_to_use_this_book', 'bio', and 'chapter_list' with high-quality corresponding content as values.",
             agent=toc_agent,
-            output_json=TOC
+            output_json=TOC,
+            converter_cls=deferred_converter()
         )
-    for book in state["books"]:
-        toc_task = create_toc_task(book)
+    def build_toc_crew(client: LLMClient) -> Crew:
+        toc_agent = create_toc_agent(client.crew_llm)
+        toc_task = create_toc_task(description, toc_agent)
         toc_crew = Crew(
             agents=[toc_agent],
             tasks=[toc_task],
             # verbose=True
         )
-        
-        toc_results = toc_crew.kickoff()
-        toc_results = toc_results.strip().replace("```","").replace("json","")
-        print("TOC--RESULT:::-----------------------\n", toc_results)
+        return toc_crew
+
+    book = state["book"]
+    description, tokens = book_prompt(
+        state, toc_task_prompt, TOC_COMPLETION_TOKENS, meter,
+        book_title=book.book_title, chapter_titles=[ch.chapter_title for ch in book.chapters],
+    )
+    toc_results = run_crew(state, config, build_toc_crew, tokens=tokens)
+    print("TOC--RESULT:::-----------------------\n", toc_results)
+    meter.record(token_usage(toc_results))
+    emit(writer, "toc_done", book_index=state["book_index"], book_title=book.book_title, tokens=token_usage(toc_results))
+    return {"toc": parse_structured(state, config, TOC, toc_results, meter), "token_usage": {"generate_toc": meter.as_dict()}}
 
-    return state
 
 
-def write_doc():
-    # Implement the logic to write the generated book content to a document or file from the state variables.
-    pass
+def assemble_book(state: BookState, writer: StreamWriter) -> dict:
+    """
+    Join the book's finishing branches: merge the book with its preface, extras, bio and TOC.
+    Returns:
+            dict: State update with `generated`, the GeneratedBook for write_doc.
+    """
+    book = state["book"]
+    extras = state["extras"]
+    generated = GeneratedBook(
+        book_titles=[book.book_title],
+        preface=state["preface"],
+        additional_chapters=[
+            Chapter(chapter_title="Who Should Read This Book", chapter_content=extras.who_should_read_this_book),
+            Chapter(chapter_title="Structure of This Book", chapter_content=extras.structure_of_book),
+            Chapter(chapter_title="How to Use This Book", chapter_content=extras.how_to_use_this_book),
+        ],
+        bio=state["bio"],
+        table_of_contents=state["toc"].model_dump(),
+        chapters=book.chapters,
+    )
+    emit(writer, "book_finished", book_index=state["book_index"], book_title=book.book_title)
+    return {"generated": generated}
+
+
+def write_doc(state: BookState, config: RunnableConfig, writer: StreamWriter) -> dict:
+    """
+    Write the assembled book to the run's output sink (`output_format`: markdown,
+    docx, jsonl, google), as soon as this book is done rather than at the end of
+    the run. Only a short record of where the book went is passed back to the run,
+    so the run state does not grow with the books' text. With output_format "none"
+    the book itself, texts resolved from the blob store, goes to `books_generated` instead.
+    A book reused from the previous run of the build (see generate_combinations)
+    is written the same way from that run's result, except in Google Docs, where
+    the existing doc is kept. Every book's result is recorded in the build log.
+    Returns:
+            dict: State update appending to `books_written` (or `books_generated`), with the sink's `out_sheet`.
+    """
+    generated = state["generated"]
+    book_index = state["book_index"]
+    output_format = state.get("output_format") or OUTPUT_FORMAT
+    thread_id = config["configurable"].get("thread_id")
+    # Set for a book reused from the previous run of the build: that run's result.
+    previous = state.get("previous")
+    built_in = previous["built_in"] if previous else thread_id
+    sink = book_sink(state, config)
+    if isinstance(sink, NullSink):
+        record = None
+        update = {"books_generated": [generated.resolved()]}
+    elif previous and (previous.get("record") or {}).get("output_format") == output_format == "google":
+        # Already in Google Docs and listed in the output sheet.
+        record = previous["record"]
+        update = {"books_written": [{**record, "reused_from": built_in}], "out_sheet": sink.out_sheet}
+    else:
+        if previous:
+            # A rebuilt book's chapters were written while it was expanded; a reused one's are written here.
+            for position, chapter in enumerate(generated.chapters):
+                sink.write_chapter(book_index, state["book"].book_title, position, chapter)
+        location = sink.write_book(book_index, generated)
+        print(f"WRITTEN:::{generated.book_titles[0]} -> {location}")
+        emit(writer, "book_written", book_index=book_index, book_title=generated.book_titles[0], location=location)
+        record = {
+            "book_index": book_index,
+            "book_title": generated.book_titles[0],
+            "output_format": output_format,
+            "location": location,
+        }
+        update = {"books_written": [{**record, "reused_from": built_in} if previous else record], "out_sheet": sink.out_sheet}
+    if previous:
+        print(f"REUSED:::{generated.book_titles[0]} from {built_in}")
+        emit(writer, "book_reused", book_index=book_index, book_title=generated.book_titles[0], built_in=built_in)
+    if state.get("build"):
+        build_log.finish_book(state["build"], thread_id, book_index, {
+            "built_in": built_in,
+            "generated": generated.model_dump(),
+            "record": record,
+        })
+    return update
@@ -0,0 +1,244 @@
+import os
+import io
+import re
+import json
+import threading
+from typing import Dict, List, Optional, Union
+from states import Chapter, ExpandedChapter, GeneratedBook
+from blobs import atomic_write, resolve
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Finished chapters and books of a run are written to OUTPUT_DIR/<thread_id>/.
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "output")
+# "markdown" (default), "docx", "jsonl", "google" or "none", overridable per run with `output_format`.
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "markdown")
+# Sheet the "google" sink adds one row per book to, with a link to the book's Google Doc.
+OUTPUT_SHEET_ID = os.getenv("OUTPUT_SHEET_ID")
+
+OUTPUT_FORMATS = ("markdown", "docx", "jsonl", "google", "none")
+
+
+def slugify(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-") or "untitled"
+
+
+def book_name(book_index: int, book_title: str) -> str:
+    """
+    File name stem of a book, e.g. "book-001-book-1" for "Book 1:".
+    """
+    return f"book-{book_index + 1:03d}-{slugify(book_title)}"
+
+
+def chapter_text(chapter: Union[ExpandedChapter, Chapter]) -> str:
+    return chapter.content
+
+
+def book_sections(book: GeneratedBook) -> List[tuple]:
+    """
+    (heading, text) of every section of a book in reading order: preface,
+    introductory chapters, chapters and author bio.
+    """
+    return [
+        ("Preface", resolve(book.preface)),
+        *[(ch.chapter_title, chapter_text(ch)) for ch in book.additional_chapters],
+        *[(ch.chapter_title, chapter_text(ch)) for ch in book.chapters],
+        ("About the Author", resolve(book.bio)),
+    ]
+
+
+def book_record(book: GeneratedBook) -> dict:
+    """
+    The book as a JSON-ready dict, with every text read back from the blob store.
+    """
+    return book.resolved().model_dump()
+
+
+def render_markdown(book: GeneratedBook) -> str:
+    sections = book_sections(book)
+    lines = [f"# {' / '.join(book.book_titles)}", "", "## Table of Contents", ""]
+    lines += [f"- {heading}" for heading, _ in sections]
+    for heading, text in sections:
+        lines += ["", f"## {heading}", "", text.strip()]
+    return "\n".join(lines) + "\n"
+
+
+_append_locks: Dict[str, threading.Lock] = {}
+_append_locks_lock = threading.Lock()
+
+
+def append_line(path: str, record: dict) -> str:
+    """
+    Append one JSON record to a JSONL file in a single write, serialized per file,
+    so concurrent books never interleave. A record cut short by a crash is the
+    unterminated last line, which readers skip.
+    """
+    with _append_locks_lock:
+        lock = _append_locks.setdefault(os.path.abspath(path), threading.Lock())
+    data = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with lock, open(path, "ab") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return path
+
+
+class BookSink:
+    """
+    Where finished chapters and books go. generate_book hands over every chapter
+    as soon as it is expanded, write_doc the whole book once it is assembled,
+    so results show up while the run is still going and need not stay in the
+    graph state. `out_sheet` is the sheet books are listed in, if the sink has one.
+    """
+
+    out_sheet: Optional[str] = None
+
+    def write_chapter(self, book_index: int, book_title: str, position: int, chapter: ExpandedChapter) -> Optional[str]:
+        return None
+
+    def write_book(self, book_index: int, book: GeneratedBook) -> Optional[str]:
+        """
+        Returns:
+                str: Where the book was written (path or URL).
+        """
+        raise NotImplementedError
+
+
+class MarkdownSink(BookSink):
+    """
+    <directory>/<book>.md per book, and <directory>/<book>/<nn>-<chapter>.md
+    per chapter while the book is still being expanded.
+    """
+
+    extension = ".md"
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def render_chapter(self, chapter: ExpandedChapter) -> bytes:
+        return f"## {chapter.chapter_title}\n\n{chapter_text(chapter).strip()}\n".encode("utf-8")
+
+    def render_book(self, book: GeneratedBook) -> bytes:
+        return render_markdown(book).encode("utf-8")
+
+    def write_chapter(self, book_index, book_title, position, chapter):
+        name = f"{position + 1:02d}-{slugify(chapter.chapter_title)}{self.extension}"
+        return atomic_write(os.path.join(self.directory, book_name(book_index, book_title), name), self.render_chapter(chapter))
+
+    def write_book(self, book_index, book):
+        name = book_name(book_index, book.book_titles[0]) + self.extension
+        return atomic_write(os.path.join(self.directory, name), self.render_book(book))
+
+
+class DocxSink(MarkdownSink):
+    """
+    Same layout as MarkdownSink with .docx files. Needs python-docx.
+    """
+
+    extension = ".docx"
+
+    def __init__(self, directory: str):
+        try:
+            import docx
+        except ImportError as e:
+            raise ImportError("output_format 'docx' needs python-docx: pip install python-docx") from e
+        super().__init__(directory)
+        self.docx = docx
+
+    def render(self, title: str, sections: List[tuple]) -> bytes:
+        document = self.docx.Document()
+        document.add_heading(title, level=0)
+        for heading, text in sections:
+            document.add_heading(heading, level=1)
+            for paragraph in re.split(r"\n\s*\n", text.strip()):
+                document.add_paragraph(paragraph.strip())
+        buffer = io.BytesIO()
+        document.save(buffer)
+        return buffer.getvalue()
+
+    def render_chapter(self, chapter):
+        return self.render(chapter.chapter_title, [(chapter.chapter_title, chapter_text(chapter))])
+
+    def render_book(self, book):
+        return self.render(" / ".join(book.book_titles), book_sections(book))
+
+
+class JsonlSink(BookSink):
+    """
+    One line per chapter in <directory>/chapters.jsonl and one per book in
+    <directory>/books.jsonl.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def write_chapter(self, book_index, book_title, position, chapter):
+        return append_line(os.path.join(self.directory, "chapters.jsonl"), {
+            "book_index": book_index,
+            "book_title": book_title,
+            "position": position,
+            **chapter.resolved().model_dump(),
+        })
+
+    def write_book(self, book_index, book):
+        return append_line(os.path.join(self.directory, "books.jsonl"), {"book_index": book_index, **book_record(book)})
+
+
+class GoogleDocsSink(BookSink):
+    """
+    One Google Doc per book, listed with its link in the OUTPUT_SHEET_ID sheet
+    (needs GOOGLE_CREDENTIALS). The row is added only once the doc has its full text,
+    so the sheet never links to a half-written book. The API clients share one
+    HTTP connection, which is not thread-safe, so books are written one at a time.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, sheet_id: Optional[str] = OUTPUT_SHEET_ID):
+        self.sheet_id = sheet_id
+        self.out_sheet = f"https://docs.google.com/spreadsheets/d/{sheet_id}" if sheet_id else None
+
+    def write_book(self, book_index, book):
+        from utils import docs_service, sheets_client
+
+        title = " / ".join(book.book_titles)
+        with self._lock:
+            documents = docs_service().documents()
+            doc_id = documents.create(body={"title": title}).execute()["documentId"]
+            documents.batchUpdate(
+                documentId=doc_id,
+                body={"requests": [{"insertText": {"location": {"index": 1}, "text": render_markdown(book)}}]},
+            ).execute()
+            url = f"https://docs.google.com/document/d/{doc_id}/edit"
+            if self.sheet_id:
+                sheets_client().open_by_key(self.sheet_id).sheet1.append_row([book_index + 1, title, url])
+        return url
+
+
+class NullSink(BookSink):
+    """
+    Writes nothing; books are kept in the graph state (`books_generated`) instead.
+    """
+
+    def write_book(self, book_index, book):
+        return None
+
+
+def get_sink(output_format: Optional[str], directory: str) -> BookSink:
+    """
+    Sink of a run's `output_format`, writing under `directory`.
+    """
+    output_format = output_format or OUTPUT_FORMAT
+    if output_format == "markdown":
+        return MarkdownSink(directory)
+    if output_format == "docx":
+        return DocxSink(directory)
+    if output_format == "jsonl":
+        return JsonlSink(directory)
+    if output_format == "google":
+        return GoogleDocsSink()
+    if output_format == "none":
+        return NullSink()
+    raise ValueError(f"Unknown output_format {output_format!r}, expected one of {', '.join(OUTPUT_FORMATS)}")
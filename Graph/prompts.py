@@ -15,4 +15,162 @@ Avoid outdated language: Ensure language is contemporary, conversational, and av
 
 Enhance Writing Style: As an editor, your writing must be sophisticated, fluent, and philosophical, yet never dull, overly academic, or outdated. Each paragraph must include compelling hook sentences to guide the reader’s thought process logically and naturally. Avoid repetition at sentence beginnings; repetitive beginnings will result in severe penalties.
 
-"""
\ No newline at end of file
+"""
+
+
+expand_chapter_task_prompt = """Expand the following chapter into a deeply philosophical long-form essay of around 1,500 words.
+
+### Chapter Title: {chapter_title}
+
+### Original Content:
+{chapter_content}
+
+Ensure a modern tone, reflective insights, logical flow, and high-quality transitions. Avoid academic language or redundancy. Every paragraph must be engaging and valuable."""
+
+
+expander_system_prompt = """You are a world-class philosophical writer who excels at transforming short insights into profound, expansive texts with emotional depth, clarity, and elegance. Your goal is to expand brief chapters into rich, deep, long-form philosophical content."""
+
+
+preface_task_prompt = """
+You are a preface writer.
+You will be given a book with chapters.
+Generate a preface for the book, summarizing its themes and purpose.
+The preface should be engaging and set the tone for the reader.
+This is the expanded book:
+
+{book}
+"""
+
+
+# Finishing nodes: {book} is the book's title and chapter digests (see nodes.book_prompt).
+extras_task_prompt = """
+You are given a structured non-fiction book titled "{book_title}" composed of the following chapters, each with a short digest:
+
+{book}
+
+Your task is to write **three well-developed introductory chapters**:
+1. **Who Should Read This Book** : Describe the ideal reader profile. Identify their problems, mindset, or goals. Help them self-identify and feel seen.
+2. **Structure of This Book** : Explain how the book is organized, chapter by chapter. Reveal the thought process behind the structure and how it benefits the reader.
+3. **How to Use This Book** : Provide practical guidance on how readers should approach the book. Should they read linearly or by topic? How should they take notes or reflect? Should they revisit sections?
+Each section must be **engaging, clearly written, and tuned to the tone and purpose of the book**. Be instructive but not dry. Use a warm, confident, yet professional voice.
+Each chapter should be around ~700 words long.
+Return a dictionary like:
+```json
+{{
+"who_should_read_this_book": "..."
+"how_to_use_this_book": "..."
+"structure_of_book": "..."
+}}
+```
+            """
+
+
+bio_task_prompt = """
+Write a professional, engaging, and reader-resonant **author biography**.
+It should be concise (150–200 words), written in third-person, and speak to the author’s **credibility, unique experience, and personal connection** to the book’s subject.
+
+Author Info:
+{author_info}
+
+Book Overview:
+{book}
+
+Output Format:
+```json
+{{
+  "bio": "..."
+}}
+"""
+
+
+toc_task_prompt = """
+You are given a structured non-fiction book titled "{book_title}" composed of the following chapters, each with a short digest:
+
+{book}
+Your task is to write a **Table of Contents** for the book.
+The table of contents should include:
+1. **Preface**: A brief introduction to the book.
+2. **Who Should Read This Book**: A description of the ideal reader profile.
+3. **Structure of This Book**: An explanation of how the book is organized, chapter by chapter.
+4. **How to Use This Book**: Practical guidance on how readers should approach the book.
+5. **Author Bio**: A brief biography of the author.
+6. **Chapters**: A list of all chapters in the book.
+The table of contents should be clear, engaging, and aligned with the book's tone and purpose.
+Return a dictionary like:
+```json
+{{
+"preface": "Preface",
+"who_should_read_this_book": "Who Should Read This Book",
+"structure_of_book": "Structure of This Book",
+"how_to_use_this_book": "How to Use This Book",
+"bio": "Author Bio",
+"chapter_list": {{
+  "chapter_titles": {chapter_titles}
+}}
+}}
+```
+"""
+
+
+chapter_digest_prompt = """Write a compact digest of the following book chapter in at most 120 words.
+Capture its central argument, key themes and ideas, and its tone, so an editor can write a preface, table of contents and reader guidance from the digest alone. Return only the digest text.
+
+### Chapter Title: {chapter_title}
+
+### Chapter:
+{expanded_content}"""
+
+
+# Long-form expansion (expansion "longform"): expand_chapter_prompt is the editor's brief
+# for every call, the manuscript is planned as an outline and its sections are written
+# in parallel, then the opening of every section after the first is reworked to follow on
+# from the end of the section before it.
+longform_outline_prompt = """Plan the expanded manuscript of the following chapter as an outline of {sections} sections, in reading order, that together make a manuscript of about {words} words.
+For each section, give one line: its title, a colon, and one or two sentences on what it covers and how it builds on the section before it.
+
+### Chapter Title: {chapter_title}
+
+### Original Content:
+{chapter_content}"""
+
+
+longform_section_prompt = """You are writing one section of the expanded manuscript of the chapter below. Other writers are writing the other sections at the same time, following the same outline.
+
+### Chapter Title: {chapter_title}
+
+### Original Content:
+{chapter_content}
+
+### Outline:
+{outline}
+
+### Previous Section:
+{previous_section}
+
+### Next Section:
+{next_section}
+
+Write section {number} of {sections}, "{section}", in about {words} words. Cover only what the outline gives this section; leave what belongs to the previous and next sections to them, but open so that it follows from the previous section and close so that it leads into the next one.
+Return only the text of the section, without a heading."""
+
+
+longform_transition_prompt = """Two consecutive sections of a long-form manuscript were written separately. Below are the closing paragraph of the first and the opening paragraph of the second.
+Rewrite the opening paragraph so the second section follows on naturally from the first: no repeated ideas or sentence openings, no restart of the argument, a clear bridge from one to the other. Keep its meaning, language and roughly its length.
+Return only the rewritten opening paragraph.
+
+### End of Section "{previous_section}":
+{previous_paragraph}
+
+### Opening of Section "{section}":
+{paragraph}"""
+
+
+# Second attempt at a structured answer that did not match its schema: only the
+# broken fields are asked for again, the valid ones are kept.
+structured_repair_prompt = """The answer below was meant to be a JSON object matching the {schema} schema, but some fields are missing or invalid:
+{errors}
+
+Return only these fields, with values taken from the answer (fix their format, do not rewrite their content). Write a field from the answer's content only if it is missing from it.
+
+### Answer:
+{answer}"""
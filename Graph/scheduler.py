@@ -0,0 +1,99 @@
+import heapq
+import itertools
+import threading
+import weakref
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Callable, Dict, Tuple
+
+
+class LLMScheduler:
+    """
+    Shared LLM concurrency budget for one run.
+    Every LLM call of every book waits for a slot here, so the budget stays
+    saturated across books and stages instead of being split per node. Waiting
+    calls are served lowest priority first: earlier books, and finishing stages
+    before expansion, so the first books complete as early as possible.
+    """
+
+    def __init__(self, max_in_flight: int):
+        self.max_in_flight = max(1, max_in_flight)
+        self.in_flight = 0
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._seq = itertools.count()
+
+    @contextmanager
+    def slot(self, priority: Tuple = ()):
+        """
+        Hold one LLM slot for the duration of the with-block.
+        Args:
+                priority (tuple): Lower is served first, e.g. (book_index, stage).
+        """
+        entry = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            while self.in_flight >= self.max_in_flight or self._waiting[0] != entry:
+                self._cond.wait()
+            heapq.heappop(self._waiting)
+            self.in_flight += 1
+            # The next waiter may be able to take another free slot.
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+
+class SingleFlight:
+    """
+    Runs a function once per key among concurrent callers: a chapter shared by
+    several books that are expanding at the same time is only expanded once,
+    the other books wait for and reuse that result.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+
+    def do(self, key: str, fn: Callable):
+        with self._lock:
+            future = self._calls.get(key)
+            owner = future is None
+            if owner:
+                future = self._calls[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+# Weak: a scheduler is dropped once no call holds or waits for one of its slots, at
+# which point it has no state left to keep, so finished runs do not accumulate.
+_schedulers: "weakref.WeakValueDictionary[str, LLMScheduler]" = weakref.WeakValueDictionary()
+_schedulers_lock = threading.Lock()
+
+# Process-wide, keyed by content hash, so concurrent runs also share in-flight work.
+single_flight = SingleFlight()
+
+
+def get_scheduler(thread_id: str, max_in_flight: int) -> LLMScheduler:
+    """
+    The scheduler of the run `thread_id`, created on first use and again whenever
+    the previous one was dropped.
+    """
+    with _schedulers_lock:
+        scheduler = _schedulers.get(thread_id)
+        if scheduler is None:
+            scheduler = _schedulers[thread_id] = LLMScheduler(max_in_flight)
+        return scheduler
@@ -1,21 +1,60 @@
 # FastAPI server
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import uvicorn
 import os
+import json
 import uuid
+import threading
+from functools import lru_cache
 from dotenv import load_dotenv
-from graph import graph
+from jobs import JobManager, build_input
+from metrics import metrics
+from sheets import get_sheets_reader
 
 load_dotenv()
 
 PORT = os.getenv("PORT", 8000)
+# Load the graph (and the LLM libraries) in the background as soon as the server
+# is up, rather than in the first request; the server accepts requests meanwhile.
+PRELOAD_GRAPH = os.getenv("PRELOAD_GRAPH", "1") == "1"
+
+
+@lru_cache(maxsize=None)
+def get_graph():
+    """
+    The compiled graph, imported on first use so the server starts without it.
+    """
+    from graph import graph
+
+    return graph
+
+
+def sweep_blobs():
+    """
+    Delete the blobs no run, checkpoint or cache entry refers to any more, at most once an hour.
+    """
+    from checkpoint import maybe_sweep_blobs
+
+    maybe_sweep_blobs()
+
 
 # Create the FastAPI app
 app = FastAPI()
 
+# Background runner for /jobs
+job_manager = JobManager(get_graph)
+
+
+@app.on_event("startup")
+async def preload_graph():
+    if PRELOAD_GRAPH:
+        threading.Thread(target=get_graph, name="preload-graph", daemon=True).start()
+
 # Add CORS middleware to allow requests from the frontend
 app.add_middleware(
     CORSMiddleware,
@@ -39,36 +78,134 @@ async def read_index():
 async def invoke(payload: dict):
     """
     Invoke the graph and return the result.
+    The run happens on a worker thread so the event loop keeps serving other requests.
     """
-    gpt_prompt = payload.get("gpt_prompt")
-    openai_api_key = payload.get("openai_api_key")
-    output_lang = payload.get("output_lang")
-    max_tokens = payload.get("max_tokens")
     max_docs = payload.get("max_docs")
-    min_diff = payload.get("min_diff")
-    r_chapters = payload.get("r_chapters")
-    mode = payload.get("mode")
-    openai_api_key = openai_api_key
-
-    config = {"configurable": {"thread_id": str(uuid.uuid4())}}
-    output = graph.invoke(
-        input={
-            "messages": [("human", gpt_prompt)],
-            "gpt_prompt": gpt_prompt,
-            "openai_api_key": openai_api_key,
-            "output_lang": output_lang,
-            "max_tokens": max_tokens,
-            "max_docs": max_docs,
-            "min_diff": min_diff,
-            "r_chapters": r_chapters,
-            "mode": mode,
-        },
+
+    thread_id = str(uuid.uuid4())
+    config = {"configurable": {"thread_id": thread_id}}
+    graph = await run_in_threadpool(get_graph)
+    output = await run_in_threadpool(
+        graph.invoke,
+        input=build_input(payload),
         config=config,
         stream_mode="values",
     )
     out_sheet = output.get("out_sheet")
+    metrics.write_report(thread_id)
+    await run_in_threadpool(sweep_blobs)
+
+    if out_sheet:
+        return {"message":f"{max_docs} Books are created and saved in a google docs. Here is the google sheet - {out_sheet}"}
+    return {
+        "message": f"{max_docs} Books are created.",
+        "books_written": output.get("books_written", []),
+    }
+
+
+@app.post("/jobs")
+async def submit_job(payload: dict):
+    """
+    Queue a graph run in the background and return its job id immediately.
+    """
+    job_id = job_manager.submit(build_input(payload))
+    return {"job_id": job_id, "status": "queued"}
+
+
+@app.get("/jobs")
+async def list_jobs():
+    return {"jobs": job_manager.list()}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Status, progress and (once finished) result of a job.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return jsonable_encoder(job)
+
+
+@app.post("/jobs/{job_id}/resume")
+async def resume_job(job_id: str):
+    """
+    Continue a failed job from its last checkpoint.
+    """
+    if not job_manager.resume(job_id):
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is unknown or not failed")
+    return {"job_id": job_id, "status": "queued"}
+
+
+def sse(event: str, data) -> str:
+    """
+    Format one server-sent event.
+    """
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+@app.get("/runs/{thread_id}/report")
+async def run_report(thread_id: str):
+    """
+    Per-node wall time, LLM latency percentiles, tokens, retries, cache hits and
+    estimated cost of a run (a job id is its thread_id).
+    """
+    report = metrics.report(thread_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail=f"No metrics for run {thread_id}")
+    return report
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    Process-wide node and LLM metrics in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics.prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/sheets/stats")
+async def sheets_stats():
+    """
+    Version checks, downloads and cache hits of the process-wide Sheets reader,
+    whose authorized session every request shares.
+    """
+    return get_sheets_reader().stats
+
+
+@app.post("/stream")
+async def stream(payload: dict):
+    """
+    Run the graph and stream its progress as server-sent events.
+    Emits `node_finished` after every node (once per book for `book_pipeline`), the custom node events (`chapter_expanded`,
+    `book_expanded`, `preface_done`, `book_finished`, `chapter_written`, `book_written`, each with token counts where they
+    apply), then `done` or `error`.
+    """
+    thread_id = str(uuid.uuid4())
+    config = {"configurable": {"thread_id": thread_id}}
+
+    async def events():
+        yield sse("started", {"thread_id": thread_id})
+        try:
+            graph = await run_in_threadpool(get_graph)
+            async for mode, chunk in graph.astream(
+                input=build_input(payload),
+                config=config,
+                stream_mode=["updates", "custom"],
+            ):
+                if mode == "custom":
+                    yield sse(chunk.get("event", "message"), chunk)
+                else:
+                    for node in chunk:
+                        yield sse("node_finished", {"node": node})
+            metrics.write_report(thread_id)
+            yield sse("done", {"thread_id": thread_id, "report": metrics.report(thread_id)})
+        except Exception as e:
+            yield sse("error", {"thread_id": thread_id, "error": str(e)})
+        await run_in_threadpool(sweep_blobs)
 
-    return {"message":f"{max_docs} Books are created and saved in a google docs. Here is the google sheet - {out_sheet}"}
+    return StreamingResponse(events(), media_type="text/event-stream")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,167 @@
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+from blobs import atomic_write
+from dotenv import load_dotenv
+
+load_dotenv()
+
+if TYPE_CHECKING:
+    import pandas as pd
+    import requests
+
+# Point both at sheets_server.py to run against local CSV files instead of Google.
+SHEETS_API_BASE = os.getenv("SHEETS_API_BASE", "https://sheets.googleapis.com/v4")
+DRIVE_API_BASE = os.getenv("DRIVE_API_BASE", "https://www.googleapis.com/drive/v3")
+# Downloaded sheets are kept here with their Drive version, and fetched again only once it changes.
+SHEETS_CACHE_DIR = os.getenv("SHEETS_CACHE_DIR", ".cache/sheets")
+SHEETS_TIMEOUT = float(os.getenv("SHEETS_TIMEOUT", 60))
+
+
+def parse_sheet_spec(spec: str) -> Tuple[str, Optional[List[str]]]:
+    """
+    "<sheet_id>" for the first worksheet, "<sheet_id>#<tab>,<tab>" for named worksheets.
+    """
+    sheet_id, _, tabs = spec.partition("#")
+    return sheet_id, [tab.strip() for tab in tabs.split(",") if tab.strip()] or None
+
+
+def values_frame(values: List[list]) -> "pd.DataFrame":
+    """
+    DataFrame of a worksheet's values, the first row as header. The API drops
+    trailing empty cells, so short rows are padded.
+    """
+    import pandas as pd
+
+    if not values:
+        return pd.DataFrame()
+    header = [str(cell).strip() for cell in values[0]]
+    rows = [list(row[: len(header)]) + [""] * (len(header) - len(row)) for row in values[1:]]
+    return pd.DataFrame(rows, columns=header)
+
+
+class SheetsReader:
+    """
+    Reads worksheets through the Sheets REST API on one authorized session,
+    shared by every run of the process (and every request of server.py).
+    All worksheets asked for from one spreadsheet come in a single
+    values:batchGet call. Before downloading, the spreadsheet's Drive version is
+    checked (a metadata-only call); if it matches the local copy in
+    SHEETS_CACHE_DIR, the copy is used and nothing is downloaded.
+    """
+
+    def __init__(self, session: Optional["requests.Session"] = None, sheets_api: str = SHEETS_API_BASE,
+                 drive_api: str = DRIVE_API_BASE, cache_dir: str = SHEETS_CACHE_DIR):
+        self.sheets_api = sheets_api.rstrip("/")
+        self.drive_api = drive_api.rstrip("/")
+        self.cache_dir = cache_dir
+        self._session = session
+        self._lock = threading.Lock()
+        self.stats = {"version_checks": 0, "downloads": 0, "cache_hits": 0}
+
+    @property
+    def session(self) -> "requests.Session":
+        # Authorized on first use; AuthorizedSession refreshes its token by itself.
+        with self._lock:
+            if self._session is None:
+                if self.sheets_api.startswith("https://sheets.googleapis.com"):
+                    from google.auth.transport.requests import AuthorizedSession
+                    from utils import google_credentials
+
+                    self._session = AuthorizedSession(google_credentials())
+                else:
+                    import requests
+
+                    self._session = requests.Session()
+            return self._session
+
+    def _get(self, url: str, params=None) -> dict:
+        response = self.session.get(url, params=params, timeout=SHEETS_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] += 1
+
+    def version(self, sheet_id: str) -> str:
+        """
+        Drive revision of the spreadsheet; it changes with every edit.
+        """
+        self._count("version_checks")
+        meta = self._get(f"{self.drive_api}/files/{quote(sheet_id)}", {"fields": "version,modifiedTime", "supportsAllDrives": "true"})
+        return str(meta.get("version") or meta.get("modifiedTime"))
+
+    def _cache_path(self, sheet_id: str) -> str:
+        return os.path.join(self.cache_dir, f"{quote(sheet_id, safe='')}.json")
+
+    def _load(self, sheet_id: str) -> Optional[dict]:
+        try:
+            with open(self._cache_path(sheet_id), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def read(self, sheet_id: str, worksheets: Optional[Sequence[str]] = None) -> Dict[str, "pd.DataFrame"]:
+        """
+        Worksheets of one spreadsheet, from the local copy if the sheet has not changed.
+        Args:
+                sheet_id (str): Spreadsheet id.
+                worksheets (list): Worksheet titles, the first worksheet if None.
+        Returns:
+                dict: Worksheet title -> DataFrame of its rows, in the order asked for.
+        """
+        version = self.version(sheet_id)
+        cached = self._load(sheet_id)
+        if cached is None or cached.get("version") != version:
+            cached = {"version": version, "titles": None, "values": {}}
+        if worksheets is None:
+            if cached["titles"] is None:
+                meta = self._get(f"{self.sheets_api}/spreadsheets/{quote(sheet_id)}", {"fields": "sheets.properties(title,index)"})
+                cached["titles"] = [s["properties"]["title"] for s in sorted(meta["sheets"], key=lambda s: s["properties"].get("index", 0))]
+            worksheets = cached["titles"][:1]
+
+        missing = [title for title in worksheets if title not in cached["values"]]
+        if missing:
+            self._count("downloads")
+            ranges = [f"'{title}'" for title in missing]
+            data = self._get(
+                f"{self.sheets_api}/spreadsheets/{quote(sheet_id)}/values:batchGet",
+                {"ranges": ranges, "majorDimension": "ROWS"},
+            )
+            for title, value_range in zip(missing, data.get("valueRanges", [])):
+                cached["values"][title] = value_range.get("values", [])
+            atomic_write(self._cache_path(sheet_id), json.dumps(cached, ensure_ascii=False).encode("utf-8"))
+        else:
+            self._count("cache_hits")
+        return {title: values_frame(cached["values"][title]) for title in worksheets}
+
+    def read_many(self, specs: Sequence[str]) -> Dict[str, Dict[str, "pd.DataFrame"]]:
+        """
+        Several spreadsheets at once, one batched call per spreadsheet, run concurrently.
+        Args:
+                specs (list): "<sheet_id>" or "<sheet_id>#<tab>,<tab>" each.
+        Returns:
+                dict: spec -> the worksheets read() returns for it.
+        """
+        with ThreadPoolExecutor(max_workers=max(1, min(8, len(specs)))) as executor:
+            futures = {spec: executor.submit(self.read, *parse_sheet_spec(spec)) for spec in specs}
+            return {spec: future.result() for spec, future in futures.items()}
+
+
+_reader: Optional[SheetsReader] = None
+_reader_lock = threading.Lock()
+
+
+def get_sheets_reader() -> SheetsReader:
+    """
+    Process-wide SheetsReader, so the authorized session is made once and reused.
+    """
+    global _reader
+    with _reader_lock:
+        if _reader is None:
+            _reader = SheetsReader()
+        return _reader
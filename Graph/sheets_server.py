@@ -0,0 +1,87 @@
+# Local stand-in for the parts of the Sheets and Drive APIs sheets.py uses, serving CSV files.
+# A spreadsheet is SHEETS_STANDIN_DIR/<sheet_id>.csv (one worksheet "Sheet1") or a
+# directory SHEETS_STANDIN_DIR/<sheet_id>/ with one <worksheet>.csv per worksheet.
+# Run `python sheets_server.py` and set
+#   SHEETS_API_BASE=http://localhost:8002/v4
+#   DRIVE_API_BASE=http://localhost:8002/drive/v3
+# Editing a CSV file changes the spreadsheet's version, like an edit in Google Sheets.
+from fastapi import FastAPI, HTTPException, Query
+import uvicorn
+import os
+import csv
+import threading
+from typing import List
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PORT = int(os.getenv("SHEETS_STANDIN_PORT", 8002))
+SHEETS_STANDIN_DIR = os.getenv("SHEETS_STANDIN_DIR", "sheets")
+
+app = FastAPI()
+
+calls = {"files.get": 0, "spreadsheets.get": 0, "values.batchGet": 0}
+lock = threading.Lock()
+
+
+def count(name: str) -> None:
+    with lock:
+        calls[name] += 1
+
+
+def worksheet_files(sheet_id: str) -> dict:
+    """
+    Worksheet title -> CSV path of one spreadsheet.
+    """
+    single = os.path.join(SHEETS_STANDIN_DIR, f"{sheet_id}.csv")
+    if os.path.isfile(single):
+        return {"Sheet1": single}
+    directory = os.path.join(SHEETS_STANDIN_DIR, sheet_id)
+    if os.path.isdir(directory):
+        return {
+            name[: -len(".csv")]: os.path.join(directory, name)
+            for name in sorted(os.listdir(directory))
+            if name.endswith(".csv")
+        }
+    raise HTTPException(status_code=404, detail=f"Requested entity was not found: {sheet_id}")
+
+
+@app.get("/drive/v3/files/{sheet_id}")
+async def get_file(sheet_id: str):
+    count("files.get")
+    mtime = max(os.stat(path).st_mtime_ns for path in worksheet_files(sheet_id).values())
+    return {"id": sheet_id, "version": str(mtime), "modifiedTime": str(mtime)}
+
+
+@app.get("/v4/spreadsheets/{sheet_id}")
+async def get_spreadsheet(sheet_id: str):
+    count("spreadsheets.get")
+    return {
+        "spreadsheetId": sheet_id,
+        "sheets": [{"properties": {"title": title, "index": i}} for i, title in enumerate(worksheet_files(sheet_id))],
+    }
+
+
+@app.get("/v4/spreadsheets/{sheet_id}/values:batchGet")
+async def batch_get(sheet_id: str, ranges: List[str] = Query(...)):
+    count("values.batchGet")
+    files = worksheet_files(sheet_id)
+    value_ranges = []
+    for a1 in ranges:
+        title = a1.split("!")[0].strip("'")
+        if title not in files:
+            raise HTTPException(status_code=400, detail=f"Unable to parse range: {a1}")
+        with open(files[title], newline="", encoding="utf-8") as f:
+            values = [row for row in csv.reader(f)]
+        value_ranges.append({"range": a1, "majorDimension": "ROWS", "values": values})
+    return {"spreadsheetId": sheet_id, "valueRanges": value_ranges}
+
+
+@app.get("/stats")
+async def stats():
+    with lock:
+        return dict(calls)
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=PORT)
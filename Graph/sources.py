@@ -0,0 +1,177 @@
+import os
+from typing import TYPE_CHECKING, Iterator, List, Tuple
+from states import ChapterCatalog
+from dotenv import load_dotenv
+
+load_dotenv()
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Rows read and validated at a time by the local file sources.
+SOURCE_CHUNK_ROWS = int(os.getenv("SOURCE_CHUNK_ROWS", 5000))
+# Local chapter files are read from this directory (and its subdirectories) only.
+SOURCE_DIR = os.getenv("SOURCE_DIR", ".")
+
+COLUMNS = ["chapter_title", "chapter_content"]
+
+
+def validate_batch(df: "pd.DataFrame") -> Tuple[List[str], List[str], int]:
+    """
+    Validate a chunk of rows at once: both columns present, non-empty title and content.
+    Returns:
+            tuple: Titles and contents of the valid rows, and the number of rows skipped.
+    """
+    missing = [column for column in COLUMNS if column not in df.columns]
+    if missing:
+        raise ValueError(f"Chapter source is missing column(s) {missing}, found {list(df.columns)}")
+    titles = df["chapter_title"].astype("string").str.strip()
+    contents = df["chapter_content"].astype("string").str.strip()
+    valid = titles.fillna("").ne("") & contents.fillna("").ne("")
+    return titles[valid].tolist(), contents[valid].tolist(), int((~valid).sum())
+
+
+class ChapterSource:
+    """
+    Where the chapters of a run come from. A source yields its rows as DataFrame
+    chunks with (at least) the chapter_title and chapter_content columns;
+    read() validates them chunk by chunk into a ChapterCatalog.
+    """
+
+    name = "source"
+
+    def batches(self) -> Iterator["pd.DataFrame"]:
+        raise NotImplementedError
+
+    def read(self) -> ChapterCatalog:
+        titles, contents, skipped = [], [], 0
+        for df in self.batches():
+            batch_titles, batch_contents, batch_skipped = validate_batch(df)
+            titles += batch_titles
+            contents += batch_contents
+            skipped += batch_skipped
+        if skipped:
+            print(f"Skipping {skipped} invalid row(s) of {self.name}: empty chapter_title or chapter_content")
+        return ChapterCatalog(titles=titles, contents=contents)
+
+
+class CsvSource(ChapterSource):
+    def __init__(self, path: str, chunk_rows: int = SOURCE_CHUNK_ROWS):
+        self.name = path
+        self.path = path
+        self.chunk_rows = chunk_rows
+
+    def batches(self):
+        import pandas as pd
+
+        yield from pd.read_csv(self.path, dtype=str, keep_default_na=False, chunksize=self.chunk_rows)
+
+
+class XlsxSource(ChapterSource):
+    """
+    First worksheet of an .xlsx workbook, read row by row in openpyxl's read-only mode.
+    """
+
+    def __init__(self, path: str, chunk_rows: int = SOURCE_CHUNK_ROWS):
+        self.name = path
+        self.path = path
+        self.chunk_rows = chunk_rows
+
+    def batches(self):
+        import pandas as pd
+
+        try:
+            from openpyxl import load_workbook
+        except ImportError as e:
+            raise ImportError("Reading .xlsx chapters needs openpyxl: pip install openpyxl") from e
+        workbook = load_workbook(self.path, read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            header = [str(cell).strip() if cell is not None else "" for cell in next(rows, ())]
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) == self.chunk_rows:
+                    yield pd.DataFrame(chunk, columns=header)
+                    chunk = []
+            if chunk:
+                yield pd.DataFrame(chunk, columns=header)
+        finally:
+            workbook.close()
+
+
+class ParquetSource(ChapterSource):
+    def __init__(self, path: str, chunk_rows: int = SOURCE_CHUNK_ROWS):
+        self.name = path
+        self.path = path
+        self.chunk_rows = chunk_rows
+
+    def batches(self):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Reading .parquet chapters needs pyarrow: pip install pyarrow") from e
+        parquet = pq.ParquetFile(self.path)
+        columns = [column for column in COLUMNS if column in parquet.schema_arrow.names]
+        for batch in parquet.iter_batches(batch_size=self.chunk_rows, columns=columns):
+            yield batch.to_pandas()
+
+
+class GoogleSheetSource(ChapterSource):
+    """
+    Google Sheets, read through the shared sheets.SheetsReader (cached, one batched
+    call per spreadsheet). `sheet_id` is "<id>" for the first worksheet,
+    "<id>#<tab>,<tab>" for named worksheets, and several of those joined by ";"
+    to read more than one spreadsheet.
+    """
+
+    def __init__(self, sheet_id: str):
+        self.name = f"sheet {sheet_id}"
+        self.sheet_id = sheet_id
+
+    def batches(self):
+        from sheets import get_sheets_reader
+
+        specs = [spec.strip() for spec in self.sheet_id.split(";") if spec.strip()]
+        for worksheets in get_sheets_reader().read_many(specs).values():
+            yield from worksheets.values()
+
+
+class FakeSource(ChapterSource):
+    """
+    The deterministic chapters of fakes.read_fake_sheet, for "fake:<n>".
+    """
+
+    def __init__(self, sheet_id: str):
+        self.name = sheet_id
+        self.sheet_id = sheet_id
+
+    def batches(self):
+        from fakes import read_fake_sheet
+
+        yield read_fake_sheet(self.sheet_id)
+
+
+FILE_SOURCES = {".csv": CsvSource, ".xlsx": XlsxSource, ".xlsm": XlsxSource, ".parquet": ParquetSource, ".pq": ParquetSource}
+
+
+def get_source(sheet_id: str) -> ChapterSource:
+    """
+    Source of a run's `sheet_id`:
+    "fake:<n>" for generated chapters, "file:<path>" or a path ending in .csv,
+    .xlsx or .parquet for a local file under SOURCE_DIR, anything else is a
+    Google Sheet id.
+    """
+    if sheet_id.startswith("fake:"):
+        return FakeSource(sheet_id)
+    path = sheet_id[len("file:"):] if sheet_id.startswith("file:") else sheet_id
+    extension = os.path.splitext(path)[1].lower()
+    if extension in FILE_SOURCES:
+        root = os.path.realpath(SOURCE_DIR)
+        full = os.path.realpath(os.path.join(root, path))
+        if os.path.commonpath([root, full]) != root:
+            raise ValueError(f"Chapter file {path!r} is outside SOURCE_DIR {SOURCE_DIR!r}")
+        return FILE_SOURCES[extension](full)
+    if sheet_id.startswith("file:"):
+        raise ValueError(f"Unsupported chapter file {path!r}, expected one of {', '.join(FILE_SOURCES)}")
+    return GoogleSheetSource(sheet_id)
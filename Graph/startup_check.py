@@ -0,0 +1,90 @@
+# Import-time profile of the entry points, to keep server and CLI cold starts fast.
+# Imports each module in a fresh interpreter with `python -X importtime`, prints the
+# slowest imports, and fails if the import takes longer than the budget or pulls in
+# a library that is supposed to load lazily (LLM SDKs, pandas, Google clients, ...).
+# Example:
+#   python startup_check.py                      # graph and server, 1.0s budget each
+#   python startup_check.py server --budget 0.5 --top 30
+import os
+import sys
+import argparse
+import subprocess
+from collections import defaultdict
+
+parser = argparse.ArgumentParser(description="Check the import time of the entry points.")
+parser.add_argument("modules", nargs="*", default=["graph", "server"], help="modules to import")
+parser.add_argument("--budget", type=float, default=1.0, help="max seconds per module import")
+parser.add_argument("--top", type=int, default=15, help="number of slowest top-level packages to show")
+parser.add_argument("--runs", type=int, default=5, help="imports per module, the fastest counts")
+args = parser.parse_args()
+
+# Loaded on first use by llms.py, batch.py, nodes.py, utils.py, sources.py, sheets.py, output.py and embeddings.py.
+LAZY_MODULES = (
+    "crewai",
+    "litellm",
+    "langchain_openai",
+    "langchain_google_vertexai",
+    "vertexai",
+    "openai",
+    "numpy",
+    "pandas",
+    "pyarrow",
+    "openpyxl",
+    "gspread",
+    "google.auth",
+    "googleapiclient",
+    "docx",
+)
+
+GRAPH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def profile(module: str) -> tuple:
+    """
+    Import `module` once in a fresh interpreter.
+    Returns:
+            tuple: Total import seconds, {top-level package: seconds spent in its modules}, loaded lazy modules.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [GRAPH_DIR, os.environ.get("PYTHONPATH")])))
+    code = (
+        f"import sys, {module}\n"
+        f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, env=env
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    total = 0.0
+    packages = defaultdict(float)
+    for line in proc.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package", nesting shown by indentation
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        # Self times, at every depth: each module counts once, towards its own package.
+        packages[name.strip().split(".")[0]] += int(own) / 1e6
+        if name.strip() == module and depth == 0:
+            total = int(cumulative) / 1e6
+    loaded = [m for m in proc.stdout.strip().split(",") if m]
+    return total, dict(packages), loaded
+
+
+def main():
+    failed = False
+    for module in args.modules:
+        runs = [profile(module) for _ in range(max(1, args.runs))]
+        total, packages, loaded = min(runs, key=lambda run: run[0])
+        ok = total <= args.budget and not loaded
+        failed |= not ok
+        print(f"{'OK' if ok else 'FAIL'} import {module}: {total:.3f}s (budget {args.budget:.2f}s)")
+        for name, seconds in sorted(packages.items(), key=lambda kv: -kv[1])[: args.top]:
+            print(f"    {name:<32}{seconds:>8.3f}s")
+        if loaded:
+            print(f"    loaded at import, should be lazy: {', '.join(loaded)}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
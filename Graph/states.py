@@ -1,16 +1,26 @@
+import json
 from langgraph.graph import MessagesState
-from typing import Any, Dict, List, Optional, Tuple, Annotated
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union, Annotated, TypedDict
 import operator
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import AfterValidator, BaseModel, Field, ConfigDict, PrivateAttr, field_validator
+from blobs import resolve, store_text
+
+# Long texts are kept in the blob store and held in the state as a short
+# "blob:sha256:..." reference, so checkpoints stay small however long the chapters are.
+# Read them through `.content` on chapters, or blobs.resolve().
+BlobText = Annotated[str, AfterValidator(store_text)]
 
 class Extras(BaseModel):
-	who_should_read_this_book: str
-	how_to_use_this_book: str
-	structure_of_book: str
+	who_should_read_this_book: BlobText
+	how_to_use_this_book: BlobText
+	structure_of_book: BlobText
+
+class Bio(BaseModel):
+    bio: BlobText
 
 class ChapterTitleList(BaseModel):
     chapter_titles: list[str]
-class TOC:
+class TOC(BaseModel):
     preface: str
     who_should_read_this_book: str
     structure_of_book: str
@@ -18,44 +28,181 @@ class TOC:
     bio: str
     chapter_list: ChapterTitleList
 
+class SectionOutline(BaseModel):
+    # One "Title: what it covers" line per section, in reading order.
+    sections: list[str]
+
+class ChapterExpansion(BaseModel):
+    # Response schema of an expansion call; the digest is added afterwards (see ExpandedChapter).
+    chapter_title: str
+    expanded_content: BlobText
+
 class ExpandedChapter(BaseModel):
     chapter_title: str
-    expanded_content: str
+    expanded_content: BlobText
+    # Short summary written once after expansion, used by the book-level prompts.
+    digest: BlobText = ""
+
+    @property
+    def content(self) -> str:
+        return resolve(self.expanded_content)
+
+    def resolved(self) -> "ExpandedChapter":
+        """Copy with the texts instead of blob references."""
+        return self.model_copy(update={"expanded_content": self.content, "digest": resolve(self.digest)})
 
 class Chapter(BaseModel):
 	chapter_title: str
-	chapter_content: str
+	chapter_content: BlobText
+
+	@property
+	def content(self) -> str:
+		return resolve(self.chapter_content)
+
+	def resolved(self) -> "Chapter":
+		"""Copy with the text instead of a blob reference."""
+		return self.model_copy(update={"chapter_content": self.content})
+
+class ChapterCatalog(BaseModel):
+    """
+    Every valid chapter of a source, column by column. Chapter objects are only
+    built for the chapters that are picked (`catalog[i]`), so a catalog of tens
+    of thousands of rows costs two lists of strings until books are drawn from it.
+    The contents are packed into one JSON list, stored as a single blob, so
+    checkpoints carry one reference and loading a source writes one file.
+    """
+
+    titles: List[str] = []
+    # JSON list of the contents (given as a list), a blob reference once it is long.
+    contents: BlobText = "[]"
+    _contents: Optional[List[str]] = PrivateAttr(default=None)
+
+    @field_validator("contents", mode="before")
+    @classmethod
+    def pack_contents(cls, value):
+        return value if isinstance(value, str) else json.dumps(list(value), ensure_ascii=False)
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def __getitem__(self, i: int) -> Chapter:
+        return Chapter(chapter_title=self.titles[i], chapter_content=self.content_list()[i])
+
+    def content_list(self) -> List[str]:
+        """Contents of every chapter, read from the blob store on first use."""
+        if self._contents is None:
+            self._contents = json.loads(resolve(self.contents))
+        return self._contents
+
+    def chapters(self) -> Iterator[Chapter]:
+        return (self[i] for i in range(len(self)))
+
+    def texts(self) -> Iterator[Tuple[str, str]]:
+        """(title, content) of every chapter."""
+        return zip(self.titles, self.content_list())
 
 class Book(BaseModel):
 	book_title: str
-	chapters: List[Chapter]
+	chapters: List[Union[ExpandedChapter, Chapter]]
 	# model_config = ConfigDict(arbitrary_types_allowed=True)
 
 class GeneratedBook(BaseModel):
 	book_titles: list[str]
-	preface: str
+	preface: BlobText
 	additional_chapters: list[Chapter]
-	bio: str
+	bio: BlobText
 	table_of_contents: dict
-	chapters: list[Chapter]
+	chapters: List[Union[ExpandedChapter, Chapter]]
+
+	def resolved(self) -> "GeneratedBook":
+		"""Copy with the texts instead of blob references, for callers outside the graph."""
+		return self.model_copy(update={
+			"preface": resolve(self.preface),
+			"bio": resolve(self.bio),
+			"additional_chapters": [ch.resolved() for ch in self.additional_chapters],
+			"chapters": [ch.resolved() for ch in self.chapters],
+		})
+
+
+def add_usage(left: Optional[Dict[str, dict]], right: Optional[Dict[str, dict]]) -> Dict[str, dict]:
+    """Reducer for per-node token_usage: counts of the same node are summed, one book pipeline adds to the next."""
+    merged = {node: dict(counts) for node, counts in (left or {}).items()}
+    for node, counts in (right or {}).items():
+        total = merged.setdefault(node, {})
+        for key, value in counts.items():
+            total[key] = total.get(key, 0) + value
+    return merged
+
+
+def keep_last(left: Optional[str], right: Optional[str]) -> Optional[str]:
+    """Reducer for values every book pipeline reports the same way, e.g. out_sheet: the latest non-empty one wins."""
+    return right or left
 
 
 class StateIn(MessagesState):
     sheet_id: str
     books: List[Book]
     mode: str
+    engine: str
+    expansion: str
+    selection: str
+    max_similarity: float
+    delta: bool
     r_chapters: int
     max_docs: int
     max_overlap: int
+    seed: int
     max_tokens: int
+    max_concurrency: int
     openai_api_key: str
     output_lang: str
+    output_format: str
     gpt_prompt: str
-    books_generated: Annotated[List[Book], operator.add]
-    chapter_list: List[Chapter]
+    books_generated: Annotated[List[GeneratedBook], operator.add]
+    chapter_list: ChapterCatalog
+    # Incremental rebuilds (see nodes.generate_combinations)
+    build: str
+    reused_books: List[dict]
     expanded_chapters: list[ExpandedChapter]
+    token_usage: Annotated[Dict[str, dict], add_usage]
+
+
+class BookState(TypedDict, total=False):
+    """State of one book pipeline, sent per book by dispatch_books."""
+    book: Book
+    book_index: int
+    # Key of the run's build, and the previous run's result of a book that is reused.
+    build: str
+    previous: dict
+    max_tokens: int
+    max_concurrency: int
+    engine: str
+    expansion: str
+    output_lang: str
+    output_format: str
+    openai_api_key: str
+    # Finishing stage
+    preface: str
+    extras: Extras
+    bio: str
+    toc: TOC
+    generated: GeneratedBook
+    # Output stage
+    books_generated: Annotated[List[GeneratedBook], operator.add]
+    books_written: Annotated[List[dict], operator.add]
+    out_sheet: Annotated[Optional[str], keep_last]
+    token_usage: Annotated[Dict[str, dict], add_usage]
+
+
+class BookOut(TypedDict):
+    books_generated: Annotated[List[GeneratedBook], operator.add]
+    books_written: Annotated[List[dict], operator.add]
+    out_sheet: Annotated[Optional[str], keep_last]
+    token_usage: Annotated[Dict[str, dict], add_usage]
 
 
 class StateOut(MessagesState):
-	out_sheet:str
-	books_generated: Annotated[List[Book], operator.add]
\ No newline at end of file
+	out_sheet: Annotated[Optional[str], keep_last]
+	token_usage: Annotated[Dict[str, dict], add_usage]
+	books_generated: Annotated[List[GeneratedBook], operator.add]
+	books_written: Annotated[List[dict], operator.add]
\ No newline at end of file
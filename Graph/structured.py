@@ -0,0 +1,168 @@
+import os
+import re
+import json
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple, Type
+from pydantic import BaseModel, TypeAdapter, ValidationError, create_model
+from prompts import structured_repair_prompt
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Characters of the broken answer shown to the repair call.
+REPAIR_CONTEXT_CHARS = int(os.getenv("REPAIR_CONTEXT_CHARS", 8000))
+
+FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.S | re.I)
+
+
+class StructuredOutputError(ValueError):
+    pass
+
+
+def output_text(output) -> str:
+    """
+    Raw text of a crew, batch or chat model result: the answer itself, or the
+    arguments of its tool call when the model answered through function calling.
+    """
+    if isinstance(output, str):
+        return output
+    raw = getattr(output, "raw", None)
+    if isinstance(raw, str):
+        return raw
+    content = getattr(output, "content", None)
+    if isinstance(content, str) and content.strip():
+        return content
+    tool_calls = getattr(output, "tool_calls", None)
+    if tool_calls:
+        return json.dumps(tool_calls[0].get("args", {}), ensure_ascii=False)
+    return str(output)
+
+
+def extract_json(text: str) -> Optional[Any]:
+    """
+    The JSON value of an LLM answer: the whole answer, the inside of a ``` fence,
+    or the span from the first "{" to the last "}". Raw newlines inside strings are accepted.
+    Returns:
+            The decoded value, None if there is none.
+    """
+    candidates = [text.strip()] + [match.group(1).strip() for match in FENCE_RE.finditer(text)]
+    start, end = text.find("{"), text.rfind("}")
+    if 0 <= start < end:
+        candidates.append(text[start:end + 1])
+    for candidate in candidates:
+        try:
+            return json.loads(candidate, strict=False)
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def field_key(key: str) -> str:
+    # "Who Should Read This Book" -> "who_should_read_this_book"
+    return re.sub(r"[^a-z0-9]+", "_", str(key).lower()).strip("_")
+
+
+@lru_cache(maxsize=None)
+def _adapter(schema: Type[BaseModel], name: str) -> TypeAdapter:
+    return TypeAdapter(schema.model_fields[name].annotation)
+
+
+def validate_fields(schema: Type[BaseModel], data, fixed: Optional[dict] = None) -> Tuple[Optional[BaseModel], Dict[str, Any], Dict[str, str]]:
+    """
+    Validate `data` against `schema` one field at a time, so a broken field does
+    not discard the good ones. Keys are matched loosely ("Bio" for bio).
+    Args:
+            schema: The pydantic model, e.g. ChapterExpansion, Extras or TOC.
+            data: The decoded answer.
+            fixed (dict): Values known without the LLM, they override the answer.
+    Returns:
+            tuple: The model if every field is valid (else None), the valid fields, and an error per broken or missing field.
+    """
+    data = data if isinstance(data, dict) else {}
+    by_key = {field_key(key): value for key, value in data.items()}
+    by_key.update({key: value for key, value in data.items() if key in schema.model_fields})
+    by_key.update(fixed or {})
+    valid, errors = {}, {}
+    for name, field in schema.model_fields.items():
+        if name not in by_key:
+            if field.is_required():
+                errors[name] = "missing"
+            continue
+        try:
+            valid[name] = _adapter(schema, name).validate_python(by_key[name])
+        except ValidationError as e:
+            errors[name] = "; ".join(error["msg"] for error in e.errors())
+    if errors:
+        return None, valid, errors
+    return schema(**valid), valid, {}
+
+
+def parse_output(schema: Type[BaseModel], output, fixed: Optional[dict] = None) -> Tuple[Optional[BaseModel], Dict[str, Any], Dict[str, str]]:
+    """
+    validate_fields of a crew, batch or chat model result: its parsed JSON if it
+    has one (crew output_json, batch response_format), else the JSON in its text.
+    """
+    data = getattr(output, "json_dict", None) or extract_json(output_text(output))
+    return validate_fields(schema, data, fixed)
+
+
+@lru_cache(maxsize=None)
+def deferred_converter():
+    """
+    crewai Converter class for tasks with an output_json: where crewai cannot parse
+    the answer itself, it keeps the raw answer for nodes.parse_structured instead of
+    having the LLM rewrite all of it.
+    """
+    from crewai.utilities.converter import Converter, ConverterError
+
+    class DeferredConverter(Converter):
+        def to_pydantic(self, current_attempt=1):
+            return ConverterError("Left to the schema repair pass.")
+
+        def to_json(self, current_attempt=1):
+            return ConverterError("Left to the schema repair pass.")
+
+    return DeferredConverter
+
+
+@lru_cache(maxsize=None)
+def repair_model(schema: Type[BaseModel], names: Tuple[str, ...]) -> Type[BaseModel]:
+    """
+    Model of only the fields `names` of `schema`, the response schema of a repair call.
+    """
+    return create_model(f"{schema.__name__}Repair", **{name: (schema.model_fields[name].annotation, ...) for name in names})
+
+
+def repair(chat_model, schema: Type[BaseModel], text: str, valid: Dict[str, Any], errors: Dict[str, str]) -> Tuple[BaseModel, dict]:
+    """
+    Ask again for the broken fields only, with the model's native structured
+    output, and merge them with the fields that were valid.
+    Args:
+            chat_model: LangChain chat model of an LLMClient.
+            schema: The pydantic model the answer had to match.
+            text (str): The broken answer, shown as context.
+            valid (dict), errors (dict): As returned by validate_fields.
+    Returns:
+            tuple: The complete model and the token usage of the repair call.
+    Raises:
+            StructuredOutputError: If the repaired fields are still invalid.
+    """
+    names = tuple(sorted(errors))
+    fields = repair_model(schema, names)
+    prompt = structured_repair_prompt.format(
+        schema=schema.__name__,
+        errors="\n".join(f"- {name}: {errors[name]}" for name in names),
+        answer=text[:REPAIR_CONTEXT_CHARS],
+    )
+    output = chat_model.with_structured_output(fields, include_raw=True).invoke([("human", prompt)])
+    usage = getattr(output["raw"], "usage_metadata", None) or {}
+    if output["parsed"] is not None:
+        repaired = output["parsed"].model_dump()
+    else:
+        _, repaired, still = parse_output(fields, output["raw"])
+        if still:
+            raise StructuredOutputError(f"Could not repair {schema.__name__} fields {sorted(still)}: {output['parsing_error']}")
+    model, _, still = validate_fields(schema, {**valid, **repaired})
+    if model is None:
+        raise StructuredOutputError(f"Could not repair {schema.__name__} fields {sorted(still)}")
+    return model, usage
@@ -0,0 +1,131 @@
+import os
+import threading
+from functools import lru_cache
+from typing import List, Optional
+import tiktoken
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Expected completion sizes, reserved out of the per-call budget before the prompt is planned.
+EXPANSION_COMPLETION_TOKENS = int(os.getenv("EXPANSION_COMPLETION_TOKENS", 2500))
+PREFACE_COMPLETION_TOKENS = int(os.getenv("PREFACE_COMPLETION_TOKENS", 1000))
+DIGEST_COMPLETION_TOKENS = int(os.getenv("DIGEST_COMPLETION_TOKENS", 300))
+# Finishing nodes: three ~700 word chapters, a bio, a table of contents.
+EXTRAS_COMPLETION_TOKENS = int(os.getenv("EXTRAS_COMPLETION_TOKENS", 3500))
+BIO_COMPLETION_TOKENS = int(os.getenv("BIO_COMPLETION_TOKENS", 400))
+TOC_COMPLETION_TOKENS = int(os.getenv("TOC_COMPLETION_TOKENS", 800))
+# Long-form expansion: the outline, one section, one reworked section opening.
+OUTLINE_COMPLETION_TOKENS = int(os.getenv("OUTLINE_COMPLETION_TOKENS", 800))
+SECTION_COMPLETION_TOKENS = int(os.getenv("SECTION_COMPLETION_TOKENS", 2500))
+TRANSITION_COMPLETION_TOKENS = int(os.getenv("TRANSITION_COMPLETION_TOKENS", 400))
+# Used when a run does not set max_tokens.
+DEFAULT_MAX_TOKENS = int(os.getenv("DEFAULT_MAX_TOKENS", 16000))
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: Optional[str]):
+    try:
+        return tiktoken.encoding_for_model(model or "")
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """
+    Number of tokens `text` takes for `model`, counted locally with tiktoken.
+    """
+    return len(_encoding(model).encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """
+    Cut `text` down to at most `max_tokens` tokens.
+    """
+    enc = _encoding(model)
+    ids = enc.encode(text, disallowed_special=())
+    if len(ids) <= max_tokens:
+        return text
+    return enc.decode(ids[:max(0, max_tokens)])
+
+
+def prompt_budget(max_tokens: int, fixed_prompt: str, completion_tokens: int, model: Optional[str] = None) -> int:
+    """
+    Tokens left for variable content in one call.
+    Args:
+            max_tokens (int): Budget for the whole call, prompt plus completion.
+            fixed_prompt (str): The prompt without the variable content (template, system message).
+            completion_tokens (int): Tokens reserved for the completion.
+    Returns:
+            int: Tokens available for the variable content.
+    Raises:
+            ValueError: If the template and completion alone do not fit in `max_tokens`.
+    """
+    available = max_tokens - count_tokens(fixed_prompt, model) - completion_tokens
+    if available <= 0:
+        raise ValueError(
+            f"max_tokens={max_tokens} leaves no room for content: the prompt template takes "
+            f"{count_tokens(fixed_prompt, model)} tokens and {completion_tokens} are reserved for the completion."
+        )
+    return available
+
+
+def fit_to_budget(parts: List[str], budget: int, model: Optional[str] = None) -> List[str]:
+    """
+    Truncate `parts` so their total token count fits `budget`.
+    Parts shorter than an even share are kept whole and their unused share is
+    handed to the longer parts, which are cut to a common length.
+    Returns:
+            list[str]: The parts, in order, truncated where needed.
+    """
+    sizes = [count_tokens(p, model) for p in parts]
+    if sum(sizes) <= budget:
+        return list(parts)
+
+    remaining = budget
+    caps = [None] * len(parts)
+    order = sorted(range(len(parts)), key=sizes.__getitem__)
+    for n, i in enumerate(order):
+        share = remaining // (len(parts) - n)
+        caps[i] = min(sizes[i], share)
+        remaining -= caps[i]
+    return [truncate_tokens(p, cap, model) for p, cap in zip(parts, caps)]
+
+
+class UsageMeter:
+    """
+    Thread-safe tally of planned and actual token usage for one node of a run.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.estimated_prompt_tokens = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.truncated = 0
+
+    def plan(self, prompt_tokens: int, truncated: bool = False) -> None:
+        with self._lock:
+            self.estimated_prompt_tokens += prompt_tokens
+            self.truncated += int(truncated)
+
+    def record(self, usage: dict) -> None:
+        """
+        Add the actual usage of one call, either crew token_usage
+        (prompt_tokens/completion_tokens) or LangChain usage_metadata (input_tokens/output_tokens).
+        """
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += usage.get("prompt_tokens", usage.get("input_tokens", 0)) or 0
+            self.completion_tokens += usage.get("completion_tokens", usage.get("output_tokens", 0)) or 0
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "estimated_prompt_tokens": self.estimated_prompt_tokens,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "truncated_prompts": self.truncated,
+            }
@@ -1,115 +1,298 @@
 import os
 import json
-import pandas as pd
 import logging
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 import random
+from functools import lru_cache
 from itertools import combinations
-from typing import List, Set, Tuple
+from typing import TYPE_CHECKING, List, Optional, Sequence, Set, Tuple
 from states import Chapter, Book
 from dotenv import load_dotenv
 
 load_dotenv()
 
+if TYPE_CHECKING:
+    import numpy as np
+
+# Service account key of every Google client: gspread, Docs and the Sheets reader (sheets.py).
+GOOGLE_CREDENTIALS = os.getenv("GOOGLE_CREDENTIALS", "cred.json")
+
 # Define the scope
 scope = [
     "https://spreadsheets.google.com/feeds",
     "https://www.googleapis.com/auth/drive",
+    "https://www.googleapis.com/auth/documents",
 ]
 
-# Authenticate using the JSON key file
-creds = ServiceAccountCredentials.from_json_keyfile_name("cred.json", scope)
-client = gspread.authorize(creds)
+
+@lru_cache(maxsize=None)
+def google_credentials():
+    """
+    Load the JSON key file, on first use rather than at import.
+    """
+    from google.oauth2.service_account import Credentials
+
+    return Credentials.from_service_account_file(GOOGLE_CREDENTIALS, scopes=scope)
+
+
+@lru_cache(maxsize=None)
+def sheets_client():
+    import gspread
+
+    return gspread.authorize(google_credentials())
+
+
+@lru_cache(maxsize=None)
+def docs_service():
+    """
+    Google Docs API client, used by the "google" output sink.
+    """
+    from googleapiclient.discovery import build
+
+    return build("docs", "v1", credentials=google_credentials(), cache_discovery=False)
 
 SHEET_ID = os.getenv("SHEET_ID")
 
 
-def excel_to_json(file_path):
+def read_google_sheet(sheet_id) -> List[Chapter]:
+    """
+    Read the chapters of a Google Sheet (needs GOOGLE_CREDENTIALS).
+    Returns:
+            List[Chapter]: The valid chapters, invalid rows are skipped.
+    """
+    from sources import GoogleSheetSource
+
+    return list(GoogleSheetSource(sheet_id).read().chapters())
+
+def max_achievable_docs(n: int, r: int, max_overlap: int) -> int:
     """
-    Convert an Excel file to a JSON file.
+    Upper bound on the number of distinct `r`-chapter books that can be drawn from
+    `n` chapters when no two books share more than `max_overlap` chapters
+    (Johnson bound for constant-weight packings).
+
     Args:
-            file_path (str): The path to the Excel file.
+        n: Number of available chapters.
+        r: Number of chapters per book.
+        max_overlap: Maximum number of overlapping chapters allowed between any pair of books.
+
     Returns:
-            str: The generated JSON.
+        The largest `max_docs` that could possibly be satisfied.
     """
-    # Read the Excel file
-    df = pd.read_excel(file_path)
-    json_data = df.to_json(orient="columns")
-    return json_data
+    if r > n or max_overlap >= r:
+        return 0
+    bound = 1
+    for i in range(max_overlap, -1, -1):
+        bound = (n - i) * bound // (r - i)
+    return bound
+
 
-def read_google_sheet(sheet_id):
+def pack_chapter_indices(
+    n: int, r: int, max_docs: int, max_overlap: int, seed: int = 0
+) -> List[List[int]]:
     """
-    Read a Google Sheet and convert it to JSON (needs cred.json).
+    Greedily pack up to `max_docs` sets of `r` chapter indices out of `range(n)`,
+    no two sets sharing more than `max_overlap` indices.
+
+    Chapters are tried least-used first (ties broken by a seeded shuffle), so the
+    result is deterministic for a given seed and spreads chapters evenly across books.
+    Overlap is tracked with one bitset per chapter (the books it already belongs to)
+    plus a `saturated` bitset of books that cannot take another shared chapter, so
+    checking a candidate is a single AND instead of a scan over all books.
+
+    Args:
+        n: Number of available chapters.
+        r: Number of chapters per book.
+        max_docs: Number of sets to pack.
+        max_overlap: Maximum number of overlapping chapters allowed between any pair of sets.
+        seed: Seed for tie-breaking between equally used chapters.
+
     Returns:
-            str: The generated JSON.
-    """
-    # sheet = client.open("BookExample").sheet1
-    sheet = client.open_by_key(sheet_id).sheet1
-
-    data = sheet.get_all_records()
-    chapters = []
-    given_chasps = []
-    for row in data:
-        try:
-            given_chasps.append(row)
-            chapter = Chapter(**row)
-            chapters.append(chapter)
-        except Exception as e:
-            print(f"Skipping invalid row: {row} - Error: {e}")
-    # print("read_data_util:\n",chapters)
-    return chapters
+        List of sorted index lists. May be shorter than `max_docs` if the greedy packing runs out.
+    """
+    rng = random.Random(seed)
+    order = list(range(n))
+    rng.shuffle(order)
 
-def generate_books_with_limited_overlap1(
-    chapters: List[Chapter], r: int = 3, max_docs: int = 3, max_overlap: int = 1
-) -> List[Book]:
+    usage = [0] * n
+    books_of = [0] * n  # chapter -> bitset of books containing it
+    packed: List[List[int]] = []
+
+    while len(packed) < max_docs:
+        # With max_overlap == 0 every existing book is saturated from the start.
+        saturated = (1 << len(packed)) - 1 if max_overlap == 0 else 0
+        overlap_count = {}
+        chosen: List[int] = []
+
+        order.sort(key=usage.__getitem__)  # stable: keeps the seeded order among ties
+        for c in order:
+            if books_of[c] & saturated:
+                continue
+            chosen.append(c)
+            mask = books_of[c]
+            while mask:
+                low = mask & -mask
+                j = low.bit_length() - 1
+                overlap_count[j] = overlap_count.get(j, 0) + 1
+                if overlap_count[j] >= max_overlap:
+                    saturated |= low
+                mask ^= low
+            if len(chosen) == r:
+                break
+
+        if len(chosen) < r:
+            break
+
+        bit = 1 << len(packed)
+        for c in chosen:
+            usage[c] += 1
+            books_of[c] |= bit
+        packed.append(sorted(chosen))
+
+    return packed
+
+
+def pack_diverse_indices(
+    vectors: "np.ndarray", r: int, max_docs: int, max_overlap: int, max_similarity: float, seed: int = 0
+) -> List[List[int]]:
     """
-    Generate `max_docs` Book objects with `r` Chapters each,
-    ensuring no two books share more than `max_overlap` chapters.
+    Like `pack_chapter_indices`, with near-duplicate chapters treated as the same
+    chapter: no two chapters of a book are more similar than `max_similarity`,
+    and a chapter counts towards the overlap with every book holding it or a
+    chapter more similar to it than `max_similarity`.
+
+    Each pick costs one matrix-vector product: the chapters too similar to it
+    are added to the book's `near` row, a boolean vector over all chapters, so a
+    candidate is checked against the current book and every earlier one with
+    two lookups instead of comparing chapter pairs.
+
+    Args:
+        vectors: Normalized chapter embeddings, one row per chapter (see embeddings.embed_texts).
+        r: Number of chapters per book.
+        max_docs: Number of sets to pack.
+        max_overlap: Maximum number of overlapping chapters allowed between any pair of sets.
+        max_similarity: Cosine similarity above which two chapters count as the same.
+        seed: Seed for tie-breaking between equally used chapters.
+
+    Returns:
+        List of sorted index lists. May be shorter than `max_docs` if the greedy packing runs out.
+    """
+    import numpy as np
+    from embeddings import cosine_similarity
+
+    n = len(vectors)
+    rng = random.Random(seed)
+    order = list(range(n))
+    rng.shuffle(order)
+    order = np.array(order, dtype=np.int64)
+
+    usage = np.zeros(n, dtype=np.int64)
+    near = np.zeros((max_docs, n), dtype=bool)  # book -> chapters it holds or nearly holds
+    packed: List[List[int]] = []
+
+    while len(packed) < max_docs:
+        b = len(packed)
+        overlap_count = np.zeros(b, dtype=np.int64)
+        saturated = np.full(b, max_overlap == 0)
+        blocked = np.zeros(n, dtype=bool)
+        chosen: List[int] = []
+
+        order = order[np.argsort(usage[order], kind="stable")]  # keeps the seeded order among ties
+        for c in order:
+            shared = near[:b, c]
+            if blocked[c] or (shared & saturated).any():
+                continue
+            chosen.append(int(c))
+            blocked |= cosine_similarity(vectors, vectors[c:c + 1])[:, 0] > max_similarity
+            blocked[c] = True
+            overlap_count += shared
+            saturated |= overlap_count >= max(max_overlap, 1)
+            if len(chosen) == r:
+                break
+
+        if len(chosen) < r:
+            break
+
+        near[b] = blocked
+        usage[chosen] += 1
+        packed.append(sorted(chosen))
+
+    return packed
+
+
+def select_book_indices(
+    n: int, r: int = 3, max_docs: int = 3, max_overlap: int = 1, seed: int = 0,
+    vectors: Optional["np.ndarray"] = None, max_similarity: float = 1.0,
+) -> List[List[int]]:
+    """
+    Pick the chapters of `max_docs` books of `r` chapters out of `n`, no two books
+    sharing more than `max_overlap` chapters. Books are built constructively with
+    `pack_chapter_indices`, so the same inputs and seed always give the same books.
+    Given chapter embeddings, they are built with `pack_diverse_indices` instead,
+    so chapters more similar than `max_similarity` count as the same chapter,
+    within and across books.
 
     Args:
-        chapters: List of Chapter Pydantic objects.
+        n: Number of available chapters.
         r: Number of chapters per book.
         max_docs: Total number of books to generate.
         max_overlap: Maximum number of overlapping chapters allowed between any pair of books.
+        seed: Seed for the packing order.
+        vectors: Normalized chapter embeddings, one row per chapter, for the semantic constraint.
+        max_similarity: Cosine similarity above which two chapters count as the same.
 
     Returns:
-        List of `Book` objects.
+        The chapter indices of every book.
 
     Raises:
-        RuntimeError: If unable to generate enough valid books under constraints.
+        ValueError: If `max_docs` exceeds what is achievable for the catalog size.
+        RuntimeError: If the greedy packing could not reach `max_docs` books.
     """
-    if r > len(chapters):
+    if r > n:
         raise ValueError("r cannot be greater than the number of available chapters")
     if max_overlap >= r:
         raise ValueError("max_overlap must be less than r")
 
-    books: List[Book] = []
-    used_chapter_sets: List[Set[int]] = []
-    chapter_indices = list(range(len(chapters)))
+    achievable = max_achievable_docs(n, r, max_overlap)
+    if max_docs > achievable:
+        raise ValueError(
+            f"At most {achievable} books of {r} chapters can be built from {n} chapters "
+            f"with max_overlap={max_overlap}, but max_docs={max_docs} was requested."
+        )
 
-    attempts = 0
-    max_attempts = 5
+    if vectors is None:
+        packed = pack_chapter_indices(n, r, max_docs, max_overlap, seed=seed)
+    else:
+        packed = pack_diverse_indices(vectors, r, max_docs, max_overlap, max_similarity, seed=seed)
+    if len(packed) < max_docs:
+        raise RuntimeError(
+            f"Only generated {len(packed)} books with the required overlap constraint "
+            f"(upper bound is {achievable}). "
+            f"Try increasing the total number of chapters, decreasing r, or increasing max_overlap"
+            + (" or max_similarity." if vectors is not None else ".")
+        )
+    return packed
 
-    while len(books) < max_docs and attempts < max_attempts:
-        candidate_indices = set(random.sample(chapter_indices, r))
 
-        # Ensure overlap constraint is satisfied with all existing books
-        if all(
-            len(candidate_indices & used) <= max_overlap for used in used_chapter_sets
-        ):
-            selected_chapters = [chapters[i] for i in candidate_indices]
-            book_title = f"Book {len(books) + 1}"
-            books.append(Book(book_title=book_title, chapters=selected_chapters))
-            used_chapter_sets.append(candidate_indices)
+def generate_books_with_limited_overlap1(
+    chapters: Sequence[Chapter], r: int = 3, max_docs: int = 3, max_overlap: int = 1, seed: int = 0,
+    vectors: Optional["np.ndarray"] = None, max_similarity: float = 1.0,
+) -> List[Book]:
+    """
+    Generate `max_docs` Book objects with `r` Chapters each,
+    ensuring no two books share more than `max_overlap` chapters
+    (see `select_book_indices`).
 
-        attempts += 1
+    Args:
+        chapters: Chapter Pydantic objects, a list or a ChapterCatalog that builds them on access.
+        r, max_docs, max_overlap, seed, vectors, max_similarity: As for `select_book_indices`.
 
-    if len(books) < max_docs:
-        raise RuntimeError(
-            f"Only generated {len(books)} books with the required overlap constraint. "
-            f"Try increasing the total number of chapters, decreasing r, or increasing max_overlap."
-        )
+    Returns:
+        List of `Book` objects.
+    """
+    packed = select_book_indices(len(chapters), r, max_docs, max_overlap, seed, vectors, max_similarity)
+    books: List[Book] = []
+    for indices in packed:
+        book_title = f"Book {len(books) + 1}"
+        books.append(Book(book_title=book_title, chapters=[chapters[i] for i in indices]))
     # print("overlap:\n", books)
     return books
 
@@ -1,6 +1,55 @@
-def main():
-    print("Hello from bookeditor!")
+# Run many book jobs from one manifest in a single process (or a few), sharing the
+# compiled graph, LLM clients and rate limits, caches and the LLM concurrency budget,
+# instead of launching Graph/main.py once per sheet. See Graph/manifest.py for the format.
+# Example:
+#   python main.py jobs.json --jobs 8 --llm-concurrency 32
+#   python main.py jobs.jsonl --processes 4 --jobs 4 --quiet --json report.json
+import os
+import sys
+import json
+import time
+import argparse
+
+# The graph modules import each other by their flat names.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "Graph"))
+
+
+def main() -> int:
+    from jobs import JOB_CONCURRENCY
+    from manifest import load_manifest, run_manifest, summary
+
+    parser = argparse.ArgumentParser(description="Generate the books of every job in a manifest.")
+    parser.add_argument("manifest", help="JSON or JSONL file of jobs (sheet_id or file, r_chapters, max_docs, max_overlap, output_lang, ...)")
+    parser.add_argument("--jobs", type=int, default=JOB_CONCURRENCY, help="jobs running at the same time, per process")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes, jobs are split between them")
+    parser.add_argument("--llm-concurrency", type=int, help="LLM calls in flight across all jobs of a process (default: per job max_concurrency)")
+    parser.add_argument("--quiet", action="store_true", help="hide the nodes' own output")
+    parser.add_argument("--json", help="also write the per-job results and the summary to this file")
+    args = parser.parse_args()
+
+    try:
+        jobs = load_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    def report(result: dict) -> None:
+        line = f"{result['status'].upper():<9} {result['name']}: {result['books']} books in {result['seconds']}s"
+        print(line + (f" - {result['error']}" if result["error"] else ""), flush=True)
+
+    t0 = time.perf_counter()
+    results = run_manifest(jobs, args.jobs, args.processes, args.llm_concurrency, args.quiet, on_result=report)
+    totals = summary(results, time.perf_counter() - t0)
+    print(
+        f"{totals['succeeded']}/{totals['jobs']} jobs succeeded, {totals['books']} books in {totals['wall_seconds']}s "
+        f"({totals['books_per_hour']} books/h), {totals['llm_calls']} LLM calls, "
+        f"{totals['prompt_tokens'] + totals['completion_tokens']} tokens, ~${totals['estimated_cost_usd']}"
+    )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"jobs": results, "summary": totals}, f, indent=2)
+        print(f"Report written to {args.json}")
+    return 0 if totals["failed"] == 0 else 1
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
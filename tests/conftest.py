@@ -0,0 +1,28 @@
+# The Graph modules read their configuration from the environment at import, so the
+# test run is pointed at the fake LLM backend and a scratch directory before any of
+# them is imported.
+import os
+import tempfile
+
+WORKDIR = tempfile.mkdtemp(prefix="bookeditor-tests-")
+
+os.environ.update(
+    LLM_BACKEND="fake",
+    FAKE_LLM_LATENCY="0",
+    CHECKPOINT_DB=os.path.join(WORKDIR, "checkpoints.sqlite"),
+    EXPANSION_CACHE_PATH=os.path.join(WORKDIR, "expansions.sqlite"),
+    OUTPUT_DIR=os.path.join(WORKDIR, "output"),
+    BLOB_DIR=os.path.join(WORKDIR, "blobs"),
+    RUN_REPORT_DIR=os.path.join(WORKDIR, "reports"),
+    BATCH_DIR=os.path.join(WORKDIR, "batches"),
+    BATCH_COLLECT_SECONDS="0.2",
+    BATCH_POLL_SECONDS="0.05",
+    BATCH_STANDIN_DELAY="0.05",
+    PRELOAD_GRAPH="0",
+    OTEL_SDK_DISABLED="true",
+    CREWAI_DISABLE_TELEMETRY="true",
+)
+
+# server.py serves ./static, relative to the working directory.
+os.makedirs(os.path.join(WORKDIR, "static"), exist_ok=True)
+os.chdir(WORKDIR)
@@ -0,0 +1,119 @@
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import uvicorn
+
+import batch
+import batch_server
+from batch import BatchClient, BatchError, chat_request, complete, get_batch_client
+from states import Bio
+
+
+@pytest.fixture(scope="module")
+def standin_url():
+    """batch_server.py served on a free local port."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(batch_server.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{port}/v1"
+    server.should_exit = True
+    thread.join()
+
+
+@pytest.fixture
+def standin(standin_url, monkeypatch):
+    monkeypatch.setattr(batch, "OPENAI_BATCH_BASE_URL", standin_url)
+    # A client of its own per test, so batches of earlier tests are not shared.
+    monkeypatch.setattr(batch, "_clients", batch.OrderedDict())
+    return batch_server
+
+
+def test_concurrent_requests_are_collected_into_one_batch(standin):
+    client = get_batch_client("sk-test")
+    batches_before = len(standin.batches)
+    bodies = [chat_request([{"role": "user", "content": f"Chapter {i}"}], model="gpt-4o") for i in range(6)]
+    bodies.append(chat_request([{"role": "user", "content": "Bio"}], model="gpt-4o", schema=Bio))
+
+    with ThreadPoolExecutor(len(bodies)) as pool:
+        results = list(pool.map(lambda body: complete(client, body), bodies))
+
+    assert len(standin.batches) == batches_before + 1
+    assert [str(r).endswith(f"Chapter {i}") for i, r in enumerate(results[:6])] == [True] * 6
+    assert results[-1].json_dict == {"bio": "Stand-in bio."}
+    assert results[0].token_usage["total_tokens"] > 0
+
+
+def test_full_batch_is_sent_without_waiting(standin):
+    client = BatchClient(get_batch_client("sk-test").client, collect_seconds=60, max_requests=2)
+    futures = [client.submit(chat_request([{"role": "user", "content": "x"}], model="gpt-4o")) for _ in range(2)]
+    assert all(f.result(timeout=10) for f in futures)
+
+
+def test_failed_requests_raise_batch_error(standin, monkeypatch):
+    monkeypatch.setattr(standin, "BATCH_STANDIN_FAIL_TEXT", "broken")
+    client = get_batch_client("sk-test")
+    ok = client.submit(chat_request([{"role": "user", "content": "fine"}], model="gpt-4o"))
+    failed = client.submit(chat_request([{"role": "user", "content": "broken"}], model="gpt-4o"))
+    assert ok.result(timeout=10)
+    with pytest.raises(BatchError):
+        failed.result(timeout=10)
+
+
+def test_batch_clients_are_bounded_and_keyed_by_hash(monkeypatch):
+    monkeypatch.setattr(batch, "_clients", batch.OrderedDict())
+    monkeypatch.setattr(batch, "BATCH_CLIENTS", 2)
+    first = get_batch_client("sk-one")
+    second = get_batch_client("sk-two")
+    assert get_batch_client("sk-one") is first
+    get_batch_client("sk-three")
+
+    # sk-two was the least recently used.
+    assert len(batch._clients) == 2
+    assert not any(key.startswith("sk-") for key in batch._clients)
+    assert get_batch_client("sk-one") is first
+    assert get_batch_client("sk-two") is not second
+
+
+def test_failed_batch_run_resumes_from_its_checkpoint(standin, monkeypatch):
+    from graph import graph, resume
+    from jobs import build_input
+
+    thread_id = str(uuid.uuid4())
+    config = {"configurable": {"thread_id": thread_id}}
+    payload = {
+        "sheet_id": "fake:5", "gpt_prompt": "x", "mode": "p", "output_lang": "en", "output_format": "none",
+        "max_docs": 1, "max_overlap": 1, "r_chapters": 3, "engine": "batch", "openai_api_key": "sk-test",
+    }
+    # The chapters expand, then the preface request of the book fails.
+    monkeypatch.setattr(standin, "BATCH_STANDIN_FAIL_TEXT", "You are a preface writer")
+    with pytest.raises(BatchError):
+        graph.invoke(build_input(payload), config)
+    batches_before = len(standin.batches)
+    expanded = standin_requests(standin, "Expand the following chapter")
+    digested = standin_requests(standin, "Write a compact digest")
+
+    monkeypatch.setattr(standin, "BATCH_STANDIN_FAIL_TEXT", "")
+    output = resume(thread_id)
+
+    assert len(output["books_generated"]) == 1
+    assert len(standin.batches) > batches_before
+    # The chapters expanded before the failure are not sent again.
+    assert expanded and digested
+    assert standin_requests(standin, "Expand the following chapter") == expanded
+    assert standin_requests(standin, "Write a compact digest") == digested
+
+
+def standin_requests(standin, text: str) -> int:
+    """Requests received by the stand-in whose body contains `text`."""
+    with standin.lock:
+        inputs = [standin.files[b["input_file_id"]]["content"].decode("utf-8") for b in standin.batches.values()]
+    return sum(text in line for content in inputs for line in content.splitlines())
@@ -0,0 +1,35 @@
+from blobs import get_blob_store
+from cache import get_expansion_cache
+from checkpoint import chapter_journal, checkpointer, sweep_blobs
+
+
+def test_sweep_keeps_referenced_blobs_and_deletes_the_rest():
+    store = get_blob_store()
+    orphan = store.put("orphan " * 100)
+    cached = store.put("cached " * 100)
+    journaled = store.put("journaled " * 100)
+    get_expansion_cache().set("sweep-test", {"chapter_title": "t", "expanded_content": cached})
+    chapter_journal.record("sweep-test", "chapter", {"expanded_content": journaled})
+
+    # Unreferenced but just stored: kept for the grace period.
+    sweep_blobs()
+    assert store.exists(orphan)
+
+    result = sweep_blobs(min_age=0)
+    assert not store.exists(orphan)
+    assert store.exists(cached) and store.exists(journaled)
+    assert result["deleted"] >= 1
+
+
+def test_sweep_keeps_blobs_of_checkpoints():
+    from fastapi.testclient import TestClient
+    from server import app
+
+    with TestClient(app) as client:
+        client.post("/stream", json={"sheet_id": "fake:4", "gpt_prompt": "x", "mode": "p", "output_lang": "en",
+                                     "output_format": "none", "max_docs": 1, "max_overlap": 1, "r_chapters": 2})
+    sweep_blobs(min_age=0)
+
+    checkpointed = checkpointer.refs()
+    assert checkpointed
+    assert all(get_blob_store().exists(ref) for ref in checkpointed)
@@ -0,0 +1,25 @@
+import os
+import subprocess
+import sys
+
+from checkpoint import DurableSqliteSaver, LazyConnection
+
+GRAPH_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Graph")
+
+
+def test_importing_the_graph_creates_no_files(tmp_path):
+    env = {k: v for k, v in os.environ.items() if k not in ("CHECKPOINT_DB", "EXPANSION_CACHE_PATH", "BLOB_DIR")}
+    env["PYTHONPATH"] = GRAPH_DIR
+    subprocess.run([sys.executable, "-c", "import graph"], cwd=tmp_path, env=env, check=True)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_connections_open_on_first_use(tmp_path):
+    path = tmp_path / "db" / "checkpoints.sqlite"
+    saver = DurableSqliteSaver(str(path))
+    table = LazyConnection(str(path), "CREATE TABLE t (x INTEGER);")
+    assert not path.parent.exists()
+
+    assert saver.get_tuple({"configurable": {"thread_id": "none"}}) is None
+    assert table.get().execute("SELECT COUNT(*) FROM t").fetchone() == (0,)
+    assert table.get() is table.get()
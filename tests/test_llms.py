@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+
+import pytest
+
+import llms
+from llms import LLMClient, LLMRouter
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def client(name: str) -> LLMClient:
+    return LLMClient(name, chat_model=None, crew_llm=SimpleNamespace(model="gpt-4o"), rpm=1000, tpm=10**7)
+
+
+def failing(status_code):
+    def call(c):
+        raise StatusError(status_code)
+
+    return call
+
+
+@pytest.fixture(autouse=True)
+def long_cooldown(monkeypatch):
+    # Long enough for a cooled-down client to still be unhealthy when checked.
+    monkeypatch.setattr(llms, "LLM_COOLDOWN_SECONDS", 30)
+
+
+def test_rate_limited_call_falls_back_to_the_next_client():
+    a, b = client("a"), client("b")
+    router = LLMRouter([a, b])
+
+    def call(c):
+        if c is a:
+            raise StatusError(429)
+        return c.name
+
+    assert router.run(call) == "b"
+    assert a.failures == 1 and not a.healthy(llms.time.monotonic())
+    assert a.stats == {"calls": 1, "errors": 1, "rate_limited": 1, "fallbacks": 1}
+    assert b.stats == {"calls": 1, "errors": 0, "rate_limited": 0, "fallbacks": 0}
+
+
+def test_non_retryable_error_keeps_the_client_failure_state():
+    a = client("a")
+    router = LLMRouter([a])
+    a.failures = 2
+    a.cooldown_until = 0.0
+
+    with pytest.raises(StatusError):
+        router.run(failing(400))
+
+    # A bad request is no sign of health: the failures before it still count.
+    assert a.failures == 2
+    assert a.stats == {"calls": 1, "errors": 1, "rate_limited": 0, "fallbacks": 0}
+    assert router.run(lambda c: "ok") == "ok"
+    assert a.failures == 0
+
+
+def test_last_attempt_is_not_counted_as_a_fallback():
+    a = client("a")
+    router = LLMRouter([a], max_attempts=1)
+    with pytest.raises(StatusError):
+        router.run(failing(503))
+    assert a.stats["fallbacks"] == 0 and a.failures == 1
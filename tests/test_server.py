@@ -0,0 +1,44 @@
+import json
+
+from fastapi.testclient import TestClient
+
+from server import app
+
+
+def read_events(response):
+    events = []
+    for block in response.text.split("\n\n"):
+        if not block.strip():
+            continue
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_stream_runs_the_graph_to_done():
+    payload = {
+        "sheet_id": "fake:6",
+        "gpt_prompt": "x",
+        "mode": "p",
+        "output_lang": "en",
+        "output_format": "markdown",
+        "max_docs": 2,
+        "max_overlap": 1,
+        "r_chapters": 3,
+        "max_tokens": 16000,
+    }
+    with TestClient(app) as client:
+        response = client.post("/stream", json=payload)
+
+    events = read_events(response)
+    names = [name for name, _ in events]
+    assert names[0] == "started"
+    assert names[-1] == "done", events[-1]
+    assert "error" not in names
+    assert {"read_sheet", "generate_combinations"} <= {data["node"] for name, data in events if name == "node_finished"}
+    assert "book_written" in names
+
+    # Nodes are attributed to the run's thread, read from the injected config.
+    done = events[-1][1]
+    assert done["thread_id"] == events[0][1]["thread_id"]
+    assert done["report"]["nodes"]["generate_book"]["llm_calls"] > 0
@@ -0,0 +1,71 @@
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import sheets_server
+from sheets import SheetsReader
+
+
+@pytest.fixture
+def standin(tmp_path, monkeypatch):
+    """sheets_server.py serving the CSV files of tmp_path/sheets, with its call counters reset."""
+    monkeypatch.setattr(sheets_server, "SHEETS_STANDIN_DIR", str(tmp_path / "sheets"))
+    monkeypatch.setattr(sheets_server, "calls", dict.fromkeys(sheets_server.calls, 0))
+    (tmp_path / "sheets" / "book").mkdir(parents=True)
+    write_csv(tmp_path / "sheets" / "chapters.csv", [("One", "First chapter.")])
+    write_csv(tmp_path / "sheets" / "book" / "Intro.csv", [("Intro", "Intro text.")])
+    write_csv(tmp_path / "sheets" / "book" / "Main.csv", [("Main", "Main text.")])
+    return tmp_path / "sheets"
+
+
+def write_csv(path, rows, mtime_ns=None):
+    path.write_text("chapter_title,chapter_content\n" + "".join(f"{t},{c}\n" for t, c in rows), encoding="utf-8")
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def reader(tmp_path) -> SheetsReader:
+    return SheetsReader(
+        session=TestClient(sheets_server.app),
+        sheets_api="http://testserver/v4",
+        drive_api="http://testserver/drive/v3",
+        cache_dir=str(tmp_path / "cache"),
+    )
+
+
+def test_unchanged_sheet_is_read_from_the_local_copy(standin, tmp_path):
+    sheets = reader(tmp_path)
+    first = sheets.read("chapters")["Sheet1"]
+    second = sheets.read("chapters")["Sheet1"]
+
+    assert first.equals(second) and first["chapter_title"].tolist() == ["One"]
+    assert sheets.stats == {"version_checks": 2, "downloads": 1, "cache_hits": 1}
+    assert sheets_server.calls == {"files.get": 2, "spreadsheets.get": 1, "values.batchGet": 1}
+
+    # Another process (a new reader) uses the same local copy.
+    assert reader(tmp_path).read("chapters")["Sheet1"].equals(first)
+    assert sheets_server.calls["values.batchGet"] == 1
+
+
+def test_edited_sheet_is_downloaded_again(standin, tmp_path):
+    sheets = reader(tmp_path)
+    sheets.read("chapters")
+    path = standin / "chapters.csv"
+    write_csv(path, [("One", "First chapter."), ("Two", "Second chapter.")], mtime_ns=os.stat(path).st_mtime_ns + 10**9)
+
+    assert sheets.read("chapters")["Sheet1"]["chapter_title"].tolist() == ["One", "Two"]
+    assert sheets.stats["downloads"] == 2 and sheets.stats["cache_hits"] == 0
+
+
+def test_named_worksheets_come_in_one_batch_and_only_missing_ones_are_fetched(standin, tmp_path):
+    sheets = reader(tmp_path)
+    result = sheets.read_many(["book#Intro,Main"])["book#Intro,Main"]
+
+    assert list(result) == ["Intro", "Main"]
+    assert sheets_server.calls["values.batchGet"] == 1
+    assert sheets_server.calls["spreadsheets.get"] == 0
+
+    # The first worksheet needs the titles, the worksheet itself is already cached.
+    assert list(sheets.read("book")) == ["Intro"]
+    assert sheets_server.calls == {"files.get": 2, "spreadsheets.get": 1, "values.batchGet": 1}
@@ -0,0 +1,20 @@
+import os
+
+from blobs import get_blob_store, is_ref
+from states import ChapterCatalog
+
+
+def test_catalog_contents_are_stored_as_one_blob():
+    titles = [f"Chapter {i}" for i in range(50)]
+    contents = [f"Content of chapter {i}. " * 40 for i in range(50)]
+    catalog = ChapterCatalog(titles=titles, contents=contents)
+
+    assert is_ref(catalog.contents)
+    assert os.path.exists(get_blob_store().path(catalog.contents))
+    assert list(catalog.texts()) == list(zip(titles, contents))
+    assert catalog[3].content == contents[3]
+
+    # As restored from a checkpoint: the reference is kept and read back on use.
+    restored = ChapterCatalog.model_validate(catalog.model_dump())
+    assert restored.contents == catalog.contents
+    assert restored[49].content == contents[49]
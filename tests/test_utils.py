@@ -0,0 +1,68 @@
+from itertools import combinations
+
+import numpy as np
+
+import embeddings
+from embeddings import normalize, openai_embeddings
+from nodes import similarity_threshold
+from utils import pack_chapter_indices, pack_diverse_indices
+
+
+def unit(*rows):
+    return normalize(np.array(rows, dtype=np.float32))
+
+
+def check_books(books, r, max_overlap):
+    for book in books:
+        assert len(book) == r and len(set(book)) == r and book == sorted(book)
+    for a, b in combinations(books, 2):
+        assert len(set(a) & set(b)) <= max_overlap
+
+
+def test_distinct_chapters_pack_like_pack_chapter_indices():
+    vectors = np.eye(12, dtype=np.float32)
+    books = pack_diverse_indices(vectors, r=3, max_docs=6, max_overlap=1, max_similarity=0.85, seed=7)
+
+    assert books == pack_diverse_indices(vectors, r=3, max_docs=6, max_overlap=1, max_similarity=0.85, seed=7)
+    assert len(books) == len(pack_chapter_indices(12, r=3, max_docs=6, max_overlap=1, seed=7))
+    check_books(books, r=3, max_overlap=1)
+
+
+def test_near_duplicates_never_share_a_book_and_count_as_overlap():
+    # Chapters 0 and 1 are near-duplicates, 2 to 5 are distinct.
+    vectors = unit([1, 0.05, 0, 0, 0], [1, 0, 0, 0, 0], [0, 1, 0, 0, 0], [0, 0, 1, 0, 0], [0, 0, 0, 1, 0], [0, 0, 0, 0, 1])
+    books = pack_diverse_indices(vectors, r=2, max_docs=10, max_overlap=0, max_similarity=0.9)
+
+    check_books(books, r=2, max_overlap=0)
+    assert not any({0, 1} <= set(book) for book in books)
+    # With no overlap allowed, 0 and 1 are one chapter: 5 distinct chapters make 2 books.
+    assert len(books) == 2
+
+
+def test_max_similarity_zero_only_keeps_dissimilar_chapters_together():
+    orthogonal = np.eye(4, dtype=np.float32)
+    assert len(pack_diverse_indices(orthogonal, r=2, max_docs=2, max_overlap=0, max_similarity=0.0)) == 2
+
+    # Every pair is slightly similar, so with 0.0 no two chapters can share a book.
+    similar = unit([1, 0.1, 0.1, 0.1], [0.1, 1, 0.1, 0.1], [0.1, 0.1, 1, 0.1], [0.1, 0.1, 0.1, 1])
+    assert pack_diverse_indices(similar, r=2, max_docs=2, max_overlap=1, max_similarity=0.0) == []
+    assert len(pack_diverse_indices(similar, r=2, max_docs=2, max_overlap=1, max_similarity=0.5)) == 2
+
+
+def test_similarity_threshold_keeps_an_explicit_zero():
+    assert similarity_threshold({"max_similarity": 0.0}) == 0.0
+    assert similarity_threshold({"max_similarity": 0.5}) == 0.5
+    assert similarity_threshold({}) == similarity_threshold({"max_similarity": None}) > 0
+
+
+def test_embedding_clients_are_bounded_and_keyed_by_hash(monkeypatch):
+    monkeypatch.setattr(embeddings, "_embedders", embeddings.OrderedDict())
+    monkeypatch.setattr(embeddings, "EMBEDDING_CLIENTS", 2)
+    first = openai_embeddings("sk-one")
+    assert openai_embeddings("sk-one") is first
+    openai_embeddings("sk-two")
+    openai_embeddings("sk-three")
+
+    assert len(embeddings._embedders) == 2
+    assert not any("sk-" in key for key in embeddings._embedders)
+    assert openai_embeddings("sk-one") is not first